@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from download_engine import (
+    get_videos_info, run_download_queue, normalize_media_url, DEFAULT_ENGINE_SETTINGS
+)
+
+DEFAULT_DOWNLOAD_DIR = os.path.join(os.getcwd(), "مجلد_التنزيلات")
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+FINISHED_JOBS_RETENTION = 1000 # عدد المهام المنتهية التي تبقى قابلة للاستعلام قبل حذف الأقدم
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+# --- بداية قسم إدارة المهام ---
+class JobManager:
+    def __init__(self, loop, max_concurrent=4, download_dir=DEFAULT_DOWNLOAD_DIR, settings=None):
+        self.loop = loop
+        self.download_dir = download_dir
+        self.settings = dict(DEFAULT_ENGINE_SETTINGS, **(settings or {}))
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.jobs = {}
+        self._cancel_events = {}
+        self._finished = {} # المهام المنتهية بترتيب انتهائها، لحذف الأقدم بعد تجاوز حد الاحتفاظ
+        self._ids = itertools.count(1)
+        self.subscribers = set()
+
+    def publish(self, event):
+        # يُستدعى من خيط الحدث فقط؛ المشترك البطيء يفقد أحداثاً بدلاً من حجز الذاكرة
+        for subscriber in list(self.subscribers):
+            if subscriber.full():
+                continue
+            subscriber.put_nowait(event)
+
+    def _update(self, job_id, **changes):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.update(changes)
+        self.publish({"type": "job", "job": job})
+        if job["status"] in FINISHED_STATUSES and job_id not in self._finished:
+            self._finished[job_id] = None
+            while len(self._finished) > FINISHED_JOBS_RETENTION:
+                evicted = next(iter(self._finished))
+                del self._finished[evicted]
+                self.jobs.pop(evicted, None)
+                self._cancel_events.pop(evicted, None)
+
+    def _update_threadsafe(self, job_id, **changes):
+        self.loop.call_soon_threadsafe(lambda: self._update(job_id, **changes))
+
+    def submit(self, url, quality="متوسطة", file_type="mp4", subtitles=False, download_dir=None):
+        job_id = str(next(self._ids))
+        self.jobs[job_id] = {
+            "id": job_id, "url": url, "title": None, "status": "queued", "progress": 0,
+            "filename": None, "error": None, "quality": quality, "format": file_type,
+            "subtitles": subtitles, "dir": download_dir or self.download_dir, "created": time.time(),
+        }
+        self._cancel_events[job_id] = threading.Event()
+        self.executor.submit(self._run_job, job_id)
+        self.publish({"type": "job", "job": self.jobs[job_id]})
+        return job_id
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in ("queued", "running"):
+            self._cancel_events[job_id].set()
+            if job["status"] == "queued":
+                self._update(job_id, status="cancelled")
+        return job
+
+    def _run_job(self, job_id):
+        # أي استثناء غير متوقع ينهي المهمة بحالة فشل بدل أن تبقى "running" إلى الأبد
+        try:
+            self._download_job(job_id)
+        except Exception as e:
+            self._update_threadsafe(job_id, status="failed", error=str(e) or type(e).__name__)
+
+    def _download_job(self, job_id):
+        job = self.jobs.get(job_id)
+        cancel_event = self._cancel_events.get(job_id)
+        # مهمة أُلغيت وهي في الانتظار، وربما حُذفت بعد ذلك ضمن المهام المنتهية
+        if job is None or cancel_event is None or cancel_event.is_set():
+            return
+        self._update_threadsafe(job_id, status="running")
+
+        try:
+            normalized = normalize_media_url(job["url"])
+            if normalized and normalized[0][0] == 'video':
+                # رابط مرئية واحدة: لا حاجة لطلب بيانات منفصل قبل التحميل
+                videos = [{"title": normalized[1], "url": normalized[1], "id": normalized[0][1]}]
+                playlist_title = None
+            else:
+                info = get_videos_info(job["url"])
+                videos, playlist_title = info["videos"], info["playlist_title"]
+                self._update_threadsafe(job_id, title=playlist_title or (videos[0]["title"] if videos else None))
+        except Exception as e:
+            self._update_threadsafe(job_id, status="failed", error=str(e))
+            return
+
+        results = []
+        errors = []
+        run_download_queue(videos, job["dir"], job["quality"], job["format"], job["subtitles"],
+                           playlist_title, self.settings, cancel_event,
+                           on_progress=lambda percent, filename: self._update_threadsafe(job_id, progress=percent, filename=filename),
+                           on_error=errors.append,
+                           on_finished=lambda title, success: results.append(success))
+
+        if cancel_event.is_set():
+            status = "cancelled"
+        elif results and all(results):
+            status = "done"
+        else:
+            status = "failed"
+        self._update_threadsafe(job_id, status=status, error="\n".join(errors) or None)
+# --- نهاية قسم إدارة المهام ---
+
+
+# --- بداية قسم خادم HTTP ---
+async def read_request(reader):
+    # يرفع ValueError لطلب مشوّه، فيرد المعالج بـ 400 ويغلق الاتصال
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = b''
+    content_length = int(headers.get('content-length', 0))
+    if content_length < 0:
+        raise ValueError(f"Content-Length سالب: {content_length}")
+    if content_length:
+        body = await reader.readexactly(content_length)
+    return method, urlparse(target).path, headers, body
+
+
+def write_json(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    writer.write((f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                  f"Content-Type: application/json; charset=utf-8\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+
+
+async def stream_events(manager, writer):
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                 b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n")
+    subscriber = asyncio.Queue(maxsize=1000)
+    manager.subscribers.add(subscriber)
+    try:
+        for job in manager.jobs.values():
+            writer.write(f"data: {json.dumps({'type': 'job', 'job': job}, ensure_ascii=False)}\n\n".encode('utf-8'))
+        await writer.drain()
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), timeout=15)
+                writer.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+            except asyncio.TimeoutError:
+                writer.write(b": ping\n\n") # إبقاء الاتصال حياً عبر الوكلاء
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        manager.subscribers.discard(subscriber)
+
+
+def handle_jobs_post(manager, body):
+    payload = json.loads(body or b'{}')
+    if not isinstance(payload, dict):
+        return 400, {"error": "جسم الطلب يجب أن يكون كائن JSON"}
+    urls = payload.get("urls") or ([payload["url"]] if payload.get("url") else [])
+    if not isinstance(urls, list) or not all(isinstance(url, str) and url for url in urls):
+        return 400, {"error": "url يجب أن يكون نصاً و urls قائمة نصوص"}
+    if not urls:
+        return 400, {"error": "يجب تحديد url أو urls"}
+    if payload.get("dir") is not None and not isinstance(payload["dir"], str):
+        return 400, {"error": "dir يجب أن يكون نصاً"}
+    file_type = payload.get("format", "mp4")
+    if file_type not in ("mp4", "mp3"):
+        return 400, {"error": "الصيغة يجب أن تكون mp4 أو mp3"}
+    ids = [manager.submit(url, payload.get("quality", "متوسطة"), file_type,
+                          bool(payload.get("subtitles", False)), payload.get("dir"))
+           for url in urls]
+    return 202, {"ids": ids}
+
+
+async def handle_connection(manager, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ValueError as e:
+                write_json(writer, 400, {"error": f"طلب غير صالح: {e}"}, keep_alive=False)
+                await writer.drain()
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            parts = [part for part in path.split('/') if part]
+
+            try:
+                if parts == ['events'] and method == 'GET':
+                    await stream_events(manager, writer)
+                    break
+                elif parts == ['health']:
+                    status, payload = 200, {"ok": True, "jobs": len(manager.jobs)}
+                elif parts == ['jobs'] and method == 'POST':
+                    status, payload = handle_jobs_post(manager, body)
+                elif parts == ['jobs'] and method == 'GET':
+                    status, payload = 200, {"jobs": list(manager.jobs.values())}
+                elif len(parts) == 2 and parts[0] == 'jobs' and method in ('GET', 'DELETE'):
+                    job = manager.jobs.get(parts[1]) if method == 'GET' else manager.cancel(parts[1])
+                    status, payload = (200, job) if job else (404, {"error": "المهمة غير موجودة"})
+                else:
+                    status, payload = 404, {"error": "المسار غير موجود"}
+            except (ValueError, KeyError) as e:
+                status, payload = 400, {"error": f"طلب غير صالح: {e}"}
+
+            write_json(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, max_concurrent, download_dir, settings=None):
+    manager = JobManager(asyncio.get_running_loop(), max_concurrent, download_dir, settings)
+    server = await asyncio.start_server(lambda r, w: handle_connection(manager, r, w), host, port)
+    print(f"خادم التحميل يعمل على http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+# --- نهاية قسم خادم HTTP ---
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="واجهة HTTP/JSON محلية لمحرك التحميل")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrent", type=int, default=4, help="عدد المهام التي تُحمّل في نفس الوقت")
+    parser.add_argument("--dir", default=DEFAULT_DOWNLOAD_DIR)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.concurrent, args.dir))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
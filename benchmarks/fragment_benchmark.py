@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_engine import load_yt_dlp, build_ydl_opts, run_download_queue
+
+# خادم HLS محلي بديل: كل جزء يتأخر بزمن ثابت يحاكي زمن الذهاب والإياب إلى CDN بعيد
+
+
+class FragmentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        if path.endswith('.m3u8'):
+            body = server.playlist
+            content_type = "application/vnd.apple.mpegurl"
+        elif path.startswith('/frag') and path.endswith('.ts'):
+            time.sleep(server.latency)
+            body = server.fragment
+            content_type = "video/mp2t"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FragmentServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fragments, fragment_size, latency):
+        super().__init__(("127.0.0.1", 0), FragmentHandler)
+        self.latency = latency
+        # حزم TS فارغة (بايت التزامن 0x47) حتى لا يرفضها أي فحص للصيغة
+        self.fragment = (b'\x47' + b'\xff' * 187) * (fragment_size // 188)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for index in range(fragments):
+            lines += ["#EXTINF:4.0,", f"frag{index}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        self.playlist = ("\n".join(lines) + "\n").encode()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def handle_error(self, request, client_address):
+        # yt-dlp يغلق اتصالات keep-alive في نهاية كل تحميل
+        pass
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server_address[1]}/{name}.m3u8"
+
+
+def download_once(url, output_dir, concurrent_fragments):
+    yt_dlp = load_yt_dlp()
+    ydl_opts = build_ydl_opts(output_dir, "متوسطة", "mp4", False, lambda d: None, concurrent_fragments)
+    ydl_opts.update({'format': 'best', 'fixup': 'never', 'hls_prefer_native': True})
+    started = time.perf_counter()
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([url])
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أثر تحميل أجزاء HLS بالتوازي على خادم محلي")
+    parser.add_argument("--fragments", type=int, default=40)
+    parser.add_argument("--fragment-kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.1, help="تأخير كل جزء بالثواني")
+    parser.add_argument("--items", type=int, default=8, help="عدد العناصر في تجربة الضبط التلقائي")
+    args = parser.parse_args(argv)
+
+    server = FragmentServer(args.fragments, args.fragment_kb * 1024, args.latency)
+    total_mb = len(server.fragment) * args.fragments / 1048576
+    output_root = tempfile.mkdtemp(prefix="fragment-bench-")
+    try:
+        print(f"{args.fragments} جزء × {args.fragment_kb} KB، تأخير {args.latency * 1000:.0f}ms لكل جزء")
+        baseline = None
+        for value in (1, 2, 4, 8, 16):
+            output_dir = os.path.join(output_root, f"fixed-{value}")
+            seconds = download_once(server.url(f"fixed{value}"), output_dir, value)
+            baseline = baseline or seconds
+            print(f"أجزاء متزامنة={value:2d}: {seconds:6.2f} ثانية، {total_mb / seconds:6.2f} MB/s، تسريع {baseline / seconds:4.1f}x")
+
+        # الضبط التلقائي عبر طابور كامل يبدأ من جزء واحد
+        videos = [{"title": f"item{index}", "url": server.url(f"item{index}")} for index in range(args.items)]
+        # القيم تُقرأ من رسائل الطابور نفسه عند كل تعديل
+        values = [1]
+
+        def on_log(message):
+            if message.startswith("تعديل عدد الأجزاء المتزامنة إلى"):
+                values.append(int(message.rstrip('.').split()[-1]))
+
+        started = time.perf_counter()
+        run_download_queue(videos, os.path.join(output_root, "adaptive"), "متوسطة", "mp4", False,
+                           settings={"concurrent_fragments": 1, "adaptive_fragments": True, "checksums": False},
+                           on_log=on_log)
+        seconds = time.perf_counter() - started
+        print(f"ضبط تلقائي لـ {args.items} عناصر: {seconds:.2f} ثانية، {total_mb * args.items / seconds:.2f} MB/s، "
+              f"تسلسل القيم: {values}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_root, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
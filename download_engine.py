@@ -0,0 +1,2042 @@
+import os
+import re
+import errno
+import json
+import mmap
+import time
+import datetime
+import random
+import shutil
+import pstats
+import cProfile
+import hashlib
+import itertools
+import contextlib
+import subprocess
+import threading
+import tracemalloc
+import multiprocessing
+from collections import deque
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures, as_completed, FIRST_COMPLETED
+)
+from urllib.parse import urlparse, parse_qs
+
+# --- بداية قسم التحميل الكسول لـ yt-dlp ---
+# استيراد yt-dlp وسجل المستخرجات مكلف، لذا يؤجل إلى أول استخدام أو إلى خيط خلفي بعد ظهور النافذة
+_yt_dlp_module = None
+_yt_dlp_lock = threading.Lock()
+
+
+def load_yt_dlp():
+    global _yt_dlp_module
+    if _yt_dlp_module is None:
+        with _yt_dlp_lock:
+            if _yt_dlp_module is None:
+                import yt_dlp
+                _yt_dlp_module = yt_dlp
+    return _yt_dlp_module
+
+
+def preload_yt_dlp_in_background(on_done=None):
+    def preload():
+        yt_dlp = load_yt_dlp()
+        yt_dlp.extractor.gen_extractor_classes() # تحميل سجل المستخرجات مسبقاً
+        if on_done:
+            on_done()
+
+    thread = threading.Thread(target=preload, daemon=True)
+    thread.start()
+    return thread
+# --- نهاية قسم التحميل الكسول لـ yt-dlp ---
+
+# --- بداية قسم الكائنات المشتركة ---
+# كائن واحد لكل (نوع، مفتاح) في العملية: المزرعة وخادم الـ API يشغلان عدة طوابير متزامنة،
+# فتتقاسم الموالفات والمجمعات وحدود السرعة بدلاً من أن ينشئ كل طابور نسخته
+_shared_objects = {}
+_shared_objects_lock = threading.Lock()
+
+
+def get_shared(kind, key, factory):
+    with _shared_objects_lock:
+        if (kind, key) not in _shared_objects:
+            _shared_objects[(kind, key)] = factory()
+        return _shared_objects[(kind, key)]
+# --- نهاية قسم الكائنات المشتركة ---
+
+# --- بداية قسم منطق التحميل ---
+stop_event = threading.Event()
+
+def reset_stop_event():
+    stop_event.clear()
+
+def stop_download_process():
+    stop_event.set()
+
+def get_format_options(quality, file_type, progressive=False):
+    quality_map = {
+        'منخفضة': 'best[height<=360]',
+        'متوسطة': 'best[height<=720]',
+        'عالية': 'best[height<=1080]/bestvideo[height<=1080]+bestaudio/best'
+    }
+    quality_value_video = quality_map.get(quality, 'best[height<=720]') # الافتراضي متوسطة
+
+    if file_type == 'mp3':
+        # جودة الصوت mp3 ستكون 192kbps بواسطة FFmpeg
+        return 'bestaudio/best'
+    merged_format = f'{quality_value_video}[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+    if progressive:
+        # صيغة مدمجة مسبقاً عبر HTTP تُكتب بترتيب التشغيل، فيمكن تشغيلها قبل اكتمال التحميل
+        height = {'منخفضة': 360, 'متوسطة': 720, 'عالية': 1080}.get(quality, 720)
+        return f'best[height<={height}][ext=mp4][protocol^=http]/best[ext=mp4][protocol^=http]/{merged_format}'
+    # mp4: دمج أفضل مرئية (بالجودة المحددة) مع أفضل صوت
+    return merged_format
+
+
+def get_videos_info(url, max_entries=None):
+    ydl_opts = {
+        "quiet": True,
+        "extract_flat": "in_playlist",
+        "skip_download": True,
+        "simulate": True,
+        "forcejson": True,
+        "no_warnings": True,
+        "socket_timeout": 20, # مهلة للاتصال الأولي
+    }
+    if max_entries:
+        # أول N عناصر فقط (صفحة واحدة غالباً) لفحص التغيير بأقل عدد من الطلبات
+        ydl_opts["playlistend"] = max_entries
+    yt_dlp = load_yt_dlp()
+    videos = []
+    playlist_title_text = None
+
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+
+            if not info:
+                raise Exception("لم يتم العثور على معلومات للمرئية.")
+
+            if 'entries' in info and info['entries']:
+                playlist_title_text = info.get("title", "قائمة تشغيل غير مسماة")
+                for entry in info["entries"]:
+                    if entry:
+                        video_id = entry.get('id')
+                        video_title = entry.get('title', 'مرئية بدون عنوان')
+                        if video_id:
+                             videos.append({
+                                "title": video_title,
+                                "url": f"https://www.youtube.com/watch?v={video_id}",
+                                "id": video_id,
+                                "duration": entry.get('duration')
+                            })
+            elif 'id' in info :
+                video_id = info.get('id')
+                video_title = info.get('title', 'مرئية بدون عنوان')
+                if video_id:
+                    videos.append({
+                        "title": video_title,
+                        "url": info.get('webpage_url', f"https://www.youtube.com/watch?v={video_id}"),
+                        "id": video_id
+                    })
+            else:
+                raise Exception("تنسيق المعلومات غير مدعوم أو الرابط غير صالح.")
+
+            return {
+                "videos": videos,
+                "playlist_title": playlist_title_text
+            }
+    except yt_dlp.utils.DownloadError as e:
+        if "Unsupported URL" in str(e):
+             raise Exception(f"الرابط غير مدعوم: {url}")
+        elif "Video unavailable" in str(e):
+            raise Exception("المرئية غير متاح.")
+        else:
+            raise Exception(f"خطأ في جلب معلومات المرئية: {str(e)}")
+    except Exception as e:
+        raise Exception(f"خطأ غير متوقع في جلب المعلومات: {str(e)}")
+
+
+def sanitize_filename(filename):
+    filename = re.sub(r'[\\/*?:"<>|]', "_", filename)
+    filename = re.sub(r'\s+', " ", filename).strip()
+    if len(filename) > 150:
+        filename = filename[:147] + "..."
+    return filename
+# --- نهاية قسم منطق التحميل ---
+
+# --- بداية قسم الاستيراد الجماعي ---
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+TRACKING_PARAMS = {"si", "feature", "pp", "fbclid", "gclid", "ab_channel"}
+
+
+def normalize_media_url(url):
+    # يحول أي صيغة رابط إلى مفتاح (النوع، المعرف) ورابط قانوني، أو None لسطر فارغ/تعليق
+    url = url.strip()
+    if not url or url.startswith('#'):
+        return None
+    if YOUTUBE_ID_RE.match(url):
+        return ('video', url), f"https://www.youtube.com/watch?v={url}"
+    if '://' not in url:
+        url = 'https://' + url
+
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path_parts = [part for part in parsed.path.split('/') if part]
+    query = parse_qs(parsed.query)
+
+    video_id = None
+    if host == 'youtu.be' and path_parts:
+        video_id = path_parts[0]
+    elif host in ('youtube.com', 'youtube-nocookie.com'):
+        if path_parts[:1] == ['watch']:
+            video_id = query.get('v', [None])[0]
+        elif len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v'):
+            video_id = path_parts[1]
+        if not video_id and query.get('list'):
+            playlist_id = query['list'][0]
+            return ('playlist', playlist_id), f"https://www.youtube.com/playlist?list={playlist_id}"
+        if not video_id:
+            # قناة أو صفحة أخرى: المسار وحده يكفي كمفتاح
+            canonical = "https://www.youtube.com/" + "/".join(path_parts)
+            return ('url', canonical), canonical
+    if video_id and YOUTUBE_ID_RE.match(video_id):
+        return ('video', video_id), f"https://www.youtube.com/watch?v={video_id}"
+
+    # منصات أخرى: حذف معاملات التتبع والجزء بعد #
+    kept_query = "&".join(f"{key}={value}" for key, values in sorted(query.items())
+                          for value in values if key not in TRACKING_PARAMS and not key.startswith('utm_'))
+    canonical = f"{parsed.scheme}://{parsed.netloc.lower()}{parsed.path}" + (f"?{kept_query}" if kept_query else "")
+    return ('url', canonical), canonical
+
+
+def bulk_resolve_urls(lines, max_workers=16, on_progress=None, cancel_event=None):
+    if cancel_event is None:
+        cancel_event = stop_event
+    # فهرس تجزئة: كل مفتاح قانوني يُحل مرة واحدة فقط مهما تكرر
+    index = {}
+    duplicates = 0
+    failed = []
+    for line in lines:
+        # سطر الدفعة: الرابط أول كلمة، وما بعده مقطع زمني اختياري: "الرابط 1:00-3:30"
+        parts = line.split(None, 1)
+        if not parts:
+            continue
+        clip = None
+        if len(parts) == 2:
+            try:
+                clip = parse_clip_range(parts[1])
+            except ValueError as e:
+                # لاحقة غير مفهومة تُسجل فشلاً للسطر دون أي طلب شبكة
+                failed.append((line.strip(), str(e)))
+                continue
+        normalized = normalize_media_url(parts[0])
+        if normalized is None:
+            continue
+        key, canonical_url = normalized
+        key = key + (tuple(clip) if clip else None,)
+        if key in index:
+            duplicates += 1
+        else:
+            index[key] = (canonical_url, clip)
+
+    videos = {}
+    to_resolve = []
+    for (kind, identifier, clip_key), (canonical_url, clip) in index.items():
+        if kind == 'video':
+            # روابط المرئيات لا تحتاج طلب شبكة: العنوان الحقيقي يُجلب عند التحميل
+            video = {"title": canonical_url, "url": canonical_url, "id": identifier}
+            if clip:
+                # العنوان يبقى الرابط وحده؛ الواجهة تعرض المقطع من الحقل clip
+                video["clip"] = clip
+            videos[(identifier, clip_key)] = video
+        else:
+            to_resolve.append((canonical_url, clip))
+
+    if to_resolve:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(get_videos_info, url): (url, clip) for url, clip in to_resolve}
+            for done_count, future in enumerate(as_completed(futures), 1):
+                if cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                url, clip = futures[future]
+                try:
+                    for video in future.result()["videos"]:
+                        if clip:
+                            video = dict(video, clip=clip)
+                        videos.setdefault((video["id"], tuple(clip) if clip else None), video)
+                except Exception as e:
+                    failed.append((url, str(e)))
+                if on_progress:
+                    on_progress(done_count, len(to_resolve))
+
+    return {
+        "videos": list(videos.values()),
+        "playlist_title": None,
+        "duplicates": duplicates,
+        "failed": failed,
+    }
+# --- نهاية قسم الاستيراد الجماعي ---
+
+# --- بداية قسم فحص FFmpeg ---
+# نتيجة الفحص تحفظ على القرص وتبطل تلقائياً عند تغير ملف ffmpeg/ffprobe (المسار أو وقت التعديل)
+FFMPEG_PROBE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "downtube", "ffmpeg_probe.json")
+
+
+def hidden_window_kwargs():
+    # إخفاء نافذة الطرفية على ويندوز
+    if os.name != 'nt':
+        return {}
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE
+    return {"startupinfo": startupinfo, "creationflags": subprocess.CREATE_NO_WINDOW}
+
+
+def _binary_signature(path):
+    if not path:
+        return None
+    stat = os.stat(path)
+    return [os.path.realpath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def probe_ffmpeg_capabilities(cache_path=FFMPEG_PROBE_CACHE):
+    ffmpeg_path = shutil.which('ffmpeg')
+    if not ffmpeg_path:
+        return {"available": False, "version": None, "encoders": [], "ffprobe": False}
+    ffprobe_path = shutil.which('ffprobe')
+    signature = [_binary_signature(ffmpeg_path), _binary_signature(ffprobe_path)]
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get("signature") == signature:
+            return cached["capabilities"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        version_result = subprocess.run([ffmpeg_path, '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        text=True, **hidden_window_kwargs())
+        encoders_result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'], stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    except OSError:
+        return {"available": False, "version": None, "encoders": [], "ffprobe": False}
+
+    encoders = []
+    for line in encoders_result.stdout.splitlines():
+        # سطر المرمز: " A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3)"
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS" and parts[1] != "=":
+            encoders.append(parts[1])
+    capabilities = {
+        "available": version_result.returncode == 0,
+        "version": version_result.stdout.splitlines()[0] if version_result.stdout else None,
+        "encoders": encoders,
+        "ffprobe": bool(ffprobe_path),
+    }
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": signature, "capabilities": capabilities}, f)
+    except OSError:
+        pass
+    return capabilities
+
+
+def check_ffmpeg_installed():
+    return probe_ffmpeg_capabilities()["available"]
+# --- نهاية قسم فحص FFmpeg ---
+
+
+# --- بداية قسم إعادة المحاولة ---
+# سياسة لكل صنف من الأخطاء:
+# max_attempts: العدد الكلي للمحاولات، base_delay/max_delay: حدود التأخير الأسي بالثواني،
+# defer: تأجيل العنصر إلى آخر الطابور بدلاً من انتظاره وإيقاف بقية الدفعة،
+# trips_breaker: هل يُحسب الفشل على المضيف (قاطع الدائرة) أم على العنصر نفسه فقط.
+RETRY_POLICIES = {
+    'timeout':   {'max_attempts': 4, 'base_delay': 2,  'max_delay': 60,  'defer': False, 'trips_breaker': True},
+    '429':       {'max_attempts': 5, 'base_delay': 30, 'max_delay': 600, 'defer': True,  'trips_breaker': True},
+    '5xx':       {'max_attempts': 4, 'base_delay': 5,  'max_delay': 120, 'defer': True,  'trips_breaker': True},
+    '403':       {'max_attempts': 2, 'base_delay': 10, 'max_delay': 60,  'defer': True,  'trips_breaker': False},
+    'extractor': {'max_attempts': 2, 'base_delay': 15, 'max_delay': 60,  'defer': True,  'trips_breaker': False},
+    # فشل إنشاء الاتصال نفسه: غالباً مشكلة في الواجهة المحلية أو الوكيل لا في المضيف
+    'connection': {'max_attempts': 3, 'base_delay': 2, 'max_delay': 20,  'defer': False, 'trips_breaker': False},
+    'other':     {'max_attempts': 1, 'base_delay': 0,  'max_delay': 0,   'defer': False, 'trips_breaker': False},
+}
+
+# أخطاء نهائية لا فائدة من إعادة محاولتها
+PERMANENT_ERROR_MARKERS = (
+    "Video unavailable", "This video is unavailable", "Private video",
+    "Unsupported URL", "copyright", "members-only", "Sign in to confirm your age",
+)
+
+CONNECTION_ERROR_MARKERS = (
+    "Cannot assign requested address", "Connection refused", "Network is unreachable", "No route to host",
+    "ProxyError", "Unable to connect to proxy", "Tunnel connection failed", "SOCKS",
+)
+
+
+def classify_download_error(error):
+    yt_dlp = load_yt_dlp()
+    error_text = str(error)
+    for marker in PERMANENT_ERROR_MARKERS:
+        if marker in error_text:
+            return 'other'
+
+    if "HTTP Error 429" in error_text or "Too Many Requests" in error_text:
+        return '429'
+    if "HTTP Error 403" in error_text:
+        return '403'
+    if re.search(r'HTTP Error 5\d\d', error_text):
+        return '5xx'
+    if any(marker in error_text for marker in CONNECTION_ERROR_MARKERS):
+        return 'connection'
+    if "timed out" in error_text or "TimeoutError" in error_text or "Connection reset" in error_text:
+        return 'timeout'
+
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and exc_info[0] and issubclass(exc_info[0], yt_dlp.utils.ExtractorError):
+        return 'extractor'
+    if isinstance(error, yt_dlp.utils.ExtractorError) or "Unable to extract" in error_text:
+        return 'extractor'
+    return 'other'
+
+
+def compute_backoff_delay(policy, attempt):
+    # تأخير أسي مع "full jitter" لتفادي تزامن المحاولات
+    ceiling = min(policy['max_delay'], policy['base_delay'] * (2 ** attempt))
+    return random.uniform(0, ceiling) if ceiling > 0 else 0
+
+
+class HostCircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._open_until = {}
+        self._probing = {} # المضيف -> وقت بدء محاولة الاختبار الجارية في حالة نصف مفتوح
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until.get(host, 0):
+                return False
+            if host not in self._open_until:
+                return True
+            # بعد انتهاء فترة التبريد يُسمح بمحاولة واحدة فقط (نصف مفتوح) حتى تُعرف نتيجتها،
+            # والمحاولة التي لم تُبلغ عن نتيجتها تنتهي صلاحيتها بعد فترة تبريد كاملة
+            if now - self._probing.get(host, -self.cooldown) < self.cooldown:
+                return False
+            self._probing[host] = now
+            return True
+
+    def retry_at(self, host):
+        with self._lock:
+            if host in self._probing:
+                return time.monotonic() + 1
+            return self._open_until.get(host, 0)
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+            self._probing.pop(host, None)
+
+    def release_probe(self, host):
+        # انتهت محاولة الاختبار بخطأ لا يُحسب على المضيف (403 أو إيقاف مثلاً)
+        with self._lock:
+            self._probing.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if self._probing.pop(host, None) is not None or failures >= self.failure_threshold:
+                self._open_until[host] = time.monotonic() + self.cooldown
+                return True
+            return False
+
+
+host_breaker = HostCircuitBreaker()
+
+
+def get_url_host(url):
+    return urlparse(url).hostname or ""
+
+
+def _pop_next_ready(queue):
+    now = time.monotonic()
+    for index, entry in enumerate(queue):
+        if entry[2] <= now:
+            del queue[index]
+            return entry, 0
+    return None, min(entry[2] for entry in queue) - now
+# --- نهاية قسم إعادة المحاولة ---
+
+
+# --- بداية قسم تزامن الأجزاء ---
+DEFAULT_ENGINE_SETTINGS = {
+    "concurrent_fragments": 4,
+    "adaptive_fragments": True,
+    "dedup_store": False,
+    "content_store_dir": "",
+    "stream_audio": False,
+    "profiling": False,
+    "profile_dir": "",
+    "staging_dir": "",
+    "checksums": True,
+    "progressive": False,
+    "schedule": [],
+    "network_paths": [],
+    "output_profile": "original",
+    "output_target_mb": 200,
+}
+
+
+class FragmentConcurrencyTuner:
+    # يضبط عدد الأجزاء المتزامنة (DASH/HLS) بين العناصر حسب الإنتاجية وزمن الجزء المقاس.
+    # تسلق تدريجي: مضاعفة العدد (أو تنصيفه عند الحد الأعلى) ما دامت الإنتاجية تتحسن، وعند أول خطوة فاشلة
+    # الرجوع لأفضل قيمة والثبات عليها، مع إعادة اختبار خطوة واحدة بالتناوب كل REPROBE_ITEMS عنصراً لملاحظة تغير الخط
+    REPROBE_ITEMS = 25
+
+    def __init__(self, initial=4, adaptive=True, minimum=1, maximum=16):
+        self.value = max(minimum, min(maximum, int(initial)))
+        self.adaptive = adaptive
+        self.minimum = minimum
+        self.maximum = maximum
+        self._best_value = None
+        self._best_throughput = None
+        self._baseline_latency = None
+        self._settled_items = None # None: ما زال يستكشف، وإلا عدد العناصر منذ الثبات
+        self._direction = 1 # 1: مضاعفة، -1: تنصيف
+        self._lock = threading.Lock()
+
+    def start_item(self):
+        # قياسات كل عنصر منفصلة حتى تتقاسم الطوابير المتزامنة نفس الموالف
+        return {"value": self.value, "started": None, "last_index": None, "last_time": None, "latencies": [], "bytes": 0}
+
+    def observe(self, sample, d):
+        fragment_index = d.get('fragment_index')
+        if d.get('status') != 'downloading' or fragment_index is None:
+            return
+        now = time.monotonic()
+        if sample["started"] is None:
+            sample["started"] = now
+        if sample["last_index"] is not None and fragment_index > sample["last_index"]:
+            # مع N طلبات متوازية يكتمل جزء كل (زمن الجزء / N) تقريباً
+            per_fragment = (now - sample["last_time"]) / (fragment_index - sample["last_index"])
+            sample["latencies"].append(per_fragment * sample["value"])
+        if fragment_index != sample["last_index"]:
+            sample["last_index"] = fragment_index
+            sample["last_time"] = now
+        sample["bytes"] = d.get('downloaded_bytes') or sample["bytes"]
+
+    def finish_item(self, sample):
+        latencies = sorted(sample["latencies"])
+        elapsed = time.monotonic() - sample["started"] if sample["started"] else 0
+        if not self.adaptive or len(latencies) < 4 or elapsed <= 0:
+            return None
+        throughput = sample["bytes"] / elapsed
+        latency = latencies[len(latencies) // 2]
+
+        with self._lock:
+            if sample["value"] != self.value:
+                # قِيس بقيمة غيّرها طابور آخر في أثناء التحميل
+                return None
+            if self._baseline_latency is None:
+                self._baseline_latency = latency
+            old_value = self.value
+
+            if self._best_value is None or self.value == self._best_value:
+                # قياس جديد عند أفضل قيمة معروفة
+                self._best_value = self.value
+                self._best_throughput = throughput
+                if latency > self._baseline_latency * 2 and self.value > self.minimum:
+                    # زمن الجزء تضاعف: الخادم أو الخط مشبع
+                    self.value = self._best_value = max(self.minimum, self.value // 2)
+                    self._best_throughput = None
+                    self._settled_items = 0
+                elif self._settled_items is None or self._settled_items >= self.REPROBE_ITEMS:
+                    if self._settled_items is not None:
+                        self._direction = -self._direction
+                    self.value = self._step()
+                    self._settled_items = None if self._settled_items is None else 0
+                else:
+                    self._settled_items += 1
+            elif throughput > self._best_throughput * 1.05:
+                # الخطوة أفادت: تصبح الأفضل ويستمر الاستكشاف إلا إذا كانت إعادة اختبار بعد ثبات
+                self._best_value = self.value
+                self._best_throughput = throughput
+                if self._settled_items is None:
+                    self.value = self._step()
+            else:
+                # الخطوة لم تفد: الرجوع لأفضل قيمة والتوقف عن الاستكشاف
+                self.value = self._best_value
+                self._settled_items = 0
+            return self.value if self.value != old_value else None
+
+    def _step(self):
+        # الخطوة التالية في اتجاه الاستكشاف، وعكسه إذا كان الحد قد بُلغ
+        for direction in (self._direction, -self._direction):
+            value = self.value * 2 if direction > 0 else self.value // 2
+            if self.minimum <= value <= self.maximum:
+                self._direction = direction
+                return value
+        return self.value
+
+
+def get_fragment_tuner(initial, adaptive):
+    return get_shared('fragment_tuner', (int(initial), bool(adaptive)),
+                      lambda: FragmentConcurrencyTuner(initial, adaptive))
+# --- نهاية قسم تزامن الأجزاء ---
+
+
+# --- بداية قسم مخزن المحتوى ---
+FICLONE = 0x40049409 # ioctl لنسخ الملف بالإشارة (reflink) على btrfs/xfs
+
+
+@contextlib.contextmanager
+def interprocess_lock(lock_path):
+    # قفل على ملف جانبي يحمي القراءة-الدمج-الاستبدال بين العمليات (عمال المزرعة)، فقفل الخيوط وحده لا يكفي
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class ContentStore:
+    # مخزن واحد لكل الملفات المحملة، مفتاحه معرف المرئية + معرف الصيغة + نوع الإخراج،
+    # ومجلدات قوائم التشغيل تحتوي على روابط صلبة (أو reflink) إلى نسخة واحدة
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index_path = os.path.join(root, self.INDEX_FILE)
+        self._lock = threading.Lock()
+        self._index_mtime = None
+        self._index = self._read_index()
+
+    def _read_index(self):
+        try:
+            self._index_mtime = os.path.getmtime(self.index_path)
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _refresh_index(self):
+        # عمليات أخرى قد أضافت عناصر منذ آخر قراءة
+        try:
+            if os.path.getmtime(self.index_path) != self._index_mtime:
+                self._index.update(self._read_index())
+        except OSError:
+            pass
+
+    def _write_index(self):
+        # دمج ما كتبته عمليات أخرى (مزرعة التحميل) ثم الاستبدال الذري، تحت قفل بين العمليات
+        with interprocess_lock(self.index_path + ".lock"):
+            on_disk = self._read_index()
+            on_disk.update(self._index)
+            self._index = on_disk
+            temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(temp_path, self.index_path)
+            self._index_mtime = os.path.getmtime(self.index_path)
+
+    @staticmethod
+    def make_key(video_id, format_id, file_type):
+        return f"{video_id}:{format_id}:{file_type}"
+
+    def lookup(self, video_id, format_id, file_type):
+        with self._lock:
+            self._refresh_index()
+            entry = self._index.get(self.make_key(video_id, format_id, file_type))
+        if entry and os.path.exists(entry["path"]):
+            return entry["path"]
+        return None
+
+    def find_by_video(self, video_id, file_type):
+        with self._lock:
+            self._refresh_index()
+            entries = [entry for entry in self._index.values()
+                       if entry["video_id"] == video_id and entry["file_type"] == file_type]
+        return next((entry for entry in entries if os.path.exists(entry["path"])), None)
+
+    def add(self, video_id, format_id, file_type, source_path):
+        key = self.make_key(video_id, format_id, file_type)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(source_path)[1]
+        stored_path = os.path.join(self.objects_dir, digest[:2], digest + extension)
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        shutil.move(source_path, stored_path)
+        with self._lock:
+            self._index[key] = {"path": stored_path, "video_id": video_id,
+                                "format_id": format_id, "file_type": file_type}
+            self._write_index()
+        return stored_path
+
+    def link_into(self, stored_path, target_path):
+        if os.path.exists(target_path):
+            if os.path.samefile(stored_path, target_path):
+                return
+            os.remove(target_path)
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        try:
+            os.link(stored_path, target_path)
+            return
+        except OSError:
+            pass
+        try:
+            import fcntl
+            with open(stored_path, 'rb') as src, open(target_path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+        shutil.copy2(stored_path, target_path)
+
+
+def get_content_store(root):
+    root = os.path.abspath(root)
+    return get_shared('content_store', root, lambda: ContentStore(root))
+
+
+def get_output_path(ydl, info, file_type):
+    path = ydl.prepare_filename(info)
+    if file_type == 'mp3':
+        path = os.path.splitext(path)[0] + '.mp3'
+    return path
+# --- نهاية قسم مخزن المحتوى ---
+
+
+# --- بداية قسم منطقة التجهيز ---
+STAGING_COPY_CHUNK = 8 * 1024 * 1024
+STAGING_PARTIAL_SUFFIXES = ('.part', '.ytdl', '.part.mp3', '.temp')
+
+
+def get_item_staging_dir(staging_root, video_info, file_type):
+    # اسم ثابت لكل عنصر حتى تستأنف إعادة المحاولة ملفات .part الموجودة بدلاً من البدء من الصفر
+    key = f"{video_info['url']}|{file_type}|{video_info.get('clip')}"
+    return os.path.join(staging_root, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+def move_to_destination(source_path, destination_dir):
+    # يعيد (المسار النهائي، البصمة): البصمة تُحسب أثناء النسخ فقط، وإعادة التسمية لا تمرر البيانات فتعيد None
+    os.makedirs(destination_dir, exist_ok=True)
+    target_path = os.path.join(destination_dir, os.path.basename(source_path))
+    try:
+        os.replace(source_path, target_path)
+        return target_path, None
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # نظام ملفات مختلف: نسخة متتابعة واحدة باسم مؤقت ثم إعادة تسمية على الوجهة، فلا يظهر ملف ناقص بالاسم النهائي
+    temp_path = target_path + '.moving'
+    hasher = hashlib.sha256()
+    with open(source_path, 'rb') as source, open(temp_path, 'wb') as target:
+        while True:
+            chunk = source.read(STAGING_COPY_CHUNK)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            target.write(chunk)
+    shutil.copystat(source_path, temp_path)
+    os.replace(temp_path, target_path)
+    os.remove(source_path)
+    return target_path, hasher.hexdigest()
+
+
+def move_staged_files(staging_dir, destination_dir, keep_media=False):
+    # keep_media: ملفات الوسائط تبقى في منطقة التجهيز (لترميزها هناك) وتُعاد بمساراتها فيها
+    moved = []
+    for entry in os.scandir(staging_dir):
+        if entry.is_file() and not entry.name.endswith(STAGING_PARTIAL_SUFFIXES):
+            if keep_media and entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                moved.append((entry.path, None))
+            else:
+                moved.append(move_to_destination(entry.path, destination_dir))
+    try:
+        os.rmdir(staging_dir)
+    except OSError:
+        pass
+    return moved
+# --- نهاية قسم منطقة التجهيز ---
+
+
+# --- بداية قسم التحقق من السلامة ---
+CHECKSUM_MANIFEST = "checksums.json"
+MEDIA_EXTENSIONS = ('.mp4', '.mp3', '.m4a', '.webm', '.mkv', '.opus', '.ogg', '.aac', '.flac', '.mov')
+_manifest_lock = threading.Lock()
+
+
+def hash_file(path):
+    # قراءة عبر mmap: hashlib يحرر GIL للكتل الكبيرة فتعمل عدة خيوط بالتوازي فعلاً
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mapped)
+    return hasher.hexdigest()
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, CHECKSUM_MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_checksum(path, digest, video_info, file_type):
+    directory, name = os.path.split(path)
+    entry = {
+        "sha256": digest,
+        "size": os.path.getsize(path),
+        "file_type": file_type,
+        "video": {key: video_info[key] for key in ("title", "url", "id", "clip") if key in video_info},
+        "time": time.time(),
+    }
+    manifest_path = os.path.join(directory, CHECKSUM_MANIFEST)
+    with _manifest_lock, interprocess_lock(os.path.join(directory, f".{CHECKSUM_MANIFEST}.lock")):
+        # الدمج مع النسخة على القرص لأن عمليات أخرى (المزرعة) قد تكتب في نفس المجلد
+        manifest = _read_manifest(directory)
+        manifest[name] = entry
+        temp_path = os.path.join(directory, f"{CHECKSUM_MANIFEST}.{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+
+
+def probe_media_file(path):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                             '-of', 'default=nw=1:nk=1', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    if result.returncode != 0:
+        return result.stderr.strip().splitlines()[0] if result.stderr.strip() else "ffprobe فشل"
+    try:
+        if float(result.stdout.strip()) > 0:
+            return None
+    except ValueError:
+        pass
+    return "مدة غير صالحة"
+
+
+def verify_file(path, entry, use_ffprobe):
+    # يعيد سبب الفشل أو None
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return "الملف غير موجود"
+    if size != entry["size"]:
+        return f"الحجم {size} بدلاً من {entry['size']}"
+    if hash_file(path) != entry["sha256"]:
+        return "البصمة لا تطابق"
+    if use_ffprobe and path.lower().endswith(MEDIA_EXTENSIONS):
+        return probe_media_file(path)
+    return None
+
+
+def verify_library(root, max_workers=None, on_progress=None, cancel_event=None):
+    tasks = []
+    for directory, _, filenames in os.walk(root):
+        if CHECKSUM_MANIFEST in filenames:
+            for name, entry in _read_manifest(directory).items():
+                tasks.append((os.path.join(directory, name), entry))
+
+    use_ffprobe = probe_ffmpeg_capabilities()["ffprobe"]
+    failed = []
+    checked = 0
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 2) * 2)) as pool:
+        futures = {pool.submit(verify_file, path, entry, use_ffprobe): (path, entry) for path, entry in tasks}
+        for future in as_completed(futures):
+            if cancel_event is not None and cancel_event.is_set():
+                for pending in futures:
+                    pending.cancel()
+                break
+            path, entry = futures[future]
+            try:
+                reason = future.result()
+            except OSError as e:
+                reason = str(e)
+            checked += 1
+            if reason:
+                failed.append({"path": path, "reason": reason, "video": entry.get("video"), "file_type": entry.get("file_type")})
+            if on_progress:
+                on_progress(checked, len(tasks))
+    return {"checked": checked, "total": len(tasks), "failed": failed}
+# --- نهاية قسم التحقق من السلامة ---
+
+
+# --- بداية قسم التحويل المحلي ---
+# مرمّزات المرئية متعددة الخيوط وتأخذ خيطاً لكل نواة افتراضياً، فمجمعها أصغر وكل ترميز محدود بعدد خيوط ثابت
+# حتى يبقى مجموع الخيوط قريباً من عدد الأنوية. ترميز الصوت خيط واحد فيأخذ مجمعه عاملاً لكل نواة
+VIDEO_ENCODE_THREADS = 4
+
+
+def video_encode_threads():
+    return min(VIDEO_ENCODE_THREADS, os.cpu_count() or 2)
+
+
+def get_transcode_pool(kind='audio'):
+    def create():
+        cores = os.cpu_count() or 2
+        workers = max(1, cores // video_encode_threads()) if kind == 'video' else cores
+        # spawn بدلاً من fork لأن العملية الأم قد تحمل خيوط Qt وyt-dlp
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return get_shared('transcode_pool', kind, create)
+
+
+def probe_audio_codec(path):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                             '-show_entries', 'stream=codec_name', '-of', 'default=nw=1:nk=1', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def transcode_audio(source_path, output_path, bitrate='192k'):
+    # تعمل داخل عملية منفصلة: نسخ مباشر إذا كان الصوت mp3 أصلاً، وإلا تحويل إلى mp3
+    codec = probe_audio_codec(source_path)
+    if codec is None:
+        raise Exception(f"لا يوجد مسار صوتي في {os.path.basename(source_path)}")
+    codec_args = ['-c:a', 'copy'] if codec == 'mp3' else ['-c:a', 'libmp3lame', '-b:a', bitrate]
+    temp_path = output_path + '.part.mp3'
+    result = subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', source_path, '-vn', '-map', '0:a:0',
+                             *codec_args, '-threads', '1', temp_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise Exception(result.stderr.strip() or "فشل FFmpeg في التحويل")
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+# kind: audio يغير ترميز الصوت فقط، video يعيد ترميز المرئية بحجم مستهدف، copy نسخ المسارات دون إعادة ترميز
+OUTPUT_PROFILES = {
+    'original': {'label': "كما هو (mp3 192k / mp4 بدون إعادة ترميز)", 'kind': None},
+    'opus': {'label': "Opus 96k", 'kind': 'audio', 'codec': 'libopus', 'bitrate': '96k', 'ext': '.opus'},
+    'aac': {'label': "AAC 128k", 'kind': 'audio', 'codec': 'aac', 'bitrate': '128k', 'ext': '.m4a'},
+    'copy': {'label': "نسخ المسارات فقط", 'kind': 'copy'},
+    'h264': {'label': "H.264 بحجم مستهدف", 'kind': 'video', 'codec': 'libx264', 'ext': '.mp4'},
+    'h265': {'label': "H.265 بحجم مستهدف", 'kind': 'video', 'codec': 'libx265', 'ext': '.mp4'},
+}
+# الحاوية المناسبة لكل ترميز صوتي عند النسخ دون إعادة ترميز
+COPY_AUDIO_EXTENSIONS = {'aac': '.m4a', 'mp3': '.mp3', 'opus': '.opus', 'vorbis': '.ogg', 'flac': '.flac'}
+VIDEO_PROFILE_AUDIO_BITRATE = 96 * 1000
+MIN_VIDEO_BITRATE = 150 * 1000
+
+
+def profile_applies(profile_name, file_type):
+    # mp4 يُدمج أصلاً بالنسخ، وملفات الصوت لا تُعاد ترميز مرئيتها
+    kind = OUTPUT_PROFILES.get(profile_name, OUTPUT_PROFILES['original'])['kind']
+    if kind is None:
+        return False
+    if file_type == 'mp3':
+        return kind in ('audio', 'copy')
+    return kind in ('audio', 'video')
+
+
+def probe_duration(path):
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                             '-of', 'default=nw=1:nk=1', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0.0
+
+
+def encode_output(source_path, profile_name, file_type, target_bytes=0, threads=1):
+    # تعمل داخل مجمع العمليات. تعيد إحصاءات الترميز، والمسار النهائي قد يختلف في الامتداد عن المصدر
+    profile = OUTPUT_PROFILES[profile_name]
+    started = time.monotonic()
+    source_bytes = os.path.getsize(source_path)
+    duration = probe_duration(source_path)
+    base, source_ext = os.path.splitext(source_path)
+    result = {"path": source_path, "source_bytes": source_bytes, "output_bytes": source_bytes,
+              "duration": duration, "seconds": 0.0, "skipped": False}
+
+    if file_type == 'mp3':
+        if profile['kind'] == 'copy':
+            codec = probe_audio_codec(source_path)
+            if codec is None:
+                raise Exception(f"لا يوجد مسار صوتي في {os.path.basename(source_path)}")
+            output_ext = COPY_AUDIO_EXTENSIONS.get(codec, '.mka')
+            codec_args = ['-c:a', 'copy']
+        else:
+            output_ext = profile['ext']
+            codec_args = ['-c:a', profile['codec'], '-b:a', profile['bitrate']]
+        codec_args = ['-vn', '-map', '0:a:0', *codec_args]
+    elif profile['kind'] == 'audio':
+        output_ext = '.mp4'
+        codec_args = ['-map', '0:v?', '-map', '0:a?', '-c:v', 'copy',
+                      '-c:a', profile['codec'], '-b:a', profile['bitrate'], '-movflags', '+faststart']
+    else:
+        if not duration or (target_bytes and source_bytes <= target_bytes):
+            # المصدر أصغر من الحجم المستهدف أصلاً، إعادة الترميز لن توفر شيئاً
+            result["skipped"] = True
+            return result
+        output_ext = profile['ext']
+        video_bitrate = max(int(target_bytes * 8 / duration) - VIDEO_PROFILE_AUDIO_BITRATE, MIN_VIDEO_BITRATE)
+        codec_args = ['-map', '0:v:0', '-map', '0:a:0?', '-c:v', profile['codec'], '-preset', 'medium',
+                      '-b:v', str(video_bitrate), '-maxrate', str(int(video_bitrate * 1.5)),
+                      '-bufsize', str(video_bitrate * 2), '-c:a', 'aac', '-b:a', str(VIDEO_PROFILE_AUDIO_BITRATE),
+                      '-movflags', '+faststart']
+        if profile['codec'] == 'libx265':
+            # وسم hvc1 مطلوب لتشغيل H.265 في مشغلات أبل، وx265 يبني مجمع خيوطه الخاص فلا يكفيه -threads
+            codec_args += ['-tag:v', 'hvc1', '-x265-params', f"pools={threads}:log-level=error"]
+    codec_args += ['-threads', str(threads)]
+
+    output_path = base + output_ext
+    temp_path = f"{base}.encoding{output_ext}"
+    process = subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', source_path, *codec_args, temp_path],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **hidden_window_kwargs())
+    if process.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise Exception(process.stderr.strip() or "فشل FFmpeg في الترميز")
+    result["seconds"] = time.monotonic() - started
+
+    output_bytes = os.path.getsize(temp_path)
+    if output_ext == source_ext and output_bytes >= source_bytes:
+        # نفس الحاوية والناتج أكبر: الاحتفاظ بالمصدر
+        os.remove(temp_path)
+        result["skipped"] = True
+        return result
+    os.replace(temp_path, output_path)
+    if output_path != source_path:
+        os.remove(source_path)
+    result.update(path=output_path, output_bytes=output_bytes)
+    return result
+
+
+class EncodeReport:
+    # إحصاءات لكل ملف إخراج: البايتات الموفرة وسرعة الترميز
+    def __init__(self):
+        self.profiles = {}
+
+    def add(self, profile_name, result):
+        stats = self.profiles.setdefault(profile_name, {"items": 0, "source_bytes": 0, "output_bytes": 0,
+                                                        "seconds": 0.0, "duration": 0.0})
+        stats["items"] += 1
+        stats["source_bytes"] += result["source_bytes"]
+        stats["output_bytes"] += result["output_bytes"]
+        if not result["skipped"]:
+            stats["seconds"] += result["seconds"]
+            stats["duration"] += result["duration"]
+
+    def describe(self, profile_name, stats):
+        saved = stats["source_bytes"] - stats["output_bytes"]
+        ratio = saved / stats["source_bytes"] * 100 if stats["source_bytes"] else 0
+        text = f"{profile_name}: {stats['items']} ملف، توفير {saved / 1048576:.1f} MB ({ratio:.0f}%)"
+        if stats["seconds"]:
+            text += (f"، سرعة الترميز {stats['source_bytes'] / 1048576 / stats['seconds']:.1f} MB/s"
+                     f" ({stats['duration'] / stats['seconds']:.1f}x من الزمن الحقيقي)")
+        return text
+
+    def summary(self):
+        return "\n".join(self.describe(name, stats) for name, stats in self.profiles.items())
+
+
+def find_local_audio_source(video_info, final_download_dir, content_store=None):
+    # يعيد (نوع المصدر، المسار): 'stored' لملف mp3 جاهز في المخزن، 'video' لملف mp4 يمكن استخراج صوته
+    yt_dlp = load_yt_dlp()
+    video_id = video_info.get("id")
+    if content_store and video_id:
+        entry = content_store.find_by_video(video_id, 'mp3')
+        if entry:
+            return 'stored', entry["path"]
+        entry = content_store.find_by_video(video_id, 'mp4')
+        if entry:
+            return 'video', entry["path"]
+    title = video_info.get("title")
+    if title:
+        candidate = os.path.join(final_download_dir, yt_dlp.utils.sanitize_filename(title) + '.mp4')
+        if os.path.exists(candidate):
+            return 'video', candidate
+    return None, None
+# --- نهاية قسم التحويل المحلي ---
+
+
+# --- بداية قسم المقاطع الزمنية ---
+def parse_timestamp(text):
+    # يقبل "90" أو "1:30" أو "01:02:03.5"
+    seconds = 0.0
+    for part in text.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_clip_range(text):
+    # "بداية-نهاية"، والنهاية الفارغة تعني حتى آخر المرئية
+    start_text, separator, end_text = text.strip().partition('-')
+    if not separator or not start_text.strip():
+        raise ValueError(f"صيغة المقطع غير صالحة: {text}")
+    start = parse_timestamp(start_text)
+    end = parse_timestamp(end_text) if end_text.strip() else float('inf')
+    if end <= start:
+        raise ValueError(f"نهاية المقطع يجب أن تكون بعد بدايته: {text}")
+    return [start, end]
+
+
+def format_clip_range(clip):
+    def format_seconds(value):
+        value = int(value)
+        return f"{value // 3600}:{value // 60 % 60:02d}:{value % 60:02d}" if value >= 3600 else f"{value // 60}:{value % 60:02d}"
+    start, end = clip
+    return f"{format_seconds(start)}-{'' if end == float('inf') else format_seconds(end)}"
+
+
+def clip_ydl_options(clip):
+    # yt-dlp يمرر المقطع إلى FFmpeg الذي يطلب فقط النطاقات/الأجزاء المغطية للوقت المطلوب،
+    # والقص عند أقرب إطار مفتاحي بالنسخ المباشر دون إعادة ترميز
+    yt_dlp = load_yt_dlp()
+    return {
+        'download_ranges': yt_dlp.utils.download_range_func(None, [tuple(clip)]),
+        'force_keyframes_at_cuts': False,
+    }
+# --- نهاية قسم المقاطع الزمنية ---
+
+
+# --- بداية قسم الاستخراج المتدفق للصوت ---
+STREAM_CHUNK_SIZE = 10 * 1024 * 1024 # طلبات Range بحجم 10MB كما يفعل yt-dlp لتفادي تقييد يوتيوب
+STREAM_READ_SIZE = 256 * 1024
+STREAM_RETRIES = 3
+
+
+def stream_audio_item(video_info, final_download_dir, progress_hook, bitrate='192k', network_path=None):
+    # تحميل الصوت وتمريره مباشرة إلى stdin لـ FFmpeg: لا يُكتب على القرص إلا ملف mp3 النهائي.
+    # يعيد None إذا كانت الصيغة غير مناسبة للتدفق (مجزأة أو مدمجة) أو لم يستطع FFmpeg قراءتها من أنبوب
+    # (مثل mp4 الذي يقع فيه moov في آخر الملف) ليُستخدم المسار العادي
+    yt_dlp = load_yt_dlp()
+    from yt_dlp.networking import Request
+
+    ydl_opts = {
+        'format': 'bestaudio[protocol^=http]/bestaudio/best',
+        'outtmpl': os.path.join(final_download_dir, '%(title)s.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': 60,
+        **network_path_options(network_path),
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_info["url"], download=False)
+        if info.get('requested_formats') or info.get('protocol') not in ('http', 'https'):
+            return None
+
+        output_path = get_output_path(ydl, info, 'mp3')
+        temp_path = output_path + '.part.mp3'
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        # الحجم التقريبي للتقدم فقط، والتوقف عند الحجم الدقيق أو عند أول قطعة ناقصة حتى لا يُقتطع الملف
+        total_bytes = info.get('filesize')
+        estimated_bytes = total_bytes or info.get('filesize_approx')
+        # -xerror: بدونه ينهي FFmpeg بنجاح وملف شبه فارغ إذا تعذرت قراءة الصيغة من الأنبوب
+        ffmpeg = subprocess.Popen(['ffmpeg', '-v', 'error', '-xerror', '-y', '-i', 'pipe:0', '-vn',
+                                   '-c:a', 'libmp3lame', '-b:a', bitrate, temp_path],
+                                  stdin=subprocess.PIPE, stderr=subprocess.PIPE, **hidden_window_kwargs())
+        downloaded = 0
+        ffmpeg_closed = False
+        try:
+            while not ffmpeg_closed and (total_bytes is None or downloaded < total_bytes):
+                headers = dict(info.get('http_headers') or {})
+                headers['Range'] = f"bytes={downloaded}-{downloaded + STREAM_CHUNK_SIZE - 1}"
+                response = None
+                for attempt in range(STREAM_RETRIES):
+                    try:
+                        response = ydl.urlopen(Request(info['url'], headers=headers))
+                        break
+                    except yt_dlp.networking.exceptions.HTTPError as e:
+                        # 416: الملف انتهى عند حد القطعة السابقة تماماً
+                        if e.status != 416 or not downloaded:
+                            raise
+                        break
+                    except yt_dlp.networking.exceptions.TransportError:
+                        if attempt == STREAM_RETRIES - 1:
+                            raise
+                        time.sleep(2 ** attempt)
+                if response is None:
+                    break
+                whole_body = response.status == 200 # الخادم تجاهل Range وأرسل الملف كاملاً
+                chunk_bytes = 0
+                while True:
+                    block = response.read(STREAM_READ_SIZE)
+                    if not block:
+                        break
+                    try:
+                        ffmpeg.stdin.write(block)
+                    except BrokenPipeError:
+                        # توقف FFmpeg مبكراً؛ سبب الخطأ يُقرأ من stderr أدناه
+                        ffmpeg_closed = True
+                        break
+                    chunk_bytes += len(block)
+                    downloaded += len(block)
+                    progress_hook({'status': 'downloading', 'filename': output_path, 'downloaded_bytes': downloaded,
+                                   'total_bytes': total_bytes, 'total_bytes_estimate': estimated_bytes})
+                response.close()
+                if whole_body or chunk_bytes < STREAM_CHUNK_SIZE:
+                    break
+
+            if total_bytes and downloaded < total_bytes and not ffmpeg_closed:
+                raise yt_dlp.utils.DownloadError(f"انقطع التدفق بعد {downloaded} من {total_bytes} بايت")
+            try:
+                ffmpeg.stdin.close()
+            except BrokenPipeError:
+                pass
+            if ffmpeg.wait() != 0:
+                # الصيغة لا تُقرأ من أنبوب: حذف الملف المؤقت والرجوع للمسار العادي بدلاً من إفشال العنصر
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return None
+        except BaseException:
+            ffmpeg.kill()
+            ffmpeg.wait()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        os.replace(temp_path, output_path)
+        progress_hook({'status': 'finished', 'filename': output_path})
+        return output_path
+# --- نهاية قسم الاستخراج المتدفق للصوت ---
+
+
+# --- بداية قسم التحليل الأدائي ---
+# cProfile لا يقبل أكثر من مُحلّل نشط في نفس الوقت، فالمرحلة التي تبدأ أثناء مرحلة أخرى (خيط آخر) تُقاس بالوقت فقط
+_profile_lock = threading.Lock()
+# tracemalloc حالة واحدة للعملية: يُوقف فقط عند إغلاق آخر مُحلّل، وفقط إذا كان المُحلّل هو من شغّله
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_state = {"users": 0, "owned": False}
+
+
+def _acquire_tracemalloc():
+    with _tracemalloc_lock:
+        if _tracemalloc_state["users"] == 0:
+            _tracemalloc_state["owned"] = not tracemalloc.is_tracing()
+            if _tracemalloc_state["owned"]:
+                tracemalloc.start()
+        _tracemalloc_state["users"] += 1
+
+
+def _release_tracemalloc():
+    with _tracemalloc_lock:
+        _tracemalloc_state["users"] -= 1
+        if _tracemalloc_state["users"] == 0 and _tracemalloc_state["owned"]:
+            tracemalloc.stop()
+            _tracemalloc_state["owned"] = False
+
+
+class StageProfiler:
+    def __init__(self, output_dir, top=25):
+        self.output_dir = output_dir
+        self.top = top
+        os.makedirs(output_dir, exist_ok=True)
+        self.stage_times = {} # اسم المرحلة -> [العدد، الزمن الكلي]
+        self.call_times = {} # خطاف التقدم والمعالجات اللاحقة -> [العدد، الزمن الكلي]
+        self.allocations = {} # "ملف:سطر" -> فرق الحجم بالبايت
+        self.peak_memory = 0
+        self.dumps = []
+        self._sequence = itertools.count(1)
+        self._postprocessor_started = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        _acquire_tracemalloc()
+
+    def _record(self, table, name, elapsed):
+        with self._lock:
+            entry = table.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _snapshot(self):
+        # استبعاد حجوزات أدوات القياس نفسها من النتائج
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                           tracemalloc.Filter(False, cProfile.__file__)))
+
+    @contextlib.contextmanager
+    def stage(self, name, label=""):
+        sequence = next(self._sequence)
+        profile = cProfile.Profile() if _profile_lock.acquire(blocking=False) else None
+        before = self._snapshot()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                _profile_lock.release()
+            self._record(self.stage_times, name, time.perf_counter() - started)
+            peak = tracemalloc.get_traced_memory()[1]
+            top_stats = self._snapshot().compare_to(before, 'lineno')[:self.top]
+            with self._lock:
+                self.peak_memory = max(self.peak_memory, peak)
+                for stat in top_stats:
+                    frame = stat.traceback[0]
+                    key = f"{frame.filename}:{frame.lineno}"
+                    self.allocations[key] = self.allocations.get(key, 0) + stat.size_diff
+            if profile:
+                path = os.path.join(self.output_dir, f"{sequence:04d}-{name}-{sanitize_filename(label)[:40]}.prof")
+                profile.dump_stats(path)
+                self.dumps.append(path)
+
+    def timed(self, name, func):
+        # داخل مرحلة محللة بالفعل، لذا نكتفي بـ perf_counter بدلاً من cProfile متداخل
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(self.call_times, name, time.perf_counter() - started)
+        return wrapper
+
+    def postprocessor_hook(self, d):
+        key = (threading.get_ident(), d.get('postprocessor'))
+        if d['status'] == 'started':
+            self._postprocessor_started[key] = time.perf_counter()
+        elif d['status'] == 'finished' and key in self._postprocessor_started:
+            self._record(self.call_times, f"postprocessor:{d.get('postprocessor')}",
+                         time.perf_counter() - self._postprocessor_started.pop(key))
+
+    def write_summary(self):
+        path = os.path.join(self.output_dir, "summary.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("== المراحل (العدد، الزمن الكلي بالثواني) ==\n")
+            for name, (count, total) in sorted(self.stage_times.items(), key=lambda item: -item[1][1]):
+                f.write(f"{name}\t{count}\t{total:.3f}\n")
+            f.write("\n== الاستدعاءات المقاسة (العدد، الزمن الكلي، المتوسط بالمللي ثانية) ==\n")
+            for name, (count, total) in sorted(self.call_times.items(), key=lambda item: -item[1][1]):
+                f.write(f"{name}\t{count}\t{total:.3f}\t{total * 1000 / count:.3f}\n")
+            f.write(f"\n== ذروة الذاكرة المتتبعة: {self.peak_memory / 1048576:.1f} MB ==\n")
+            f.write("\n== أكبر مواضع الحجز (فرق الحجم) ==\n")
+            for key, size in sorted(self.allocations.items(), key=lambda item: -abs(item[1]))[:self.top]:
+                f.write(f"{size / 1024:+.1f} KiB\t{key}\n")
+            if self.dumps:
+                f.write("\n== أكثر الدوال استهلاكاً (تراكمي عبر كل المراحل) ==\n")
+                pstats.Stats(*self.dumps, stream=f).sort_stats('cumulative').print_stats(self.top)
+        return path
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        _release_tracemalloc()
+
+
+def create_profiler(settings, download_dir_base):
+    settings = dict(DEFAULT_ENGINE_SETTINGS, **(settings or {}))
+    if not settings["profiling"]:
+        return None
+    output_dir = settings["profile_dir"] or os.path.join(download_dir_base, ".profiles")
+    return StageProfiler(os.path.join(output_dir, time.strftime("%Y%m%d-%H%M%S")))
+# --- نهاية قسم التحليل الأدائي ---
+
+
+# --- بداية قسم مسارات الشبكة ---
+# أخطاء تدل على مشكلة في المسار نفسه (واجهة أو وكيل) لا في الخادم أو الرابط
+PATH_ERROR_CLASSES = ('timeout', '429', 'connection')
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+
+def network_path_options(path):
+    # المسار إما عنوان مصدر محلي (واجهة أو alias) أو رابط وكيل
+    if not path:
+        return {}
+    if "://" in path:
+        return {'proxy': path}
+    return {'source_address': path}
+
+
+class NetworkPathPool:
+    # توزيع العناصر على عدة مسارات مع متوسط متحرك أسي للإنتاجية، وإيقاف مؤقت للمسار الفاشل أو المتراجع
+    def __init__(self, paths, alpha=0.3, degraded_ratio=0.3, cooldown=60, max_cooldown=900):
+        self.alpha = alpha
+        self.degraded_ratio = degraded_ratio
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.paths = {path: {"ewma": None, "in_flight": 0, "failures": 0, "cooldown_until": 0.0} for path in paths}
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            available = [path for path, state in self.paths.items() if state["cooldown_until"] <= now]
+            if not available:
+                available = [min(self.paths, key=lambda path: self.paths[path]["cooldown_until"])]
+            # المسار غير المقاس يُجرب أولاً، ثم الأقل انشغالاً، ثم الأسرع
+            path = min(available, key=lambda path: (self.paths[path]["ewma"] is not None,
+                                                    self.paths[path]["in_flight"],
+                                                    -(self.paths[path]["ewma"] or 0)))
+            self.paths[path]["in_flight"] += 1
+            return path
+
+    def release(self, path, byte_count, seconds, ok=True):
+        # يعيد "failed" أو "degraded" إذا أُوقف المسار مؤقتاً، وإلا None
+        with self._lock:
+            state = self.paths[path]
+            state["in_flight"] -= 1
+            now = time.monotonic()
+            if not ok:
+                state["failures"] += 1
+                state["cooldown_until"] = now + min(self.cooldown * 2 ** (state["failures"] - 1), self.max_cooldown)
+                return "failed"
+            state["failures"] = 0
+            if byte_count < MIN_SAMPLE_BYTES or seconds <= 0:
+                return None
+            rate = byte_count / seconds
+            state["ewma"] = rate if state["ewma"] is None else self.alpha * rate + (1 - self.alpha) * state["ewma"]
+            best = max((other["ewma"] or 0 for other_path, other in self.paths.items() if other_path != path), default=0)
+            if best and state["ewma"] < best * self.degraded_ratio:
+                # بعد انتهاء الإيقاف يُعامل كمسار غير مقاس فيُعاد اختباره
+                state["ewma"] = None
+                state["cooldown_until"] = now + self.cooldown
+                return "degraded"
+            return None
+
+    def throughput(self, path):
+        return self.paths[path]["ewma"]
+
+
+def get_network_pool(paths):
+    return get_shared('network_pool', tuple(paths), lambda: NetworkPathPool(paths))
+# --- نهاية قسم مسارات الشبكة ---
+
+
+# --- بداية قسم الجدولة الزمنية ---
+def parse_clock(text):
+    hours, _, minutes = text.strip().partition(':')
+    try:
+        hours, minutes = int(hours), int(minutes or 0)
+    except ValueError:
+        raise ValueError(f"وقت غير صالح: {text}")
+    # 24:00 مقبول كنهاية لليوم فقط
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59) and (hours, minutes) != (24, 0):
+        raise ValueError(f"وقت غير صالح: {text}")
+    return hours * 60 + minutes
+
+
+def parse_schedule_text(text):
+    # سطر لكل نافذة: "09:00-18:00 2" حيث الرقم الحد بالميجابايت/ثانية و0 بلا حد
+    windows = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        span, _, rate = line.partition(' ')
+        start, separator, end = span.partition('-')
+        if not separator:
+            raise ValueError(f"نافذة غير صالحة: {line}")
+        parse_clock(start), parse_clock(end)
+        try:
+            rate_value = float(rate or 0)
+        except ValueError:
+            raise ValueError(f"حد سرعة غير صالح: {line}")
+        if not 0 <= rate_value < float('inf'):
+            raise ValueError(f"حد سرعة غير صالح: {line}")
+        rate_bytes = int(rate_value * 1024 * 1024)
+        windows.append({"start": start.strip(), "end": end.strip(), "rate": rate_bytes})
+    return windows
+
+
+def format_schedule_text(windows):
+    return "\n".join(f"{window['start']}-{window['end']} {window['rate'] / (1024 * 1024):g}" for window in windows)
+
+
+class BandwidthSchedule:
+    # بدون نوافذ: التحميل مسموح دائماً بلا حد. مع نوافذ: مسموح داخلها فقط وبحد النافذة (0 = بلا حد)
+    def __init__(self, windows):
+        self.windows = [(parse_clock(window["start"]), parse_clock(window["end"]), int(window.get("rate") or 0))
+                        for window in windows or []]
+
+    @staticmethod
+    def _contains(start, end, minute):
+        if start < end:
+            return start <= minute < end
+        return minute >= start or minute < end # نافذة تعبر منتصف الليل، أو اليوم كاملاً إذا تساوى الطرفان
+
+    def current(self, now=None):
+        # يعيد (مسموح، الحد بالبايت/ثانية، الثواني حتى التغيير التالي)
+        if not self.windows:
+            return True, 0, None
+        moment = datetime.datetime.fromtimestamp(now if now is not None else time.time())
+        minute = moment.hour * 60 + moment.minute
+        midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        for start, end, rate in self.windows:
+            if self._contains(start, end, minute):
+                return True, rate, self._seconds_until(moment, midnight, end)
+        return False, 0, min(self._seconds_until(moment, midnight, start) for start, _, _ in self.windows)
+
+    @staticmethod
+    def _seconds_until(moment, midnight, minute_of_day):
+        target = midnight + datetime.timedelta(minutes=minute_of_day)
+        if target <= moment:
+            target += datetime.timedelta(days=1)
+        return (target - moment).total_seconds()
+
+
+RATE_LIMIT_WAIT_SLICE = 0.25
+
+
+class RateLimiter:
+    # دلو رموز مشترك بين خيوط الأجزاء، يُغذّى من خطاف التقدم فيتغير الحد فوراً دون إعادة تشغيل التحميل
+    def __init__(self, burst_seconds=0.5):
+        self.rate = 0
+        self.burst_seconds = burst_seconds
+        self._next_free = time.monotonic()
+        self._generation = 0 # يزيد مع كل تغيير للحد فيوقف الانتظارات المحسوبة بالحد القديم
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            if rate != self.rate:
+                self.rate = rate
+                self._next_free = time.monotonic()
+                self._generation += 1
+
+    def consume(self, byte_count, wait=time.sleep):
+        with self._lock:
+            if self.rate <= 0 or byte_count <= 0:
+                return
+            now = time.monotonic()
+            self._next_free = max(self._next_free, now - self.burst_seconds) + byte_count / self.rate
+            deadline = self._next_free
+            generation = self._generation
+        # الانتظار خارج القفل وعلى دفعات قصيرة: تغيير الحد عند حدود النافذة ينهي الانتظار بدل إكماله بالحد القديم.
+        # wait قد يكون Event.wait فيعيد True عند الإلغاء
+        while generation == self._generation:
+            delay = deadline - time.monotonic()
+            if delay <= 0 or wait(min(delay, RATE_LIMIT_WAIT_SLICE)):
+                break
+
+
+def get_rate_limiter(schedule):
+    # حد النافذة حد للعملية كلها، فالطوابير بنفس الجدول تتقاسم دلواً واحداً
+    return get_shared('rate_limiter', tuple(schedule.windows), RateLimiter)
+# --- نهاية قسم الجدولة الزمنية ---
+
+
+# --- بداية قسم محرك التحميل ---
+PROGRESSIVE_READY_BYTES = 2 * 1024 * 1024 # الإعلان عن رابط التشغيل بعد وصول أول 2MB
+
+
+def _noop(*args):
+    pass
+
+
+def build_ydl_opts(final_download_dir, quality, file_type, download_subtitles, progress_hook,
+                   concurrent_fragments=1, clip=None, progressive=False, output_profile='original'):
+    output_template = os.path.join(final_download_dir, '%(title)s.%(ext)s')
+    if clip:
+        output_template = os.path.join(final_download_dir, '%(title)s [%(section_start)d-%(section_end)d].%(ext)s')
+
+    ydl_opts = {
+        'format': get_format_options(quality, file_type, progressive and not clip),
+        'outtmpl': output_template,
+        'progress_hooks': [progress_hook],
+        'noprogress': True,
+        'quiet': True,
+        'no_warnings': True,
+        # إعادة المحاولة منخفضة المستوى داخل yt-dlp، أما إعادة محاولة العنصر كاملاً فيتولاها الطابور
+        'retries': 5,
+        'fragment_retries': 5,
+        'socket_timeout': 60, # زيادة المهلة إلى 60 ثانية
+        'keepvideo': False, # حذف الملفات المؤقتة بعد المعالجة
+        'concurrent_fragment_downloads': concurrent_fragments, # تحميل أجزاء DASH/HLS بالتوازي
+        # 'continuedl': True, # افتراضي
+    }
+
+    # مع ملف إخراج آخر للصوت يُحفظ الصوت الأصلي كما هو ويُرمّز لاحقاً في مجمع العمليات
+    if file_type == 'mp3' and not profile_applies(output_profile, file_type):
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192k', # استخدام 'k' للجودة
+        }]
+        # لا حاجة لـ merge_output_format هنا
+    elif file_type == 'mp4':
+         ydl_opts['merge_output_format'] = 'mp4'
+
+    if download_subtitles:
+        ydl_opts['writesubtitles'] = True
+        ydl_opts['subtitleslangs'] = ['ar', 'en'] # اللغات المطلوبة للترجمة
+        ydl_opts['writeautomaticsub'] = True
+
+    if clip:
+        ydl_opts.update(clip_ydl_options(clip))
+    return ydl_opts
+
+
+def download_video_item(video_info, final_download_dir, quality, file_type, download_subtitles, progress_hook,
+                        concurrent_fragments=1, content_store=None, profiler=None, staging_dir=None, on_file=_noop,
+                        progressive=False, network_path=None, output_profile='original', keep_staged_media=False):
+    # مع منطقة التجهيز يتم التحميل والدمج والتحويل كلها فيها، ثم تُنقل الملفات النهائية للوجهة مرة واحدة.
+    # keep_staged_media يترك ملف الوسائط في منطقة التجهيز ليُرمَّز هناك قبل نقله
+    ydl_opts = build_ydl_opts(staging_dir or final_download_dir, quality, file_type, download_subtitles, progress_hook,
+                              concurrent_fragments, video_info.get("clip"), progressive, output_profile)
+    ydl_opts.update(network_path_options(network_path))
+    if profiler:
+        ydl_opts['postprocessor_hooks'] = [profiler.postprocessor_hook]
+    # post_hooks يستقبل المسار النهائي بعد كل المعالجات اللاحقة
+    final_paths = []
+    ydl_opts['post_hooks'] = [final_paths.append]
+    yt_dlp = load_yt_dlp()
+    title = video_info.get("title", "")
+
+    def finalize():
+        # on_file(المسار، البصمة أو None إذا لم تمر البيانات عبرنا)
+        if staging_dir:
+            return move_staged_files(staging_dir, final_download_dir, keep_staged_media)
+        return [(path, None) for path in final_paths]
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if content_store is None and profiler is None:
+            ydl.download([video_info["url"]])
+            for path, digest in finalize():
+                on_file(path, digest)
+            return None
+
+        # استعلام واحد عن البيانات الوصفية يحدد الصيغة المختارة، ثم يُعاد استخدامه للتحميل
+        with profiler.stage("extract", title) if profiler else contextlib.nullcontext():
+            info = ydl.extract_info(video_info["url"], download=False)
+        if content_store is not None:
+            target_path = os.path.join(final_download_dir, os.path.basename(get_output_path(ydl, info, file_type)))
+            stored_path = content_store.lookup(info["id"], info.get("format_id"), file_type)
+            if stored_path:
+                content_store.link_into(stored_path, target_path)
+                on_file(target_path, None)
+                return "linked"
+
+        # مرحلة التحميل تشمل المعالجات اللاحقة (FFmpeg) التي يقيس خطافها زمن كل منها
+        with profiler.stage("download", title) if profiler else contextlib.nullcontext():
+            info = ydl.process_ie_result(info, download=True)
+        finished_files = finalize()
+        if content_store is not None:
+            downloads = info.get("requested_downloads") or [{}]
+            final_path = os.path.join(final_download_dir, os.path.basename(downloads[0].get("filepath") or target_path))
+            if os.path.exists(final_path):
+                stored_path = content_store.add(info["id"], info.get("format_id"), file_type, final_path)
+                content_store.link_into(stored_path, final_path)
+        for path, digest in finished_files:
+            on_file(path, digest)
+        return None
+
+
+def run_download_queue(videos, download_dir_base, quality, file_type, download_subtitles,
+                       playlist_title=None, settings=None, cancel_event=None,
+                       on_progress=_noop, on_status=_noop, on_log=_noop, on_error=_noop, on_finished=_noop,
+                       on_stream_ready=_noop):
+    yt_dlp = load_yt_dlp()
+    if cancel_event is None:
+        cancel_event = stop_event
+    settings = dict(DEFAULT_ENGINE_SETTINGS, **(settings or {}))
+    fragment_tuner = get_fragment_tuner(settings["concurrent_fragments"], settings["adaptive_fragments"])
+    output_profile = settings["output_profile"] if profile_applies(settings["output_profile"], file_type) else 'original'
+    encoding = output_profile != 'original' and check_ffmpeg_installed()
+    if encoding:
+        # المخزن والتدفق والتشغيل أثناء التحميل تعمل على الملف قبل الترميز، فتُعطل مع ملفات الإخراج
+        on_log(f"ملف الإخراج: {OUTPUT_PROFILES[output_profile]['label']} (بدون مخزن المحتوى والتشغيل أثناء التحميل).")
+    content_store = None
+    if settings["dedup_store"] and not encoding:
+        # المخزن داخل مجلد الحفظ نفسه حتى تعمل الروابط الصلبة (نفس نظام الملفات)
+        content_store = get_content_store(settings["content_store_dir"] or os.path.join(download_dir_base, ".media_store"))
+
+    # كل عنصر في الطابور: (معلومات المرئية، رقم المحاولة، أقرب وقت مسموح للبدء)
+    queue = deque((video_info, 0, 0.0) for video_info in videos)
+    total_videos = len(videos)
+    processed = 0
+    # تحويلات محلية جارية في مجمع العمليات: future -> معلومات المرئية
+    local_jobs = {}
+    local_failed = set()
+    # ترميزات ملفات الإخراج الجارية: future -> (معلومات المرئية، مسار المصدر)
+    encode_jobs = {}
+    encode_report = EncodeReport()
+    target_bytes = settings["output_target_mb"] * 1024 * 1024
+    # التدفق إلى FFmpeg لا يدعم الترجمات ولا يمر بمخزن المحتوى، فيُستخدم المسار العادي معهما
+    use_streaming = (file_type == 'mp3' and settings["stream_audio"] and not download_subtitles
+                     and content_store is None and not encoding and check_ffmpeg_installed())
+    profiler = create_profiler(settings, download_dir_base)
+    network_pool = get_network_pool(settings["network_paths"]) if settings["network_paths"] else None
+    schedule = BandwidthSchedule(settings["schedule"])
+    rate_limiter = get_rate_limiter(schedule)
+    schedule_state = {"checked": 0.0, "allowed": True, "rate": 0}
+    progressive_server = None
+    if settings["progressive"] and file_type == 'mp4' and not encoding:
+        from progressive_server import get_progressive_server
+        progressive_server = get_progressive_server()
+    if profiler:
+        on_log(f"وضع التحليل الأدائي مفعّل، تُحفظ النتائج في: {profiler.output_dir}")
+
+    def refresh_schedule(force=False):
+        # يُستدعى من الحلقة ومن خطاف التقدم (مرة في الثانية على الأكثر) لتطبيق حد النافذة الحالية
+        now = time.monotonic()
+        if not force and now - schedule_state["checked"] < 1:
+            return schedule_state["allowed"], 1
+        allowed, rate, wait_seconds = schedule.current()
+        if allowed != schedule_state["allowed"] or rate != schedule_state["rate"]:
+            if not allowed:
+                on_status(f"بانتظار نافذة التحميل التالية (بعد {wait_seconds / 60:.0f} دقيقة)...")
+                on_log(f"خارج نافذة التحميل، الإيقاف المؤقت لمدة {wait_seconds / 60:.0f} دقيقة.")
+            else:
+                on_log(f"حد السرعة الحالي: {rate / (1024 * 1024):g} MB/s." if rate else "حد السرعة الحالي: بلا حد.")
+        schedule_state.update(checked=now, allowed=allowed, rate=rate)
+        rate_limiter.set_rate(rate if allowed else 0)
+        return allowed, wait_seconds or 0
+
+    def throttle(d, last_bytes):
+        # التحميل الجاري يتوقف مؤقتاً خارج النافذة ويستأنف عند بدايتها دون إعادة تشغيل
+        allowed, wait_seconds = refresh_schedule()
+        while not allowed and not cancel_event.is_set():
+            cancel_event.wait(min(wait_seconds, 30))
+            allowed, wait_seconds = refresh_schedule(force=True)
+        key = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        # أول قيمة لكل ملف تشمل ما سبق تحميله في ملف .part مستأنف، فتُتخذ نقطة بداية ولا تُحتسب من الحد
+        if key in last_bytes:
+            rate_limiter.consume(downloaded - last_bytes[key], cancel_event.wait)
+        last_bytes[key] = downloaded
+
+    def record_checksums(files, video_info):
+        # البصمة تُحسب أثناء النسخ من منطقة التجهيز إن أمكن، وإلا بقراءة واحدة فورية والملف ما زال في ذاكرة النظام المؤقتة
+        if not settings["checksums"]:
+            return
+        for path, digest in files:
+            try:
+                record_checksum(path, digest or hash_file(path), video_info, file_type)
+            except OSError as e:
+                on_log(f"تعذر حساب بصمة {os.path.basename(path)}: {e}")
+
+    def collect_local_jobs(timeout):
+        nonlocal processed
+        done, _ = wait_futures(list(local_jobs), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            video_info = local_jobs.pop(future)
+            title = video_info.get("title", "مرئية غير مسمى")
+            try:
+                output_path = future.result()
+                if content_store and video_info.get("id"):
+                    stored_path = content_store.add(video_info["id"], "derived", 'mp3', output_path)
+                    content_store.link_into(stored_path, output_path)
+                record_checksums([(output_path, None)], video_info)
+                on_progress(100, os.path.basename(output_path))
+                on_log(f"اكتمل التحويل المحلي: {os.path.basename(output_path)}")
+                on_finished(title, True)
+                processed += 1
+            except Exception as e:
+                on_log(f"فشل التحويل المحلي لـ {title}، سيتم التحميل من الشبكة: {e}")
+                local_failed.add(id(video_info))
+                queue.append((video_info, 0, 0.0))
+
+    def collect_encode_jobs(timeout):
+        nonlocal processed
+        done, _ = wait_futures(list(encode_jobs), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            video_info, source_path, destination_dir = encode_jobs.pop(future)
+            title = video_info.get("title", "مرئية غير مسمى")
+            output_path = source_path
+            digest = None
+            try:
+                result = future.result()
+                encode_report.add(output_profile, result)
+                output_path = result["path"]
+                if result["skipped"]:
+                    on_log(f"لا توفير من الترميز، تم الإبقاء على الملف الأصلي: {os.path.basename(output_path)}")
+                else:
+                    on_log(f"اكتمل الترميز ({output_profile}): {os.path.basename(output_path)} "
+                           f"{result['source_bytes'] / 1048576:.1f} MB ← {result['output_bytes'] / 1048576:.1f} MB "
+                           f"خلال {result['seconds']:.1f} ثانية")
+            except Exception as e:
+                on_log(f"فشل ترميز {title}، تم الإبقاء على الملف الأصلي: {e}")
+            if destination_dir:
+                # الترميز تم في منطقة التجهيز، فيُنقل الناتج وحده إلى الوجهة وتُحسب بصمته أثناء النسخ
+                try:
+                    output_path, digest = move_to_destination(output_path, destination_dir)
+                except OSError as e:
+                    on_log(f"تعذر نقل {os.path.basename(output_path)} من منطقة التجهيز: {e}")
+                try:
+                    os.rmdir(os.path.dirname(source_path))
+                except OSError:
+                    pass
+            record_checksums([(output_path, digest)], video_info)
+            on_finished(title, True)
+            processed += 1
+
+    while queue or local_jobs or encode_jobs:
+        if cancel_event.is_set():
+            for future in (*local_jobs, *encode_jobs):
+                future.cancel()
+            on_status("تم إيقاف التحميل.")
+            on_log("تم إيقاف التحميل من قبل المستخدم.")
+            pending_video = queue[0][0] if queue else next(iter(local_jobs.values()), None) or next(iter(encode_jobs.values()))[0]
+            on_finished(pending_video.get("title", "غير معروف"), False)
+            break
+
+        if local_jobs:
+            collect_local_jobs(0 if queue else 0.2)
+        if encode_jobs:
+            collect_encode_jobs(0 if queue or local_jobs else 0.2)
+        if not queue:
+            continue
+
+        allowed, wait_seconds = refresh_schedule(force=True)
+        if not allowed:
+            # العناصر تبقى في الطابور حتى تبدأ النافذة التالية
+            cancel_event.wait(min(wait_seconds, 30))
+            continue
+
+        entry, wait_time = _pop_next_ready(queue)
+        if entry is None:
+            # كل العناصر المتبقية مؤجلة، ننتظر أقربها مع الاستجابة لطلب الإيقاف
+            cancel_event.wait(max(wait_time, 0.05))
+            continue
+
+        video_info, attempt, _ = entry
+        current_video_url = video_info["url"]
+        current_video_title = video_info.get("title", "مرئية غير مسمى")
+        host = get_url_host(current_video_url)
+
+        if not host_breaker.allow(host):
+            queue.append((video_info, attempt, host_breaker.retry_at(host)))
+            continue
+
+        # العناصر قيد الترميز اكتمل تحميلها وإن لم تُحتسب بعد
+        position = processed + len(encode_jobs) + 1
+        if attempt == 0:
+            on_log(f"بدء تحميل ({position}/{total_videos}): {current_video_title}")
+        else:
+            on_log(f"إعادة محاولة ({attempt + 1}) لتحميل: {current_video_title}")
+        on_status(f"جاري تحميل ({position}/{total_videos}): {current_video_title[:50]}...")
+
+        final_download_dir = download_dir_base
+        if playlist_title:
+            s_playlist_title = sanitize_filename(playlist_title)
+            playlist_folder_path = os.path.join(download_dir_base, s_playlist_title)
+            if not os.path.exists(playlist_folder_path):
+                try:
+                    os.makedirs(playlist_folder_path)
+                    on_log(f"تم إنشاء مجلد قائمة التشغيل: {playlist_folder_path}")
+                except OSError as e:
+                    on_error(f"فشل في إنشاء مجلد قائمة التشغيل: {e}")
+                    on_log(f"فشل في إنشاء مجلد قائمة التشغيل: {e}")
+                    on_finished(current_video_title, False)
+                    processed += 1
+                    continue
+            final_download_dir = playlist_folder_path
+
+        # المقاطع الزمنية تمر دائماً بالمسار العادي: لا مخزن ولا تحويل محلي ولا تدفق
+        clip = video_info.get("clip")
+        if file_type == 'mp3' and not clip and not encoding and id(video_info) not in local_failed:
+            # إذا كان المصدر موجوداً محلياً فلا داعي لتحميل الصوت من الشبكة مجدداً
+            source_kind, source_path = find_local_audio_source(video_info, final_download_dir, content_store)
+            output_path = os.path.join(final_download_dir, yt_dlp.utils.sanitize_filename(current_video_title) + '.mp3')
+            if source_kind == 'stored':
+                content_store.link_into(source_path, output_path)
+                record_checksums([(output_path, None)], video_info)
+                on_progress(100, os.path.basename(output_path))
+                on_log(f"موجود مسبقاً في المخزن، تم ربطه دون تحميل: {current_video_title}")
+                on_finished(current_video_title, True)
+                processed += 1
+                continue
+            if source_kind == 'video':
+                on_log(f"تحويل محلي من ملف موجود بدلاً من التحميل: {os.path.basename(source_path)}")
+                local_jobs[get_transcode_pool().submit(transcode_audio, source_path, output_path)] = video_info
+                continue
+
+
+        stream_state = None
+        if progressive_server and not clip:
+            token, stream_url = progressive_server.register(video_info)
+            stream_state = {"token": token, "url": stream_url, "announced": False}
+
+        def announce_stream(d):
+            # الصيغ المدمجة من مسارين منفصلين لا تصلح للتشغيل قبل الدمج
+            if (d.get('info_dict') or {}).get('requested_formats'):
+                return
+            progressive_server.update(stream_state["token"], d)
+            if not stream_state["announced"] and ((d.get('downloaded_bytes') or 0) >= PROGRESSIVE_READY_BYTES
+                                                  or d['status'] == 'finished'):
+                stream_state["announced"] = True
+                on_log(f"يمكن التشغيل أثناء التحميل: {stream_state['url']}")
+                on_stream_ready(current_video_title, stream_state["url"])
+
+        fragment_sample = fragment_tuner.start_item()
+        throttle_bytes = {}
+        # البايتات المحملة لكل ملف في هذا العنصر لقياس إنتاجية المسار
+        path_bytes = {}
+
+        def custom_progress_hook(d):
+            if cancel_event.is_set():
+                raise yt_dlp.utils.DownloadError("تم إيقاف التحميل من قبل المستخدم.")
+
+            if network_pool and d['status'] in ('downloading', 'finished'):
+                path_bytes[d.get('filename')] = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+
+            if schedule.windows and d['status'] == 'downloading':
+                throttle(d, throttle_bytes)
+            fragment_tuner.observe(fragment_sample, d)
+            if stream_state and d['status'] in ('downloading', 'finished'):
+                announce_stream(d)
+            if d['status'] == 'downloading':
+                filename = d.get('filename', 'غير معروف')
+                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded_bytes = d.get('downloaded_bytes', 0)
+                if total_bytes and downloaded_bytes is not None:
+                    progress = int((downloaded_bytes / total_bytes) * 100)
+                    on_progress(progress, os.path.basename(filename))
+            elif d['status'] == 'finished':
+                filename = d.get('filename', current_video_title)
+                on_progress(100, os.path.basename(filename))
+                on_log(f"اكتمل تحميل: {os.path.basename(filename)}")
+            elif d['status'] == 'error':
+                on_log(f"خطأ أثناء تحميل {d.get('filename', 'ملف')}")
+
+        progress_hook = profiler.timed("progress_hook", custom_progress_hook) if profiler else custom_progress_hook
+        staging_dir = get_item_staging_dir(settings["staging_dir"], video_info, file_type) if settings["staging_dir"] else None
+        item_files = []
+        network_path = network_pool.acquire() if network_pool else None
+        item_started = time.monotonic()
+        try:
+            outcome = None
+            if use_streaming and not clip:
+                with profiler.stage("stream", current_video_title) if profiler else contextlib.nullcontext():
+                    outcome = stream_audio_item(video_info, staging_dir or final_download_dir, progress_hook,
+                                                network_path=network_path)
+                if outcome is not None:
+                    item_files = move_staged_files(staging_dir, final_download_dir) if staging_dir else [(outcome, None)]
+            if outcome is None:
+                outcome = download_video_item(video_info, final_download_dir, quality, file_type,
+                                              download_subtitles, progress_hook, fragment_sample["value"],
+                                              None if clip else content_store, profiler, staging_dir,
+                                              lambda path, digest: item_files.append((path, digest)),
+                                              stream_state is not None, network_path,
+                                              output_profile if encoding else 'original', encoding)
+            host_breaker.record_success(host)
+            if network_pool and network_pool.release(network_path, sum(path_bytes.values()),
+                                                     time.monotonic() - item_started) == "degraded":
+                on_log(f"المسار {network_path} أبطأ بكثير من غيره، إيقافه مؤقتاً.")
+            if stream_state:
+                progressive_server.finish(stream_state["token"], next((path for path, _ in item_files if path.endswith('.mp4')), None))
+            new_fragment_count = fragment_tuner.finish_item(fragment_sample)
+            if new_fragment_count:
+                on_log(f"تعديل عدد الأجزاء المتزامنة إلى {new_fragment_count}.")
+            media_path = next((path for path, _ in item_files if path.lower().endswith(MEDIA_EXTENSIONS)), None) if encoding else None
+            if staging_dir and encoding:
+                # ملفات الوسائط بقيت في منطقة التجهيز؛ يُرمَّز الأول هناك ويُنقل أي ملف وسائط آخر الآن
+                item_files = [entry if entry[0] == media_path or os.path.dirname(entry[0]) != staging_dir
+                              else move_to_destination(entry[0], final_download_dir) for entry in item_files]
+            if media_path:
+                # الترميز في مجمع العمليات بينما يبدأ تحميل العنصر التالي، والاكتمال يُعلن بعد انتهائه
+                record_checksums([entry for entry in item_files if entry[0] != media_path], video_info)
+                on_status(f"جاري ترميز: {current_video_title[:50]}...")
+                kind = OUTPUT_PROFILES[output_profile]['kind'] if file_type == 'mp4' else 'audio'
+                threads = video_encode_threads() if kind == 'video' else 1
+                encode_jobs[get_transcode_pool(kind).submit(encode_output, media_path, output_profile, file_type,
+                                                            target_bytes, threads)] = (
+                    video_info, media_path, final_download_dir if staging_dir else None)
+                continue
+            record_checksums(item_files, video_info)
+            if outcome == "linked":
+                on_progress(100, current_video_title)
+                on_log(f"موجود مسبقاً في المخزن، تم ربطه دون تحميل: {current_video_title}")
+            on_finished(current_video_title, True)
+            processed += 1
+
+        except Exception as e:
+            if stream_state:
+                progressive_server.finish(stream_state["token"], failed=True)
+            if "تم إيقاف التحميل من قبل المستخدم" in str(e):
+                host_breaker.release_probe(host)
+                if network_path is not None:
+                    network_pool.release(network_path, 0, 0)
+                on_status(f"توقف تحميل: {current_video_title}")
+                on_log(f"توقف تحميل: {current_video_title}")
+                on_finished(current_video_title, False)
+                processed += 1
+                continue
+
+            error_class = classify_download_error(e)
+            policy = RETRY_POLICIES[error_class]
+            if not policy['trips_breaker']:
+                host_breaker.release_probe(host)
+            elif host_breaker.record_failure(host):
+                on_log(f"تعليق الطلبات إلى {host} مؤقتاً بعد أخطاء متتالية.")
+
+            # خطأ المسار يوقفه مؤقتاً ويسمح بمحاولة إضافية على كل مسار آخر
+            max_attempts = policy['max_attempts']
+            if network_path is not None and error_class in PATH_ERROR_CLASSES:
+                network_pool.release(network_path, 0, 0, ok=False)
+                on_log(f"فشل المسار {network_path} ({error_class})، إيقافه مؤقتاً.")
+                max_attempts += len(network_pool.paths) - 1
+            elif network_path is not None:
+                network_pool.release(network_path, 0, 0)
+
+            if attempt + 1 < max_attempts:
+                delay = compute_backoff_delay(policy, attempt)
+                if policy['defer']:
+                    on_log(f"تأجيل {current_video_title} إلى آخر الطابور ({error_class}) لمدة {delay:.1f} ثانية على الأقل.")
+                    queue.append((video_info, attempt + 1, time.monotonic() + delay))
+                else:
+                    on_log(f"خطأ مؤقت ({error_class}) في {current_video_title}، إعادة المحاولة بعد {delay:.1f} ثانية.")
+                    cancel_event.wait(delay)
+                    queue.appendleft((video_info, attempt + 1, 0.0))
+                continue
+
+            if not isinstance(e, yt_dlp.utils.DownloadError):
+                error_msg = f"خطأ غير متوقع أثناء تحميل {current_video_title}: {str(e)}"
+            elif error_class == 'timeout':
+                # اختصار رسائل الخطأ الطويلة من yt-dlp
+                error_msg = f"خطأ في تحميل {current_video_title}: انتهت مهلة الاتصال. حاول مرة أخرى أو تحقق من اتصالك بالإنترنت."
+            elif error_class == '403':
+                error_msg = f"خطأ في تحميل {current_video_title}: خطأ 403 - الوصول مرفوض. قد يكون المرئية خاصًا أو محظورًا."
+            elif error_class == '429':
+                error_msg = f"خطأ في تحميل {current_video_title}: خطأ 429 - طلبات كثيرة. حاول لاحقاً."
+            else:
+                error_msg = f"خطأ في تحميل {current_video_title}: {str(e)}"
+
+            on_error(error_msg)
+            on_log(error_msg)
+            on_finished(current_video_title, False)
+            processed += 1
+
+    if encode_report.profiles:
+        on_log(f"ملخص الترميز:\n{encode_report.summary()}")
+    if profiler:
+        on_log(f"ملخص التحليل الأدائي: {profiler.write_summary()}")
+        profiler.close()
+
+    if not cancel_event.is_set():
+        on_status("اكتملت جميع التحميلات المجدولة.")
+        on_log("اكتملت جميع التحميلات المجدولة.")
+# --- نهاية قسم محرك التحميل ---
@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+
+from download_engine import get_videos_info, run_download_queue, DEFAULT_ENGINE_SETTINGS, OUTPUT_PROFILES
+
+# عدد مرات إعادة المهمة بعد انهيار العامل قبل اعتبارها فاشلة
+MAX_WORKER_CRASHES = 2
+WORKER_CHECK_INTERVAL = 1 # ثوانٍ بين فحوص العمال المنهارين
+
+
+# الرسائل عبر الشبكة JSON وليست pickle حتى لا تُنفذ رسالة مزيفة شيفرة على الطرف الآخر
+def send_message(conn, message):
+    conn.send_bytes(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+
+def recv_message(conn):
+    return json.loads(conn.recv_bytes().decode('utf-8'))
+
+
+# --- بداية قسم العامل (Worker) ---
+def process_job(job, send_event, download_dir_override=None):
+    job_id = job["job_id"]
+    result = {"ok": False, "error": ""}
+
+    def on_finished(title, success):
+        result["ok"] = success
+
+    def on_error(message):
+        result["error"] = message
+
+    run_download_queue([job["video"]], download_dir_override or job["download_dir"],
+                       job["quality"], job["file_type"], job["subtitles"], job.get("playlist_title"), job.get("settings"),
+                       on_progress=lambda percent, filename: send_event(("progress", job_id, percent, filename)),
+                       on_log=lambda message: send_event(("log", job_id, message)),
+                       on_error=on_error,
+                       on_finished=on_finished)
+    send_event(("done", job_id, result["ok"], result["error"]))
+
+
+def local_worker_main(inbox, event_queue):
+    # المنسق يرسل لكل عامل محلي مهمة واحدة في صندوقه، فيعرف أي مهمة يعيدها للطابور إذا انهارت العملية
+    while True:
+        job = inbox.get()
+        if job is None:
+            break
+        process_job(job, event_queue.put)
+
+
+def node_worker_main(address, authkey, download_dir_override=None):
+    # عقدة بعيدة: تطلب مهمة واحدة في كل مرة من المنسق وترسل التقدم والنتيجة عبر نفس الاتصال
+    # قد تبدأ العقدة قبل المنسق، لذا نعيد محاولة الاتصال لفترة قصيرة
+    for attempt in range(30):
+        try:
+            conn = Client(address, authkey=authkey.encode())
+            break
+        except ConnectionRefusedError:
+            if attempt == 29:
+                raise
+            time.sleep(1)
+    try:
+        while True:
+            send_message(conn, ("ready",))
+            job = recv_message(conn)
+            if job is None:
+                break
+            process_job(job, lambda event: send_message(conn, event), download_dir_override)
+    except (EOFError, OSError):
+        # أغلق المنسق الاتصال بعد انتهاء كل المهام
+        pass
+    finally:
+        conn.close()
+# --- نهاية قسم العامل (Worker) ---
+
+
+# --- بداية قسم المنسق ---
+class DownloadFarm:
+    def __init__(self, download_dir, quality, file_type, subtitles=False,
+                 local_workers=None, listen_address=None, authkey=None, on_event=None, settings=None):
+        if listen_address and not authkey:
+            raise ValueError("استقبال العقد البعيدة يتطلب مفتاح مصادقة صريحاً.")
+        self.download_dir = download_dir
+        self.quality = quality
+        self.file_type = file_type
+        self.subtitles = subtitles
+        self.local_workers = local_workers if local_workers is not None else (os.cpu_count() or 2)
+        self.listen_address = listen_address
+        self.authkey = authkey
+        self.on_event = on_event or (lambda event: None)
+        self.settings = settings
+        self.job_queue = multiprocessing.Queue()
+        self.event_queue = multiprocessing.Queue()
+        self.done = threading.Event()
+        self.results = {}
+        self.crashes = {}
+
+    def build_jobs(self, urls):
+        jobs = []
+        for url in urls:
+            info = get_videos_info(url)
+            for video in info["videos"]:
+                jobs.append({
+                    "job_id": len(jobs),
+                    "video": video,
+                    "download_dir": self.download_dir,
+                    "quality": self.quality,
+                    "file_type": self.file_type,
+                    "subtitles": self.subtitles,
+                    "playlist_title": info["playlist_title"],
+                    "settings": self.settings,
+                })
+        return jobs
+
+    def _serve_node(self, conn):
+        # المهام التي أخذتها العقدة ولم تُكملها تعاد للطابور إذا انقطع الاتصال
+        in_flight = {}
+        try:
+            while not self.done.is_set():
+                message = recv_message(conn)
+                if message[0] == "ready":
+                    job = None
+                    while job is None and not self.done.is_set():
+                        try:
+                            job = self.job_queue.get(timeout=0.5)
+                        except queue.Empty:
+                            pass
+                    if job is not None:
+                        in_flight[job["job_id"]] = job
+                    send_message(conn, job)
+                else:
+                    if message[0] == "done":
+                        in_flight.pop(message[1], None)
+                    self.event_queue.put(message)
+        except (EOFError, OSError):
+            pass
+        finally:
+            for job in in_flight.values():
+                self.job_queue.put(job)
+            conn.close()
+
+    def _accept_nodes(self, listener):
+        while not self.done.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_node, args=(conn,), daemon=True).start()
+
+    def _start_worker(self):
+        inbox = multiprocessing.Queue()
+        process = multiprocessing.Process(target=local_worker_main, args=(inbox, self.event_queue), daemon=True)
+        process.start()
+        # [العملية، صندوق المهام، رقم المهمة الحالية أو None]
+        return [process, inbox, None]
+
+    def _assign_jobs(self, workers):
+        for worker in workers:
+            if worker[2] is not None:
+                continue
+            try:
+                job = self.job_queue.get_nowait()
+            except queue.Empty:
+                return
+            worker[2] = job["job_id"]
+            worker[1].put(job)
+
+    def _replace_dead_workers(self, workers, jobs):
+        # العامل المنهار لا يرسل "done"، فتُعاد مهمته للطابور أو تُسجل فاشلة بعد تكرار الانهيار
+        for index, (process, _, job_id) in enumerate(workers):
+            if process.is_alive():
+                continue
+            if job_id is not None and job_id not in self.results:
+                self.crashes[job_id] = self.crashes.get(job_id, 0) + 1
+                error = f"انهار العامل (رمز الخروج {process.exitcode})"
+                if self.crashes[job_id] < MAX_WORKER_CRASHES:
+                    self.job_queue.put(jobs[job_id])
+                    self.on_event(("log", job_id, f"{error}، إعادة المهمة للطابور."))
+                else:
+                    self.results[job_id] = {"title": jobs[job_id]["video"].get("title", ""), "ok": False, "error": error}
+                    self.on_event(("done", job_id, False, error))
+            workers[index] = self._start_worker()
+
+    def run(self, urls):
+        jobs = self.build_jobs(urls)
+        if not jobs:
+            return self.results
+        for job in jobs:
+            self.job_queue.put(job)
+
+        workers = [self._start_worker() for _ in range(self.local_workers)]
+        self._assign_jobs(workers)
+
+        listener = None
+        if self.listen_address:
+            listener = Listener(self.listen_address, authkey=self.authkey.encode())
+            threading.Thread(target=self._accept_nodes, args=(listener,), daemon=True).start()
+
+        last_check = time.monotonic()
+        try:
+            while len(self.results) < len(jobs):
+                # الفحص بمؤقت لا عند خلو الطابور فقط: أحداث التقدم من العمال الآخرين لا تتوقف ثانية كاملة
+                if time.monotonic() - last_check >= WORKER_CHECK_INTERVAL:
+                    last_check = time.monotonic()
+                    self._replace_dead_workers(workers, jobs)
+                    self._assign_jobs(workers)
+                try:
+                    event = self.event_queue.get(timeout=WORKER_CHECK_INTERVAL)
+                except queue.Empty:
+                    continue
+                if event[0] == "done":
+                    for worker in workers:
+                        if worker[2] == event[1]:
+                            worker[2] = None
+                    self._assign_jobs(workers)
+                    self.results[event[1]] = {"title": jobs[event[1]]["video"].get("title", ""),
+                                              "ok": event[2], "error": event[3]}
+                self.on_event(event)
+        finally:
+            self.done.set()
+            for _, inbox, _ in workers:
+                inbox.put(None)
+            for process, _, _ in workers:
+                process.join(timeout=5)
+            if listener:
+                listener.close()
+        return self.results
+# --- نهاية قسم المنسق ---
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    # بدون مضيف صريح يبقى الاستماع محلياً
+    return (host or "127.0.0.1", int(port))
+
+
+def print_event(event):
+    if event[0] == "progress":
+        print(f"[{event[1]}] {event[2]}% {event[3]}")
+    elif event[0] == "log":
+        print(f"[{event[1]}] {event[2]}")
+    elif event[0] == "done":
+        print(f"[{event[1]}] {'نجح' if event[2] else 'فشل'} {event[3]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="توزيع التحميل على عدة عمليات أو أجهزة")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="تشغيل المنسق مع عمال محليين")
+    run_parser.add_argument("urls", nargs="*")
+    run_parser.add_argument("--urls-file")
+    run_parser.add_argument("--dir", default=os.path.join(os.getcwd(), "مجلد_التنزيلات"))
+    run_parser.add_argument("--quality", default="متوسطة")
+    run_parser.add_argument("--format", default="mp4", choices=["mp4", "mp3"])
+    run_parser.add_argument("--subtitles", action="store_true")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    run_parser.add_argument("--listen", help="عنوان host:port لاستقبال العقد البعيدة (127.0.0.1 إذا لم يُحدد المضيف)")
+    run_parser.add_argument("--authkey", help="مفتاح مصادقة سري مطلوب مع --listen")
+    run_parser.add_argument("--concurrent-fragments", type=int, default=DEFAULT_ENGINE_SETTINGS["concurrent_fragments"])
+    run_parser.add_argument("--profile", action="store_true", help="حفظ ملفات cProfile وملخص الذاكرة لكل عنصر")
+    run_parser.add_argument("--staging-dir", default="", help="مجلد محلي سريع للتحميل والدمج قبل النقل إلى --dir")
+    run_parser.add_argument("--network-path", action="append", default=[], dest="network_paths",
+                            help="عنوان مصدر محلي أو رابط وكيل للتحميل عبره (يمكن تكراره لتوزيع العناصر على عدة مسارات)")
+    run_parser.add_argument("--output-profile", default=DEFAULT_ENGINE_SETTINGS["output_profile"], choices=list(OUTPUT_PROFILES),
+                            help="ترميز الملفات بعد التحميل لتقليل حجمها")
+    run_parser.add_argument("--target-mb", type=int, default=DEFAULT_ENGINE_SETTINGS["output_target_mb"],
+                            help="الحجم المستهدف لكل ملف مع h264/h265")
+
+    node_parser = subparsers.add_parser("node", help="تشغيل عقدة عاملة تتصل بالمنسق")
+    node_parser.add_argument("address", help="host:port للمنسق")
+    node_parser.add_argument("--dir", help="مجلد حفظ محلي بدلاً من مجلد المنسق")
+    node_parser.add_argument("--authkey", required=True, help="نفس مفتاح المنسق")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "node":
+        node_worker_main(parse_address(args.address), args.authkey, args.dir)
+        return 0
+
+    urls = list(args.urls)
+    if args.urls_file:
+        with open(args.urls_file, 'r', encoding='utf-8') as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    if not urls:
+        parser.error("لم يتم تحديد أي رابط.")
+    if args.listen and not args.authkey:
+        parser.error("--listen يتطلب --authkey سرياً، فالمنسق ينفذ المهام لأي عقدة تعرف المفتاح.")
+
+    farm = DownloadFarm(args.dir, args.quality, args.format, args.subtitles, args.workers,
+                        parse_address(args.listen) if args.listen else None, args.authkey, print_event,
+                        {"concurrent_fragments": args.concurrent_fragments, "profiling": args.profile,
+                         "staging_dir": args.staging_dir, "network_paths": args.network_paths,
+                         "output_profile": args.output_profile, "output_target_mb": args.target_mb})
+    started = time.monotonic()
+    results = farm.run(urls)
+    failed = [result for result in results.values() if not result["ok"]]
+    print(f"اكتمل {len(results) - len(failed)}/{len(results)} خلال {time.monotonic() - started:.1f} ثانية.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
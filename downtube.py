@@ -1,131 +1,51 @@
+import time
+STARTUP_STARTED = time.perf_counter() # لقياس زمن الإقلاع حتى ظهور النافذة
+
 import sys
 import os
 import json
-import re
-import subprocess
+import uuid
 import threading
-import yt_dlp
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QLineEdit, QPushButton, QComboBox, QCheckBox, QProgressBar,
-    QFileDialog, QMessageBox, QTabWidget, QPlainTextEdit, QListWidget,
-    QListWidgetItem, QAbstractItemView
+    QFileDialog, QMessageBox, QTabWidget, QPlainTextEdit, QListView,
+    QAbstractItemView, QSpinBox, QInputDialog
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject
-from PyQt5.QtGui import QFont
-
-# --- بداية قسم منطق التحميل ---
-stop_event = threading.Event()
-
-def reset_stop_event():
-    stop_event.clear()
-
-def stop_download_process():
-    stop_event.set()
-
-def get_format_options(quality, file_type):
-    quality_map = {
-        'منخفضة': 'best[height<=360]',
-        'متوسطة': 'best[height<=720]',
-        'عالية': 'best[height<=1080]/bestvideo[height<=1080]+bestaudio/best'
-    }
-    quality_value_video = quality_map.get(quality, 'best[height<=720]') # الافتراضي متوسطة
-
-    if file_type == 'mp3':
-        # جودة الصوت mp3 ستكون 192kbps بواسطة FFmpeg
-        return 'bestaudio/best'
-    else: # mp4
-        # دمج أفضل مرئية (بالجودة المحددة) مع أفضل صوت
-        return f'{quality_value_video}[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-
-
-def get_videos_info(url):
-    ydl_opts = {
-        "quiet": True,
-        "extract_flat": "in_playlist",
-        "skip_download": True,
-        "simulate": True,
-        "forcejson": True,
-        "no_warnings": True,
-        "socket_timeout": 20, # مهلة للاتصال الأولي
-    }
-    videos = []
-    playlist_title_text = None
-
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-            if not info:
-                raise Exception("لم يتم العثور على معلومات للمرئية.")
-
-            if 'entries' in info and info['entries']:
-                playlist_title_text = info.get("title", "قائمة تشغيل غير مسماة")
-                for entry in info["entries"]:
-                    if entry:
-                        video_id = entry.get('id')
-                        video_title = entry.get('title', 'مرئية بدون عنوان')
-                        if video_id:
-                             videos.append({
-                                "title": video_title,
-                                "url": f"https://www.youtube.com/watch?v={video_id}",
-                                "id": video_id
-                            })
-            elif 'id' in info :
-                video_id = info.get('id')
-                video_title = info.get('title', 'مرئية بدون عنوان')
-                if video_id:
-                    videos.append({
-                        "title": video_title,
-                        "url": info.get('webpage_url', f"https://www.youtube.com/watch?v={video_id}"),
-                        "id": video_id
-                    })
-            else:
-                raise Exception("تنسيق المعلومات غير مدعوم أو الرابط غير صالح.")
-
-            return {
-                "videos": videos,
-                "playlist_title": playlist_title_text
-            }
-    except yt_dlp.utils.DownloadError as e:
-        if "Unsupported URL" in str(e):
-             raise Exception(f"الرابط غير مدعوم: {url}")
-        elif "Video unavailable" in str(e):
-            raise Exception("المرئية غير متاح.")
-        else:
-            raise Exception(f"خطأ في جلب معلومات المرئية: {str(e)}")
-    except Exception as e:
-        raise Exception(f"خطأ غير متوقع في جلب المعلومات: {str(e)}")
-
-
-def sanitize_filename(filename):
-    filename = re.sub(r'[\\/*?:"<>|]', "_", filename)
-    filename = re.sub(r'\s+', " ", filename).strip()
-    if len(filename) > 150:
-        filename = filename[:147] + "..."
-    return filename
-# --- نهاية قسم منطق التحميل ---
-
-# --- بداية قسم فحص FFmpeg ---
-def check_ffmpeg_installed():
-    try:
-        # إخفاء نافذة الطرفية على ويندوز
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-
-        result = subprocess.run(['ffmpeg', '-version'],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                startupinfo=startupinfo,
-                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-        return result.returncode == 0
-    except FileNotFoundError:
-        return False
-# --- نهاية قسم فحص FFmpeg ---
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QTimer, QSize, QPoint, QUrl, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QFont, QIcon, QPixmap, QDesktopServices
+from concurrent.futures import ThreadPoolExecutor
+
+from download_engine import (
+    stop_event, reset_stop_event, stop_download_process,
+    get_videos_info, check_ffmpeg_installed, run_download_queue, DEFAULT_ENGINE_SETTINGS,
+    preload_yt_dlp_in_background, bulk_resolve_urls, parse_clip_range, format_clip_range, create_profiler,
+    verify_library, parse_schedule_text, format_schedule_text, OUTPUT_PROFILES
+)
+from playlist_snapshot import PlaylistSnapshot, write_snapshot
+
+# قوائم المرئيات المعروضة تُحفظ في لقطات mmap هنا بدلاً من إبقاء قواميسها في الذاكرة
+SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "downtube", "snapshots")
+SNAPSHOT_MAX_AGE = 24 * 3600
+
+
+def store_videos_snapshot(result):
+    # تُستدعى في خيط العامل: قائمة القواميس تُكتب في لقطة ولا يصل إلى الواجهة إلا مسارها،
+    # والمقاطع الزمنية (غير موجودة في صيغة اللقطة) تُنقل منفصلة لأنها قليلة
+    videos = result.get("videos", [])
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # لقطات بقيت من تشغيل سابق لم يُغلق بشكل طبيعي
+    for entry in os.scandir(SNAPSHOT_DIR):
+        if entry.is_file() and time.time() - entry.stat().st_mtime > SNAPSHOT_MAX_AGE:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    path = os.path.join(SNAPSHOT_DIR, f"{uuid.uuid4().hex}.dtps")
+    write_snapshot(path, videos, result.get("playlist_title"))
+    clips = {row: video["clip"] for row, video in enumerate(videos) if video.get("clip")}
+    return dict(result, videos=None, snapshot_path=path, count=len(videos), clips=clips)
 
 
 # --- بداية العامل (Worker) للعمليات الطويلة ---
@@ -136,8 +56,10 @@ class DownloadWorker(QObject):
     download_finished_signal = pyqtSignal(str, bool)
     log_message_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
+    stream_ready_signal = pyqtSignal(str, str)
 
-    def __init__(self, url, download_dir_base, quality, file_type, download_subtitles, selected_videos_info=None, playlist_title_override=None):
+    def __init__(self, url, download_dir_base, quality, file_type, download_subtitles, selected_videos_info=None, playlist_title_override=None,
+                 engine_settings=None):
         super().__init__()
         self.url = url
         self.download_dir_base = download_dir_base
@@ -146,19 +68,44 @@ class DownloadWorker(QObject):
         self.download_subtitles = download_subtitles
         self.selected_videos_info = selected_videos_info
         self.playlist_title_override = playlist_title_override
+        self.engine_settings = engine_settings
 
 
     def run_get_info(self):
         try:
             self.log_message_signal.emit(f"جاري جلب معلومات من الرابط: {self.url}")
-            result = get_videos_info(self.url)
-            self.info_fetched_signal.emit(result)
+            profiler = create_profiler(self.engine_settings, self.download_dir_base)
+            if profiler:
+                with profiler.stage("metadata", self.url):
+                    result = get_videos_info(self.url)
+                self.log_message_signal.emit(f"ملخص التحليل الأدائي: {profiler.write_summary()}")
+                profiler.close()
+            else:
+                result = get_videos_info(self.url)
             self.log_message_signal.emit(f"تم جلب المعلومات بنجاح. عدد المرئيات: {len(result.get('videos', []))}")
+            self.info_fetched_signal.emit(store_videos_snapshot(result))
         except Exception as e:
             self.log_message_signal.emit(f"خطأ أثناء جلب المعلومات: {str(e)}")
             self.error_signal.emit(f"خطأ في جلب المعلومات: {str(e)}")
 
 
+    def run_bulk_import(self):
+        try:
+            lines = self.url.splitlines()
+            self.log_message_signal.emit(f"جاري استيراد {len(lines)} سطر...")
+            result = bulk_resolve_urls(
+                lines,
+                on_progress=lambda done, total: self.status_updated.emit(f"جاري حل الروابط ({done}/{total})..."))
+            for failed_url, error in result["failed"]:
+                self.log_message_signal.emit(f"تعذر حل الرابط {failed_url}: {error}")
+            self.log_message_signal.emit(f"تم الاستيراد: {len(result['videos'])} مرئية فريدة، "
+                                         f"{result['duplicates']} رابط مكرر، {len(result['failed'])} فشل.")
+            self.info_fetched_signal.emit(store_videos_snapshot(result))
+        except Exception as e:
+            self.log_message_signal.emit(f"خطأ أثناء الاستيراد الجماعي: {str(e)}")
+            self.error_signal.emit(f"خطأ في الاستيراد الجماعي: {str(e)}")
+
+
     def run_download(self):
         reset_stop_event()
 
@@ -187,116 +134,158 @@ class DownloadWorker(QObject):
             self.download_finished_signal.emit("", False)
             return
 
-        total_videos = len(videos_to_download)
-        for i, video_info in enumerate(videos_to_download):
+        run_download_queue(videos_to_download, self.download_dir_base, self.quality, self.file_type,
+                           self.download_subtitles, effective_playlist_title, self.engine_settings,
+                           on_progress=self.progress_updated.emit,
+                           on_status=self.status_updated.emit,
+                           on_log=self.log_message_signal.emit,
+                           on_error=self.error_signal.emit,
+                           on_finished=self.download_finished_signal.emit,
+                           on_stream_ready=self.stream_ready_signal.emit)
+
+    def run_verify_library(self):
+        reset_stop_event()
+        self.log_message_signal.emit(f"جاري فحص سلامة الملفات في: {self.download_dir_base}")
+        self.status_updated.emit("جاري فحص سلامة المكتبة...")
+        result = verify_library(self.download_dir_base, cancel_event=stop_event,
+                                on_progress=lambda done, total: self.progress_updated.emit(int(done * 100 / total), f"فحص {done}/{total}"))
+        self.log_message_signal.emit(f"تم فحص {result['checked']} من {result['total']} ملف، التالف: {len(result['failed'])}.")
+
+        # حذف التالف أولاً حتى لا يتخطاه yt-dlp كملف موجود، ثم إعادة تحميله فقط
+        groups = {}
+        for failure in result["failed"]:
+            self.log_message_signal.emit(f"ملف تالف: {failure['path']} ({failure['reason']})")
+            if not failure["video"]:
+                continue
+            try:
+                os.remove(failure["path"])
+            except FileNotFoundError:
+                pass
+            group = groups.setdefault((os.path.dirname(failure["path"]), failure["file_type"]), {})
+            group[failure["video"]["url"]] = failure["video"]
+
+        # رسالة الاكتمال تُرسل مرة واحدة بعد كل المجموعات
+        def on_status(message):
+            if "اكتملت جميع التحميلات المجدولة" not in message and "تم إيقاف التحميل" not in message:
+                self.status_updated.emit(message)
+
+        for (directory, file_type), videos in groups.items():
             if stop_event.is_set():
-                self.status_updated.emit("تم إيقاف التحميل.")
-                self.log_message_signal.emit("تم إيقاف التحميل من قبل المستخدم.")
-                self.download_finished_signal.emit(video_info.get("title", "غير معروف"), False)
                 break
-
-            current_video_url = video_info["url"]
-            current_video_title = video_info.get("title", "مرئية غير مسمى")
-            self.log_message_signal.emit(f"بدء تحميل ({i+1}/{total_videos}): {current_video_title}")
-            self.status_updated.emit(f"جاري تحميل ({i+1}/{total_videos}): {current_video_title[:50]}...")
-
-            final_download_dir = self.download_dir_base
-            if effective_playlist_title:
-                s_playlist_title = sanitize_filename(effective_playlist_title)
-                playlist_folder_path = os.path.join(self.download_dir_base, s_playlist_title)
-                if not os.path.exists(playlist_folder_path):
-                    try:
-                        os.makedirs(playlist_folder_path)
-                        self.log_message_signal.emit(f"تم إنشاء مجلد قائمة التشغيل: {playlist_folder_path}")
-                    except OSError as e:
-                        self.error_signal.emit(f"فشل في إنشاء مجلد قائمة التشغيل: {e}")
-                        self.log_message_signal.emit(f"فشل في إنشاء مجلد قائمة التشغيل: {e}")
-                        self.download_finished_signal.emit(current_video_title, False)
-                        continue
-                final_download_dir = playlist_folder_path
-
-
-            def custom_progress_hook(d):
-                if stop_event.is_set():
-                    raise yt_dlp.utils.DownloadError("تم إيقاف التحميل من قبل المستخدم.")
-
-                if d['status'] == 'downloading':
-                    filename = d.get('filename', 'غير معروف')
-                    total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
-                    downloaded_bytes = d.get('downloaded_bytes', 0)
-                    if total_bytes and downloaded_bytes is not None:
-                        progress = int((downloaded_bytes / total_bytes) * 100)
-                        self.progress_updated.emit(progress, os.path.basename(filename))
-                elif d['status'] == 'finished':
-                    filename = d.get('filename', current_video_title)
-                    self.progress_updated.emit(100, os.path.basename(filename))
-                    self.log_message_signal.emit(f"اكتمل تحميل: {os.path.basename(filename)}")
-                elif d['status'] == 'error':
-                    self.log_message_signal.emit(f"خطأ أثناء تحميل {d.get('filename', 'ملف')}")
-
-            output_template = os.path.join(final_download_dir, '%(title)s.%(ext)s')
-
-            ydl_opts = {
-                'format': get_format_options(self.quality, self.file_type),
-                'outtmpl': output_template,
-                'progress_hooks': [custom_progress_hook],
-                'noprogress': True,
-                'quiet': True,
-                'no_warnings': True,
-                'retries': 5,  # زيادة عدد مرات إعادة المحاولة
-                'fragment_retries': 5, # لنفس السبب
-                'socket_timeout': 60, # زيادة المهلة إلى 60 ثانية
-                'keepvideo': False, # حذف الملفات المؤقتة بعد المعالجة
-                # 'continuedl': True, # افتراضي
-                # 'ignoreerrors': True, # إذا أردت تجاهل الأخطاء في قائمة التشغيل والمتابعة
-            }
-
-            if self.file_type == 'mp3':
-                ydl_opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192k', # استخدام 'k' للجودة
-                }]
-                # لا حاجة لـ merge_output_format هنا
-            elif self.file_type == 'mp4':
-                 ydl_opts['merge_output_format'] = 'mp4'
-
-            if self.download_subtitles:
-                ydl_opts['writesubtitles'] = True
-                ydl_opts['subtitleslangs'] = ['ar', 'en'] # اللغات المطلوبة للترجمة
-                ydl_opts['writeautomaticsub'] = True
+            self.log_message_signal.emit(f"إعادة تحميل {len(videos)} عنصر في: {directory}")
+            run_download_queue(list(videos.values()), directory, self.quality, file_type, False, None, self.engine_settings,
+                               on_progress=self.progress_updated.emit,
+                               on_status=on_status,
+                               on_log=self.log_message_signal.emit,
+                               on_error=self.error_signal.emit,
+                               on_finished=self.download_finished_signal.emit)
+        self.status_updated.emit("تم إيقاف التحميل." if stop_event.is_set() else "اكتملت جميع التحميلات المجدولة.")
+# --- نهاية العامل (Worker) ---
 
 
+# --- بداية قسم نموذج قائمة المرئيات ---
+class VideoListModel(QAbstractListModel):
+    # القائمة تُقرأ من لقطة mmap صفاً صفاً عند الرسم، فلا يُبنى قاموس إلا للصفوف الظاهرة أو المحددة للتحميل
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.snapshot = None
+        self.clips = {} # رقم الصف -> المقطع الزمني
+        self.icons = {} # رقم الصف -> الصورة المصغرة المحمّلة
+
+    def set_snapshot(self, path, clips=None):
+        self.beginResetModel()
+        old_snapshot = self.snapshot
+        self.snapshot = PlaylistSnapshot(path) if path else None
+        self.clips = dict(clips or {})
+        self.icons = {}
+        self.endResetModel()
+        if old_snapshot is not None:
+            # ويندوز لا يحذف ملفاً مفتوحاً بـ mmap، لذا يُغلق قبل الحذف
+            old_snapshot.close()
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([current_video_url])
-                self.download_finished_signal.emit(current_video_title, True)
-
-            except yt_dlp.utils.DownloadError as e:
-                if "تم إيقاف التحميل من قبل المستخدم" in str(e):
-                    self.status_updated.emit(f"توقف تحميل: {current_video_title}")
-                    self.log_message_signal.emit(f"توقف تحميل: {current_video_title}")
-                    self.download_finished_signal.emit(current_video_title, False)
-                else:
-                    error_msg = f"خطأ في تحميل {current_video_title}: {str(e)}"
-                    # اختصار رسائل الخطأ الطويلة من yt-dlp
-                    if "Read timed out" in str(e):
-                        error_msg = f"خطأ في تحميل {current_video_title}: انتهت مهلة الاتصال. حاول مرة أخرى أو تحقق من اتصالك بالإنترنت."
-                    elif "HTTP Error 403" in str(e):
-                        error_msg = f"خطأ في تحميل {current_video_title}: خطأ 403 - الوصول مرفوض. قد يكون المرئية خاصًا أو محظورًا."
-
-                    self.error_signal.emit(error_msg)
-                    self.log_message_signal.emit(error_msg)
-                    self.download_finished_signal.emit(current_video_title, False)
-            except Exception as e:
-                self.error_signal.emit(f"خطأ غير متوقع أثناء تحميل {current_video_title}: {str(e)}")
-                self.log_message_signal.emit(f"خطأ غير متوقع أثناء تحميل {current_video_title}: {str(e)}")
-                self.download_finished_signal.emit(current_video_title, False)
+                os.remove(old_snapshot.path)
+            except OSError:
+                pass
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.snapshot is None:
+            return 0
+        return len(self.snapshot)
+
+    def video(self, row):
+        video = self.snapshot[row]
+        if row in self.clips:
+            video["clip"] = self.clips[row]
+        return video
+
+    def video_text(self, row):
+        video = self.video(row)
+        if video.get("clip"):
+            return f"{video['title']}  [{format_clip_range(video['clip'])}]"
+        return video['title']
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or self.snapshot is None:
+            return None
+        if role == Qt.DisplayRole:
+            return self.video_text(index.row())
+        if role == Qt.DecorationRole:
+            return self.icons.get(index.row())
+        if role == Qt.UserRole:
+            return self.video(index.row())
+        return None
+
+    def set_clip(self, rows, clip):
+        for row in rows:
+            if clip:
+                self.clips[row] = clip
+            else:
+                self.clips.pop(row, None)
+            self.dataChanged.emit(self.index(row), self.index(row), [Qt.DisplayRole])
 
-        if not stop_event.is_set():
-            self.status_updated.emit("اكتملت جميع التحميلات المجدولة.")
-            self.log_message_signal.emit("اكتملت جميع التحميلات المجدولة.")
-# --- نهاية العامل (Worker) ---
+    def set_icon(self, video_id, icon):
+        row = self.snapshot.find(video_id) if self.snapshot is not None else -1
+        if row >= 0:
+            self.icons[row] = icon
+            self.dataChanged.emit(self.index(row), self.index(row), [Qt.DecorationRole])
+# --- نهاية قسم نموذج قائمة المرئيات ---
+
+
+# --- بداية قسم الصور المصغرة ---
+class ThumbnailLoader(QObject):
+    thumbnail_ready = pyqtSignal(str, bytes)
+
+    def __init__(self, max_workers=4):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.cache = None
+        self._cache_lock = threading.Lock() # الذاكرة تُنشأ مرة واحدة عند أول طلب من أحد خيوط المجمع
+        self.requested = set()
+
+    def request(self, video):
+        video_id = video.get("id")
+        if not video_id or video_id in self.requested:
+            return
+        self.requested.add(video_id)
+        self.executor.submit(self._load, video)
+
+    def _load(self, video):
+        try:
+            with self._cache_lock:
+                if self.cache is None:
+                    from thumbnail_cache import ThumbnailCache
+                    self.cache = ThumbnailCache()
+            data = self.cache.fetch(video)
+        except Exception:
+            # صورة مفقودة لا تستحق رسالة خطأ؛ نسمح بإعادة المحاولة عند التمرير لاحقاً
+            self.requested.discard(video.get("id"))
+            return
+        if data:
+            self.thumbnail_ready.emit(video["id"], data)
+
+    def reset(self):
+        self.requested.clear()
+# --- نهاية قسم الصور المصغرة ---
 
 
 class YouTubeDownloaderApp(QMainWindow):
@@ -310,14 +299,14 @@ class YouTubeDownloaderApp(QMainWindow):
             font-family: Tahoma, Arial, sans-serif;
             font-size: 10pt;
         }
-        QLineEdit, QPlainTextEdit, QListWidget {
+        QLineEdit, QPlainTextEdit, QListView {
             background-color: #2b2d31;
             color: #dcdde1;
             border: 1px solid #3a3c41;
             border-radius: 5px;
             padding: 7px; /* زيادة padding قليلاً */
         }
-        QPlainTextEdit, QListWidget {
+        QPlainTextEdit, QListView {
             font-size: 9.5pt;
         }
         QPushButton {
@@ -429,18 +418,18 @@ class YouTubeDownloaderApp(QMainWindow):
             color: #dcdde1;
             padding: 3px;
         }
-        QListWidget {
+        QListView {
              outline: none; /* إزالة إطار التركيز الأزرق حول القائمة */
         }
-        QListWidget::item {
+        QListView::item {
             padding: 6px; /* زيادة padding */
             border-radius: 4px;
         }
-        QListWidget::item:selected {
+        QListView::item:selected {
             background-color: #0078d4;
             color: white;
         }
-        QListWidget::item:hover:!selected {
+        QListView::item:hover:!selected {
             background-color: #3a3c41;
         }
         QScrollBar:vertical {
@@ -480,7 +469,7 @@ class YouTubeDownloaderApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.current_playlist_info = None
-        self.all_videos_in_playlist = []
+        self.single_video = None # معلومات المرئية عندما يعيد الرابط مرئية واحدة بلا قائمة
         self.playlist_title_for_download = None
         self.setWindowTitle("برنامج تحميل الميديا")
         self.setGeometry(250, 150, 800, 600) # حجم أكبر قليلاً
@@ -522,6 +511,11 @@ class YouTubeDownloaderApp(QMainWindow):
         self.fetch_info_button.clicked.connect(self.fetch_video_info_threaded)
         url_layout.addWidget(self.fetch_info_button)
 
+        self.bulk_import_button = QPushButton("استيراد جماعي")
+        self.bulk_import_button.setToolTip("لصق عدد كبير من الروابط أو تحميلها من ملف نصي")
+        self.bulk_import_button.clicked.connect(self.bulk_import_threaded)
+        url_layout.addWidget(self.bulk_import_button)
+
         self.clear_url_button = QPushButton("مسح")
         self.clear_url_button.clicked.connect(self.clear_url_and_list)
         url_layout.addWidget(self.clear_url_button)
@@ -529,9 +523,20 @@ class YouTubeDownloaderApp(QMainWindow):
 
         self.video_list_label = QLabel("المرئيات في القائمة (حدد للتحميل):")
         main_tab_layout.addWidget(self.video_list_label)
-        self.video_list_widget = QListWidget()
+        self.video_list_model = VideoListModel(self)
+        self.video_list_widget = QListView()
+        self.video_list_widget.setModel(self.video_list_model)
         self.video_list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.video_list_widget.setIconSize(QSize(96, 54))
+        self.video_list_widget.setUniformItemSizes(True) # يسرّع حساب الصفوف الظاهرة في القوائم الطويلة
         main_tab_layout.addWidget(self.video_list_widget)
+        self.thumbnail_loader = ThumbnailLoader()
+        self.thumbnail_loader.thumbnail_ready.connect(self.set_video_thumbnail)
+        self.thumbnail_timer = QTimer(self)
+        self.thumbnail_timer.setSingleShot(True)
+        self.thumbnail_timer.setInterval(120)
+        self.thumbnail_timer.timeout.connect(self.load_visible_thumbnails)
+        self.video_list_widget.verticalScrollBar().valueChanged.connect(lambda value: self.thumbnail_timer.start())
         self.video_list_widget.setVisible(False)
         self.video_list_label.setVisible(False)
 
@@ -545,6 +550,19 @@ class YouTubeDownloaderApp(QMainWindow):
         playlist_actions_layout.addWidget(self.deselect_all_button)
         playlist_actions_layout.addStretch() # لدفع الأزرار
         main_tab_layout.addLayout(playlist_actions_layout)
+
+        clip_layout = QHBoxLayout()
+        clip_layout.setSpacing(8)
+        self.clip_label = QLabel("مقطع زمني:")
+        clip_layout.addWidget(self.clip_label)
+        self.clip_entry = QLineEdit()
+        self.clip_entry.setPlaceholderText("مثال: 1:00-3:30 (فارغ = المرئية كاملة)")
+        clip_layout.addWidget(self.clip_entry, 1)
+        self.apply_clip_button = QPushButton("تطبيق على المحدد")
+        self.apply_clip_button.clicked.connect(self.apply_clip_to_selected)
+        self.apply_clip_button.setVisible(False)
+        clip_layout.addWidget(self.apply_clip_button)
+        main_tab_layout.addLayout(clip_layout)
         self.select_all_button.setVisible(False)
         self.deselect_all_button.setVisible(False)
 
@@ -565,12 +583,67 @@ class YouTubeDownloaderApp(QMainWindow):
         self.quality_combo.setCurrentText(self.config.get("quality", "متوسطة"))
         settings_layout.addWidget(self.quality_combo)
 
+        self.output_profile_label = QLabel("ترميز الإخراج:")
+        settings_layout.addWidget(self.output_profile_label)
+        self.output_profile_combo = QComboBox()
+        for profile_name, profile in OUTPUT_PROFILES.items():
+            self.output_profile_combo.addItem(profile["label"], profile_name)
+        self.output_profile_combo.setCurrentIndex(max(0, self.output_profile_combo.findData(
+            self.config.get("output_profile", DEFAULT_ENGINE_SETTINGS["output_profile"]))))
+        self.output_profile_combo.setToolTip("إعادة ترميز الملفات بعد التحميل في عمليات منفصلة لتقليل حجمها")
+        settings_layout.addWidget(self.output_profile_combo)
+        self.target_size_spinbox = QSpinBox()
+        self.target_size_spinbox.setRange(10, 10000)
+        self.target_size_spinbox.setSuffix(" MB")
+        self.target_size_spinbox.setValue(self.config.get("output_target_mb", DEFAULT_ENGINE_SETTINGS["output_target_mb"]))
+        self.target_size_spinbox.setToolTip("الحجم المستهدف لكل مرئية مع H.264/H.265")
+        settings_layout.addWidget(self.target_size_spinbox)
+
         self.subtitles_checkbox = QCheckBox("تحميل الترجمة (إن وجدت)")
         self.subtitles_checkbox.setChecked(self.config.get("subtitles", False))
         settings_layout.addWidget(self.subtitles_checkbox)
         settings_layout.addStretch()
         main_tab_layout.addLayout(settings_layout)
 
+        performance_layout = QHBoxLayout()
+        performance_layout.setSpacing(10)
+        self.fragments_label = QLabel("الأجزاء المتزامنة:")
+        performance_layout.addWidget(self.fragments_label)
+        self.fragments_spinbox = QSpinBox()
+        self.fragments_spinbox.setRange(1, 16)
+        self.fragments_spinbox.setValue(self.config.get("concurrent_fragments", DEFAULT_ENGINE_SETTINGS["concurrent_fragments"]))
+        self.fragments_spinbox.setToolTip("عدد أجزاء DASH/HLS التي تُحمّل بالتوازي لكل مرئية")
+        performance_layout.addWidget(self.fragments_spinbox)
+        self.adaptive_fragments_checkbox = QCheckBox("ضبط تلقائي حسب سرعة الاتصال")
+        self.adaptive_fragments_checkbox.setChecked(self.config.get("adaptive_fragments", DEFAULT_ENGINE_SETTINGS["adaptive_fragments"]))
+        performance_layout.addWidget(self.adaptive_fragments_checkbox)
+        self.dedup_store_checkbox = QCheckBox("عدم تكرار الملفات (مخزن موحد)")
+        self.dedup_store_checkbox.setChecked(self.config.get("dedup_store", DEFAULT_ENGINE_SETTINGS["dedup_store"]))
+        self.dedup_store_checkbox.setToolTip("تخزين كل مرئية مرة واحدة وربطها بمجلدات قوائم التشغيل بدلاً من تحميلها مجدداً")
+        performance_layout.addWidget(self.dedup_store_checkbox)
+        self.stream_audio_checkbox = QCheckBox("تحويل mp3 أثناء التحميل")
+        self.stream_audio_checkbox.setChecked(self.config.get("stream_audio", DEFAULT_ENGINE_SETTINGS["stream_audio"]))
+        self.stream_audio_checkbox.setToolTip("تمرير الصوت مباشرة إلى FFmpeg دون حفظ ملف وسيط على القرص")
+        performance_layout.addWidget(self.stream_audio_checkbox)
+        self.profiling_checkbox = QCheckBox("وضع التحليل الأدائي")
+        self.profiling_checkbox.setChecked(self.config.get("profiling", DEFAULT_ENGINE_SETTINGS["profiling"]))
+        self.profiling_checkbox.setToolTip("حفظ ملفات cProfile وملخص الذاكرة لكل مرحلة (يبطئ التحميل قليلاً)")
+        performance_layout.addWidget(self.profiling_checkbox)
+        self.progressive_checkbox = QCheckBox("تشغيل أثناء التحميل")
+        self.progressive_checkbox.setChecked(self.config.get("progressive", DEFAULT_ENGINE_SETTINGS["progressive"]))
+        self.progressive_checkbox.setToolTip("تفضيل صيغ mp4 المدمجة مسبقاً وتشغيلها من رابط محلي قبل اكتمال التحميل")
+        performance_layout.addWidget(self.progressive_checkbox)
+        self.schedule_button = QPushButton("جدول التحميل")
+        self.schedule_button.setToolTip("نوافذ زمنية للتحميل مع حد سرعة لكل نافذة")
+        self.schedule_button.clicked.connect(self.edit_schedule)
+        performance_layout.addWidget(self.schedule_button)
+        self.network_paths_button = QPushButton("مسارات الشبكة")
+        self.network_paths_button.setToolTip("توزيع التحميلات على عدة واجهات أو وكلاء مع تجنب المسار البطيء")
+        self.network_paths_button.clicked.connect(self.edit_network_paths)
+        performance_layout.addWidget(self.network_paths_button)
+        performance_layout.addStretch()
+        main_tab_layout.addLayout(performance_layout)
+
         dir_layout = QHBoxLayout()
         dir_layout.setSpacing(8)
         self.dir_label_prefix = QLabel("مجلد الحفظ:")
@@ -581,8 +654,28 @@ class YouTubeDownloaderApp(QMainWindow):
         self.select_dir_button = QPushButton("اختيار المجلد")
         self.select_dir_button.clicked.connect(self.select_directory)
         dir_layout.addWidget(self.select_dir_button)
+        self.verify_library_button = QPushButton("فحص سلامة المكتبة")
+        self.verify_library_button.setToolTip("مطابقة بصمات الملفات المحفوظة وفحصها بـ ffprobe وإعادة تحميل التالف فقط")
+        self.verify_library_button.clicked.connect(self.verify_library_threaded)
+        dir_layout.addWidget(self.verify_library_button)
         main_tab_layout.addLayout(dir_layout)
 
+        staging_layout = QHBoxLayout()
+        staging_layout.setSpacing(8)
+        self.staging_label_prefix = QLabel("مجلد التجهيز:")
+        staging_layout.addWidget(self.staging_label_prefix)
+        self.staging_label = QLabel(self.config.get("staging_dir") or "بدون (التحميل مباشرة في مجلد الحفظ)")
+        self.staging_label.setWordWrap(True)
+        self.staging_label.setToolTip("مجلد على قرص محلي سريع يتم فيه التحميل والدمج، ثم يُنقل الملف النهائي لمجلد الحفظ")
+        staging_layout.addWidget(self.staging_label, 1)
+        self.select_staging_button = QPushButton("اختيار")
+        self.select_staging_button.clicked.connect(self.select_staging_directory)
+        staging_layout.addWidget(self.select_staging_button)
+        self.clear_staging_button = QPushButton("إلغاء")
+        self.clear_staging_button.clicked.connect(self.clear_staging_directory)
+        staging_layout.addWidget(self.clear_staging_button)
+        main_tab_layout.addLayout(staging_layout)
+
         download_controls_layout = QHBoxLayout()
         download_controls_layout.setSpacing(8)
         self.download_button = QPushButton("بدء التحميل")
@@ -593,6 +686,13 @@ class YouTubeDownloaderApp(QMainWindow):
         self.stop_button.clicked.connect(self.confirm_stop_download)
         self.stop_button.setEnabled(False)
         download_controls_layout.addWidget(self.stop_button, 1)
+
+        self.play_button = QPushButton("▶ تشغيل")
+        self.play_button.setToolTip("فتح آخر مرئية جاهزة للتشغيل أثناء التحميل في المشغل الافتراضي")
+        self.play_button.clicked.connect(self.play_stream)
+        self.play_button.setEnabled(False)
+        self.stream_url = None
+        download_controls_layout.addWidget(self.play_button)
         main_tab_layout.addLayout(download_controls_layout)
 
         self.status_label = QLabel("الحالة: جاهز")
@@ -612,6 +712,16 @@ class YouTubeDownloaderApp(QMainWindow):
 
         self.log_message("تم تهيئة التطبيق.")
 
+    def on_window_shown(self):
+        elapsed_ms = (time.perf_counter() - STARTUP_STARTED) * 1000
+        self.log_message(f"ظهرت النافذة خلال {elapsed_ms:.0f} مللي ثانية.")
+        if "--startup-benchmark" in sys.argv:
+            print(f"time_to_window_ms={elapsed_ms:.1f}")
+            QApplication.instance().quit()
+            return
+        # تحميل yt-dlp وسجل المستخرجات في الخلفية بعد أن أصبحت النافذة تفاعلية
+        preload_yt_dlp_in_background()
+
     def check_and_create_download_dir(self):
         save_dir = self.config.get("save_dir", self.DEFAULT_DOWNLOAD_DIR)
         if not os.path.exists(save_dir):
@@ -631,12 +741,15 @@ class YouTubeDownloaderApp(QMainWindow):
                     if "format" not in self.config: self.config["format"] = "mp4"
                     if "quality" not in self.config: self.config["quality"] = "متوسطة"
                     if "subtitles" not in self.config: self.config["subtitles"] = False
+                    for key, value in DEFAULT_ENGINE_SETTINGS.items():
+                        if key not in self.config: self.config[key] = value
                     return
         except Exception as e:
             print(f"خطأ في تحميل الإعدادات: {e}")
         self.config = {
             "save_dir": self.DEFAULT_DOWNLOAD_DIR, "format": "mp4",
-            "quality": "متوسطة", "subtitles": False
+            "quality": "متوسطة", "subtitles": False,
+            **DEFAULT_ENGINE_SETTINGS
         }
 
     def save_config(self):
@@ -644,6 +757,14 @@ class YouTubeDownloaderApp(QMainWindow):
         self.config["format"] = self.format_combo.currentText()
         self.config["quality"] = self.quality_combo.currentText()
         self.config["subtitles"] = self.subtitles_checkbox.isChecked()
+        self.config["concurrent_fragments"] = self.fragments_spinbox.value()
+        self.config["adaptive_fragments"] = self.adaptive_fragments_checkbox.isChecked()
+        self.config["dedup_store"] = self.dedup_store_checkbox.isChecked()
+        self.config["stream_audio"] = self.stream_audio_checkbox.isChecked()
+        self.config["profiling"] = self.profiling_checkbox.isChecked()
+        self.config["progressive"] = self.progressive_checkbox.isChecked()
+        self.config["output_profile"] = self.output_profile_combo.currentData()
+        self.config["output_target_mb"] = self.target_size_spinbox.value()
         try:
             with open(self.CONFIG_FILE, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, ensure_ascii=False, indent=4)
@@ -651,6 +772,12 @@ class YouTubeDownloaderApp(QMainWindow):
         except Exception as e:
             self.log_message(f"خطأ في حفظ الإعدادات: {e}")
 
+    def engine_settings(self):
+        settings = {key: self.config.get(key, value) for key, value in DEFAULT_ENGINE_SETTINGS.items()}
+        if "--profile" in sys.argv:
+            settings["profiling"] = True
+        return settings
+
     def log_message(self, message):
         self.log_output.appendPlainText(message)
         self.log_output.verticalScrollBar().setValue(self.log_output.verticalScrollBar().maximum())
@@ -658,26 +785,71 @@ class YouTubeDownloaderApp(QMainWindow):
 
     def clear_url_and_list(self):
         self.url_entry.clear()
-        self.video_list_widget.clear()
-        self.all_videos_in_playlist = []
+        self.video_list_model.set_snapshot(None)
+        self.thumbnail_loader.reset()
+        self.single_video = None
         self.playlist_title_for_download = None
         self.video_list_widget.setVisible(False)
         self.video_list_label.setVisible(False)
         self.select_all_button.setVisible(False)
         self.deselect_all_button.setVisible(False)
+        self.apply_clip_button.setVisible(False)
         self.status_label.setText("الحالة: جاهز")
         self.progress_bar.setValue(0)
         self.progress_bar.setFormat("%p%")
         self.log_message("تم مسح حقل الرابط وقائمة المرئيات.")
 
 
+    def load_visible_thumbnails(self):
+        # جلب الصور للصفوف الظاهرة فقط مع هامش صغير، لا للقائمة كاملة
+        widget = self.video_list_widget
+        count = self.video_list_model.rowCount()
+        if not widget.isVisible() or count == 0:
+            return
+        viewport = widget.viewport()
+        first = widget.indexAt(QPoint(0, 0)).row()
+        last = widget.indexAt(QPoint(0, viewport.height() - 1)).row()
+        first = max(first, 0)
+        last = count - 1 if last < 0 else last
+        for row in range(max(0, first - 5), min(count, last + 6)):
+            if row not in self.video_list_model.icons:
+                self.thumbnail_loader.request(self.video_list_model.video(row))
+
+    def set_video_thumbnail(self, video_id, data):
+        pixmap = QPixmap()
+        if pixmap.loadFromData(data):
+            self.video_list_model.set_icon(video_id, QIcon(pixmap))
+
+    def selected_video_rows(self):
+        return sorted(index.row() for index in self.video_list_widget.selectionModel().selectedRows())
+
     def select_all_videos(self):
-        for i in range(self.video_list_widget.count()):
-            self.video_list_widget.item(i).setSelected(True)
+        self.video_list_widget.selectAll()
 
     def deselect_all_videos(self):
-        for i in range(self.video_list_widget.count()):
-            self.video_list_widget.item(i).setSelected(False)
+        self.video_list_widget.clearSelection()
+
+    def read_clip_entry(self):
+        text = self.clip_entry.text().strip()
+        if not text:
+            return None
+        try:
+            return parse_clip_range(text)
+        except ValueError as e:
+            QMessageBox.warning(self, "تنبيه", str(e))
+            raise
+
+    def apply_clip_to_selected(self):
+        selected_rows = self.selected_video_rows()
+        if not selected_rows:
+            QMessageBox.information(self, "معلومة", "الرجاء تحديد مرئية واحد على الأقل لتطبيق المقطع.")
+            return
+        try:
+            clip = self.read_clip_entry()
+        except ValueError:
+            return
+        self.video_list_model.set_clip(selected_rows, clip)
+        self.log_message(f"تم تطبيق المقطع '{self.clip_entry.text().strip() or 'كامل'}' على {len(selected_rows)} مرئية.")
 
     def fetch_video_info_threaded(self):
         url = self.url_entry.text().strip()
@@ -690,7 +862,35 @@ class YouTubeDownloaderApp(QMainWindow):
         self.fetch_info_button.setEnabled(False)
         self.download_button.setEnabled(False)
 
-        self.worker = DownloadWorker(url, "", "", "", False)
+        self.worker = DownloadWorker(url, self.dir_label.text(), "", "", False, engine_settings=self.engine_settings())
+        self.start_info_thread(self.worker.run_get_info)
+
+    def bulk_import_threaded(self):
+        text, ok = QInputDialog.getMultiLineText(self, "استيراد جماعي",
+                                                 "الصق الروابط (رابط في كل سطر)، أو اترك الحقل فارغاً لاختيار ملف نصي:")
+        if not ok:
+            return
+        if not text.strip():
+            file_path, _ = QFileDialog.getOpenFileName(self, "اختر ملف الروابط", "", "ملفات نصية (*.txt);;كل الملفات (*)")
+            if not file_path:
+                return
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except OSError as e:
+                QMessageBox.warning(self, "خطأ", f"تعذرت قراءة الملف: {e}")
+                return
+
+        self.status_label.setText("الحالة: جاري الاستيراد الجماعي...")
+        self.fetch_info_button.setEnabled(False)
+        self.bulk_import_button.setEnabled(False)
+        self.download_button.setEnabled(False)
+
+        self.worker = DownloadWorker(text, "", "", "", False)
+        self.worker.status_updated.connect(self.update_status)
+        self.start_info_thread(self.worker.run_bulk_import)
+
+    def start_info_thread(self, run_slot):
         self.thread = QThread()
         self.worker.moveToThread(self.thread)
 
@@ -698,7 +898,7 @@ class YouTubeDownloaderApp(QMainWindow):
         self.worker.error_signal.connect(self.handle_error)
         self.worker.log_message_signal.connect(self.log_message)
 
-        self.thread.started.connect(self.worker.run_get_info)
+        self.thread.started.connect(run_slot)
         self.thread.finished.connect(self.thread.deleteLater)
         self.worker.info_fetched_signal.connect(lambda: (self.thread.quit() if self.thread else None))
         self.worker.error_signal.connect(lambda: (self.thread.quit() if self.thread else None))
@@ -707,41 +907,43 @@ class YouTubeDownloaderApp(QMainWindow):
 
     def handle_video_info_fetched(self, result):
         self.fetch_info_button.setEnabled(True)
+        self.bulk_import_button.setEnabled(True)
         self.download_button.setEnabled(True)
 
-        videos = result.get("videos", [])
+        count = result.get("count", 0)
         self.playlist_title_for_download = result.get("playlist_title")
 
-        self.all_videos_in_playlist = videos
-        self.video_list_widget.clear()
+        self.single_video = None
+        self.video_list_model.set_snapshot(result.get("snapshot_path"), result.get("clips"))
+        self.thumbnail_loader.reset()
 
-        if not videos:
+        if not count:
             self.status_label.setText("الحالة: لم يتم العثور على مرئيةهات.")
             self.log_message("لم يتم العثور على مرئيةهات في الرابط المقدم.")
             self.video_list_widget.setVisible(False)
             self.video_list_label.setVisible(False)
             self.select_all_button.setVisible(False)
             self.deselect_all_button.setVisible(False)
+            self.apply_clip_button.setVisible(False)
             return
 
-        if len(videos) > 1 or self.playlist_title_for_download:
+        if count > 1 or self.playlist_title_for_download:
             self.video_list_label.setText(f"المرئيات في '{self.playlist_title_for_download or 'القائمة الحالية'}':")
             self.video_list_widget.setVisible(True)
             self.video_list_label.setVisible(True)
             self.select_all_button.setVisible(True)
             self.deselect_all_button.setVisible(True)
-            for video in videos:
-                item = QListWidgetItem(f"{video['title']}")
-                item.setData(Qt.UserRole, video)
-                self.video_list_widget.addItem(item)
-            self.status_label.setText(f"الحالة: تم جلب {len(videos)} مرئية. حدد المطلوب واضغط تحميل.")
-            self.log_message(f"تم عرض {len(videos)} مرئية في القائمة.")
+            self.apply_clip_button.setVisible(True)
+            self.thumbnail_timer.start()
+            self.status_label.setText(f"الحالة: تم جلب {count} مرئية. حدد المطلوب واضغط تحميل.")
+            self.log_message(f"تم عرض {count} مرئية في القائمة.")
         else:
-            video = videos[0]
+            video = self.single_video = self.video_list_model.video(0)
             self.video_list_widget.setVisible(False)
             self.video_list_label.setVisible(False)
             self.select_all_button.setVisible(False)
             self.deselect_all_button.setVisible(False)
+            self.apply_clip_button.setVisible(False)
             self.status_label.setText(f"الحالة: جاهز لتحميل '{video['title'][:50]}...'")
             self.log_message(f"تم جلب معلومات المرئية الواحد: {video['title']}")
 
@@ -753,9 +955,53 @@ class YouTubeDownloaderApp(QMainWindow):
             self.save_config()
             self.log_message(f"تم تحديد مجلد الحفظ: {selected_dir}")
 
+    def select_staging_directory(self):
+        selected_dir = QFileDialog.getExistingDirectory(self, "اختر مجلد التجهيز", self.config.get("staging_dir") or "")
+        if selected_dir:
+            self.config["staging_dir"] = selected_dir
+            self.staging_label.setText(selected_dir)
+            self.save_config()
+            self.log_message(f"تم تحديد مجلد التجهيز: {selected_dir}")
+
+    def edit_schedule(self):
+        text, ok = QInputDialog.getMultiLineText(
+            self, "جدول التحميل",
+            "نافذة في كل سطر بالصيغة: بداية-نهاية الحد بالميجابايت/ثانية (0 بلا حد)\n"
+            "مثال:\n09:00-18:00 2\n18:00-09:00 0\nاترك الحقل فارغاً للتحميل في أي وقت بلا حد.",
+            format_schedule_text(self.config.get("schedule", [])))
+        if not ok:
+            return
+        try:
+            windows = parse_schedule_text(text)
+        except ValueError as e:
+            QMessageBox.warning(self, "خطأ", str(e))
+            return
+        self.config["schedule"] = windows
+        self.save_config()
+        self.log_message(f"تم حفظ جدول التحميل ({len(windows)} نافذة)." if windows else "تم إلغاء جدول التحميل.")
+
+    def edit_network_paths(self):
+        text, ok = QInputDialog.getMultiLineText(
+            self, "مسارات الشبكة",
+            "مسار في كل سطر: عنوان IP محلي لواجهة الخروج أو رابط وكيل\n"
+            "مثال:\n192.168.1.20\n10.0.0.5\nsocks5://127.0.0.1:1080\nاترك الحقل فارغاً لاستخدام المسار الافتراضي.",
+            "\n".join(self.config.get("network_paths", [])))
+        if not ok:
+            return
+        paths = [line.strip() for line in text.splitlines() if line.strip()]
+        self.config["network_paths"] = paths
+        self.save_config()
+        self.log_message(f"تم حفظ مسارات الشبكة ({len(paths)} مسار)." if paths else "تم إلغاء مسارات الشبكة.")
+
+    def clear_staging_directory(self):
+        self.config["staging_dir"] = ""
+        self.staging_label.setText("بدون (التحميل مباشرة في مجلد الحفظ)")
+        self.save_config()
+        self.log_message("تم إلغاء مجلد التجهيز.")
+
     def start_download_threaded(self):
         url = self.url_entry.text().strip()
-        if not url and not (self.video_list_widget.isVisible() and self.video_list_widget.selectedItems()):
+        if not url and not (self.video_list_widget.isVisible() and self.selected_video_rows()):
             QMessageBox.warning(self, "تنبيه", "الرجاء إدخال رابط الميديا أو تحديد مرئيةهات من القائمة.")
             return
 
@@ -772,24 +1018,34 @@ class YouTubeDownloaderApp(QMainWindow):
         selected_videos_to_download = []
         is_playlist_download = False
 
-        if self.video_list_widget.isVisible() and self.video_list_widget.count() > 0:
-            selected_items = self.video_list_widget.selectedItems()
-            if not selected_items:
+        if self.video_list_widget.isVisible() and self.video_list_model.rowCount() > 0:
+            selected_rows = self.selected_video_rows()
+            if not selected_rows:
                 QMessageBox.information(self, "معلومة", "الرجاء تحديد مرئية واحد على الأقل من القائمة للتحميل.")
                 return
-            for item in selected_items:
-                selected_videos_to_download.append(item.data(Qt.UserRole))
+            # القواميس تُبنى هنا للصفوف المحددة فقط
+            selected_videos_to_download = [self.video_list_model.video(row) for row in selected_rows]
             is_playlist_download = True
             self.log_message(f"تم تحديد {len(selected_videos_to_download)} مرئية من القائمة للتحميل.")
 
-        elif self.all_videos_in_playlist and len(self.all_videos_in_playlist) == 1 and not self.playlist_title_for_download:
-            selected_videos_to_download = self.all_videos_in_playlist
+        elif self.single_video and not self.playlist_title_for_download:
+            selected_videos_to_download = [self.single_video]
+            try:
+                clip = self.read_clip_entry()
+            except ValueError:
+                return
+            if clip:
+                selected_videos_to_download = [dict(selected_videos_to_download[0], clip=clip)]
             self.log_message(f"سيتم تحميل المرئية الواحد الذي تم جلب معلوماته: {selected_videos_to_download[0]['title']}")
 
         elif not url: # إذا لم يكن هناك رابط ولا قائمة محددة
              QMessageBox.warning(self, "تنبيه", "الرجاء إدخال رابط الميديا أولاً.")
              return
 
+        elif self.clip_entry.text().strip():
+            QMessageBox.information(self, "معلومة", "لتحميل مقطع زمني، اضغط \"جلب المعلومات\" أولاً.")
+            return
+
 
         download_dir = self.dir_label.text()
         quality = self.quality_combo.currentText()
@@ -804,12 +1060,31 @@ class YouTubeDownloaderApp(QMainWindow):
         self.download_button.setEnabled(False)
         self.stop_button.setEnabled(True)
         self.fetch_info_button.setEnabled(False)
+        self.bulk_import_button.setEnabled(False)
+        self.verify_library_button.setEnabled(False)
 
         actual_playlist_title_for_worker = self.playlist_title_for_download if is_playlist_download else None
 
         self.worker = DownloadWorker(url, download_dir, quality, file_type, download_subtitles,
                                      selected_videos_to_download if selected_videos_to_download else None,
-                                     actual_playlist_title_for_worker)
+                                     actual_playlist_title_for_worker, self.engine_settings())
+        self.start_download_thread(self.worker.run_download)
+
+    def verify_library_threaded(self):
+        self.save_config()
+        self.status_label.setText("الحالة: جاري فحص سلامة المكتبة...")
+        self.progress_bar.setValue(0)
+        self.download_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.fetch_info_button.setEnabled(False)
+        self.bulk_import_button.setEnabled(False)
+        self.verify_library_button.setEnabled(False)
+
+        self.worker = DownloadWorker("", self.dir_label.text(), self.quality_combo.currentText(), "", False,
+                                     engine_settings=self.engine_settings())
+        self.start_download_thread(self.worker.run_verify_library)
+
+    def start_download_thread(self, run_slot):
         self.thread = QThread()
         self.worker.moveToThread(self.thread)
 
@@ -818,8 +1093,9 @@ class YouTubeDownloaderApp(QMainWindow):
         self.worker.download_finished_signal.connect(self.on_single_download_finished)
         self.worker.error_signal.connect(self.handle_error)
         self.worker.log_message_signal.connect(self.log_message)
+        self.worker.stream_ready_signal.connect(self.on_stream_ready)
 
-        self.thread.started.connect(self.worker.run_download)
+        self.thread.started.connect(run_slot)
         self.thread.finished.connect(self.thread.deleteLater)
         self.worker.status_updated.connect(self.check_if_all_done)
 
@@ -854,6 +1130,15 @@ class YouTubeDownloaderApp(QMainWindow):
              self.progress_bar.setFormat(f"اكتمل: {short_filename}")
 
 
+    def on_stream_ready(self, title, url):
+        self.stream_url = url
+        self.play_button.setEnabled(True)
+        self.play_button.setToolTip(f"تشغيل: {title}")
+
+    def play_stream(self):
+        if self.stream_url:
+            QDesktopServices.openUrl(QUrl(self.stream_url))
+
     def update_status(self, message):
         self.status_label.setText(f"الحالة: {message}")
 
@@ -872,6 +1157,8 @@ class YouTubeDownloaderApp(QMainWindow):
         self.download_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.fetch_info_button.setEnabled(True)
+        self.bulk_import_button.setEnabled(True)
+        self.verify_library_button.setEnabled(True)
 
         if stop_event.is_set():
             self.status_label.setText("الحالة: تم إيقاف التحميل.")
@@ -895,6 +1182,7 @@ class YouTubeDownloaderApp(QMainWindow):
         self.download_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.fetch_info_button.setEnabled(True)
+        self.bulk_import_button.setEnabled(True)
 
         if self.thread and self.thread.isRunning():
             self.thread.quit()
@@ -916,6 +1204,8 @@ class YouTubeDownloaderApp(QMainWindow):
                 event.ignore()
         else:
             event.accept()
+        if event.isAccepted():
+            self.video_list_model.set_snapshot(None) # حذف ملف لقطة القائمة المعروضة
 
 
 if __name__ == '__main__':
@@ -929,4 +1219,5 @@ if __name__ == '__main__':
 
     main_win = YouTubeDownloaderApp()
     main_win.show()
+    QTimer.singleShot(0, main_win.on_window_shown)
     sys.exit(app.exec_())
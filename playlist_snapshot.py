@@ -0,0 +1,212 @@
+import os
+import mmap
+import heapq
+import struct
+
+# التخطيط: ترويسة | سجلات ثابتة العرض بترتيب القائمة | فهرس أرقام السجلات مرتباً حسب المعرّف | جدول النصوص (UTF-8)
+SNAPSHOT_MAGIC = b"DTPS"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<4sHHIQQQII') # السحر، الإصدار، محجوز، العدد، بداية السجلات، بداية الفهرس، بداية النصوص، موضع وطول عنوان القائمة
+# موضع المعرّف، موضع العنوان، موضع الرابط، أطوالها، المدة بالثواني، الحجم بالبايت
+RECORD = struct.Struct('<IIIHHHIQ')
+INDEX_ITEM = struct.Struct('<IIH') # رقم السجل مع موضع المعرّف وطوله حتى لا يقرأ البحث السجل نفسه
+YOUTUBE_URL_PREFIX = "https://www.youtube.com/watch?v="
+
+
+class _StringTable:
+    # النصوص المكررة تُخزن مرة واحدة؛ base نصوص لقطة موجودة تُنسخ كما هي عند الإضافة إليها
+    def __init__(self, base=b''):
+        self.data = bytearray(base)
+        self._offsets = {}
+
+    def add(self, text):
+        data = (text or "").encode('utf-8')
+        if len(data) > 0xFFFF:
+            # القص على حدود حرف كامل حتى لا يبقى حرف متعدد البايتات مقطوعاً يفشل فكه عند القراءة
+            data = data[:0xFFFF].decode('utf-8', 'ignore').encode('utf-8')
+        if data not in self._offsets:
+            self._offsets[data] = len(self.data)
+            self.data.extend(data)
+        return self._offsets[data], len(data)
+
+
+def _encode_records(videos, strings, first_position=0):
+    # يعيد السجلات وعناصر الفهرس (المعرّف، العنصر المحزوم) غير مرتبة
+    records = bytearray()
+    index_items = []
+    for position, video in enumerate(videos, first_position):
+        video_id = video["id"]
+        id_offset, id_length = strings.add(video_id)
+        title_offset, title_length = strings.add(video.get("title"))
+        url = video.get("url") or ""
+        # رابط يوتيوب القياسي يُعاد بناؤه من المعرّف بدلاً من تخزينه
+        url_offset, url_length = (0, 0) if url == YOUTUBE_URL_PREFIX + video_id else strings.add(url)
+        records.extend(RECORD.pack(id_offset, title_offset, url_offset, id_length, title_length, url_length,
+                                   int(video.get("duration") or 0), int(video.get("filesize") or 0)))
+        index_items.append((video_id.encode('utf-8'), INDEX_ITEM.pack(position, id_offset, id_length)))
+    return records, index_items
+
+
+def _pack_snapshot(records, index_items, strings, count, title_offset, title_length):
+    records_offset = HEADER.size
+    index_offset = records_offset + len(records)
+    strings_offset = index_offset + count * INDEX_ITEM.size
+    return b''.join((HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, count, records_offset, index_offset, strings_offset,
+                                 title_offset, title_length),
+                     records,
+                     b''.join(item for _, item in index_items),
+                     strings.data))
+
+
+def encode_snapshot(videos, playlist_title=None):
+    strings = _StringTable()
+    title_offset, title_length = strings.add(playlist_title)
+    records, index_items = _encode_records(videos, strings)
+    index_items.sort(key=lambda item: item[0])
+    return _pack_snapshot(records, index_items, strings, len(index_items), title_offset, title_length)
+
+
+def write_snapshot_data(path, data):
+    # ويندوز يرفض استبدال ملف ما زال مفتوحاً بـ mmap، لذا تُغلق اللقطة القديمة قبل هذا الاستدعاء
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def write_snapshot(path, videos, playlist_title=None):
+    write_snapshot_data(path, encode_snapshot(videos, playlist_title))
+
+
+def append_snapshot(path, videos, playlist_title=None):
+    # يضيف العناصر غير الموجودة ويعيد عددها. السجلات وجدول النصوص القديمة تُنسخ كما هي والفهرس يُدمج،
+    # فلا يُبنى قاموس لأي سجل قديم مهما كبرت القائمة
+    try:
+        snapshot = PlaylistSnapshot(path)
+    except FileNotFoundError:
+        snapshot = None
+    if snapshot is None:
+        additions = list({video["id"]: video for video in videos}.values())
+        if additions:
+            write_snapshot(path, additions, playlist_title)
+        return len(additions)
+    with snapshot:
+        additions = {}
+        for video in videos:
+            if video["id"] not in additions and video["id"] not in snapshot:
+                additions[video["id"]] = video
+        if not additions:
+            return 0
+        data = snapshot.extended(additions.values(), playlist_title)
+    write_snapshot_data(path, data)
+    return len(additions)
+
+
+class PlaylistSnapshot:
+    # قراءة كسولة عبر mmap: لا يُبنى قاموس إلا للعنصر المطلوب، والبحث بالمعرّف بحث ثنائي في الفهرس
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError(f"ملف لقطة غير صالح: {path}")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self._count, self._records_offset, self._index_offset, self._strings_offset,
+         title_offset, title_length) = HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self._map.close()
+            raise ValueError(f"ملف لقطة غير صالح: {path}")
+        self.playlist_title = self._string(title_offset, title_length) or None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def _record(self, position):
+        return RECORD.unpack_from(self._map, self._records_offset + position * RECORD.size)
+
+    def _id_bytes(self, position):
+        record = self._record(position)
+        start = self._strings_offset + record[0]
+        return self._map[start:start + record[3]]
+
+    def id_at(self, position):
+        return self._id_bytes(position).decode('utf-8')
+
+    def ids(self):
+        for position in range(self._count):
+            yield self.id_at(position)
+
+    def __getitem__(self, position):
+        if not -self._count <= position < self._count:
+            raise IndexError(position)
+        position %= self._count
+        id_offset, title_offset, url_offset, id_length, title_length, url_length, duration, filesize = self._record(position)
+        video_id = self._string(id_offset, id_length)
+        video = {
+            "title": self._string(title_offset, title_length),
+            "url": self._string(url_offset, url_length) if url_length else YOUTUBE_URL_PREFIX + video_id,
+            "id": video_id,
+        }
+        if duration:
+            video["duration"] = duration
+        if filesize:
+            video["filesize"] = filesize
+        return video
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+
+    def find(self, video_id):
+        # يعيد رقم السجل بترتيب القائمة أو -1
+        target = video_id.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            position, id_offset, id_length = INDEX_ITEM.unpack_from(self._map, self._index_offset + middle * INDEX_ITEM.size)
+            start = self._strings_offset + id_offset
+            current = self._map[start:start + id_length]
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return position
+        return -1
+
+    def _index_items(self):
+        for slot in range(self._count):
+            start = self._index_offset + slot * INDEX_ITEM.size
+            item = self._map[start:start + INDEX_ITEM.size]
+            _, id_offset, id_length = INDEX_ITEM.unpack(item)
+            id_start = self._strings_offset + id_offset
+            yield self._map[id_start:id_start + id_length], item
+
+    def extended(self, videos, playlist_title=None):
+        # بيانات لقطة جديدة = هذه اللقطة + videos، دون فك أي سجل قديم
+        strings = _StringTable(self._map[self._strings_offset:])
+        title_offset, title_length = strings.add(playlist_title if playlist_title is not None else self.playlist_title)
+        records, index_items = _encode_records(videos, strings, self._count)
+        index_items.sort(key=lambda item: item[0])
+        merged = list(heapq.merge(self._index_items(), index_items, key=lambda item: item[0]))
+        return _pack_snapshot(self._map[self._records_offset:self._index_offset] + records, merged, strings,
+                              len(merged), title_offset, title_length)
+
+    def __contains__(self, video_id):
+        return self.find(video_id) >= 0
+
+    def get(self, video_id):
+        position = self.find(video_id)
+        return self[position] if position >= 0 else None
@@ -0,0 +1,142 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+READ_CHUNK = 256 * 1024
+WAIT_INTERVAL = 0.2
+STALL_TIMEOUT = 120 # إغلاق الاتصال إذا لم يصل أي بايت جديد خلال هذه المدة
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class ProgressiveHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_stream(send_body=False)
+
+    def do_GET(self):
+        self.handle_stream(send_body=True)
+
+    def handle_stream(self, send_body):
+        parts = [part for part in self.path.split('/') if part]
+        entry = self.server.entries.get(parts[1]) if len(parts) == 2 and parts[0] == 'stream' else None
+        if entry is None:
+            self.send_error(404)
+            return
+
+        path = self.server.wait_for_file(entry)
+        if path is None:
+            self.send_error(503, "لم يبدأ التحميل بعد")
+            return
+
+        total = os.path.getsize(path) if entry["done"] else entry["total"]
+        start, end = 0, (total - 1 if total else None)
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and total:
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), total - 1)
+            elif match.group(2):
+                start = max(0, total - int(match.group(2)))
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{total}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{total}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', entry["content_type"])
+        self.send_header('Accept-Ranges', 'bytes')
+        if total:
+            self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        try:
+            self.server.copy_range(entry, self.wfile, start, end)
+        except (ConnectionError, OSError):
+            pass
+
+
+class ProgressiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), ProgressiveHandler)
+        self.entries = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def register(self, video_info, content_type="video/mp4"):
+        token = hashlib.sha1(video_info["url"].encode('utf-8')).hexdigest()[:12]
+        self.entries[token] = {"paths": [], "total": None, "done": False, "failed": False,
+                               "content_type": content_type, "updated": time.monotonic()}
+        return token, f"http://{self.server_address[0]}:{self.server_address[1]}/stream/{token}"
+
+    def update(self, token, d):
+        # يُستدعى من خطاف التقدم: yt-dlp يكتب في .part ثم يعيد تسميته، فنتابع الاسمين
+        entry = self.entries[token]
+        entry["paths"] = [path for path in (d.get('filename'), d.get('tmpfilename')) if path]
+        entry["total"] = d.get('total_bytes') or entry["total"]
+        entry["updated"] = time.monotonic()
+
+    def finish(self, token, final_path=None, failed=False):
+        entry = self.entries[token]
+        if final_path:
+            entry["paths"] = [final_path]
+        entry["done"] = True
+        entry["failed"] = failed
+
+    def current_path(self, entry):
+        for path in entry["paths"]:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def wait_for_file(self, entry, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            path = self.current_path(entry)
+            if path or entry["done"]:
+                return path
+            time.sleep(WAIT_INTERVAL)
+        return None
+
+    def copy_range(self, entry, output, start, end):
+        # يتبع الملف أثناء نموه. الملف يُفتح لكل قطعة ثم يُغلق حتى لا يمنع إعادة تسمية .part على ويندوز
+        position = start
+        while end is None or position <= end:
+            path = self.current_path(entry)
+            available = os.path.getsize(path) if path else 0
+            if position < available:
+                length = min(READ_CHUNK, available - position)
+                if end is not None:
+                    length = min(length, end + 1 - position)
+                with open(path, 'rb') as f:
+                    f.seek(position)
+                    data = f.read(length)
+                output.write(data)
+                position += len(data)
+            elif entry["done"] or entry["failed"] or time.monotonic() - entry["updated"] > STALL_TIMEOUT:
+                break
+            else:
+                time.sleep(WAIT_INTERVAL)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_progressive_server():
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ProgressiveServer()
+        return _server
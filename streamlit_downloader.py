@@ -2,8 +2,14 @@ import streamlit as st
 import yt_dlp
 import os
 import re
+import time
+import uuid
+import shutil
+import threading
 from pathlib import Path
 
+from download_engine import parse_clip_range, clip_ydl_options
+
 st.set_page_config(
     page_title="برنامج تحميل الميديا",
     page_icon="📥",
@@ -30,6 +36,146 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+DOWNLOADS_ROOT = "downloads"
+MAX_JOBS_PER_USER = 2
+MAX_BYTES_PER_USER = 2 * 1024 ** 3
+MAX_TOTAL_BYTES = 20 * 1024 ** 3
+FILE_TTL = 6 * 3600 # أقصى عمر لأي ملف على الخادم
+DELIVERED_TTL = 10 * 60 # الملف الذي سُلّم للمستخدم يُحذف بعد هذه المهلة من آخر استخدام
+GC_INTERVAL = 60
+# عناوين الوكلاء العكسيين الموثوقين (مفصولة بفواصل). لا يُقرأ X-Forwarded-For إلا من اتصال قادم منها
+TRUSTED_PROXIES = {address.strip() for address in os.environ.get("DOWNTUBE_TRUSTED_PROXIES", "").split(",") if address.strip()}
+
+
+# --- بداية قسم عزل المستخدمين ---
+class JobRegistry:
+    # حالة مشتركة بين كل الجلسات: المهام الجارية لكل جلسة ولكل مستخدم والملفات المحفوظة وحجمها
+    def __init__(self, root=DOWNLOADS_ROOT):
+        self.root = root
+        self._lock = threading.Lock()
+        self.active_jobs = {} # الجلسة -> عدد مهامها الجارية (لحماية مجلدها من التنظيف)
+        self.client_jobs = {} # المستخدم -> عدد مهامه الجارية في كل تبويباته
+        self.files = {}
+        os.makedirs(root, exist_ok=True)
+
+    def try_start_job(self, session_id, client_id):
+        with self._lock:
+            if self.client_jobs.get(client_id, 0) >= MAX_JOBS_PER_USER:
+                return False
+            self.client_jobs[client_id] = self.client_jobs.get(client_id, 0) + 1
+            self.active_jobs[session_id] = self.active_jobs.get(session_id, 0) + 1
+            return True
+
+    def finish_job(self, session_id, client_id):
+        with self._lock:
+            self.client_jobs[client_id] = max(0, self.client_jobs.get(client_id, 0) - 1)
+            self.active_jobs[session_id] = max(0, self.active_jobs.get(session_id, 0) - 1)
+
+    def client_bytes(self, client_id):
+        with self._lock:
+            return sum(entry["size"] for entry in self.files.values() if entry["client"] == client_id)
+
+    def register(self, session_id, client_id, path):
+        now = time.time()
+        with self._lock:
+            self.files[path] = {"session": session_id, "client": client_id, "size": os.path.getsize(path),
+                                "created": now, "last_access": now, "delivered": False}
+
+    def mark_delivered(self, path):
+        with self._lock:
+            if path in self.files:
+                self.files[path]["delivered"] = True
+                self.files[path]["last_access"] = time.time()
+
+    def _remove(self, path):
+        self.files.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def collect(self):
+        now = time.time()
+        with self._lock:
+            for path, entry in list(self.files.items()):
+                if now - entry["created"] > FILE_TTL or (entry["delivered"] and now - entry["last_access"] > DELIVERED_TTL):
+                    self._remove(path)
+
+            # إذا تجاوز المجموع الحد نحذف الأقدم استخداماً، المسلّم منه أولاً
+            total = sum(entry["size"] for entry in self.files.values())
+            if total > MAX_TOTAL_BYTES:
+                for path, entry in sorted(self.files.items(), key=lambda item: (not item[1]["delivered"], item[1]["last_access"])):
+                    if total <= MAX_TOTAL_BYTES:
+                        break
+                    total -= entry["size"]
+                    self._remove(path)
+
+            # ملفات بقيت من تشغيل سابق للخادم أو من تحميل انقطع ولم تُسجّل
+            for session_dir in os.scandir(self.root):
+                if not session_dir.is_dir():
+                    continue
+                busy = self.active_jobs.get(session_dir.name, 0) > 0
+                for entry in os.scandir(session_dir.path):
+                    if entry.path not in self.files and not busy and now - entry.stat().st_mtime > FILE_TTL:
+                        if entry.is_dir():
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            self._remove(entry.path)
+                if not busy and not os.listdir(session_dir.path):
+                    os.rmdir(session_dir.path)
+
+    def run_gc(self):
+        while True:
+            time.sleep(GC_INTERVAL)
+            try:
+                self.collect()
+            except OSError:
+                pass
+
+
+@st.cache_resource
+def get_job_registry():
+    registry = JobRegistry()
+    threading.Thread(target=registry.run_gc, daemon=True).start()
+    return registry
+
+
+def get_session_dir():
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    session_dir = os.path.join(DOWNLOADS_ROOT, st.session_state['session_id'])
+    os.makedirs(session_dir, exist_ok=True)
+    return session_dir
+
+
+def get_connection_request():
+    # طلب Tornado الذي فتح اتصال الجلسة؛ Streamlit 1.31 لا يوفر st.context فيُقرأ من وقت التشغيل
+    try:
+        from streamlit.runtime import get_instance
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        client = get_instance().get_client(ctx.session_id) if ctx else None
+    except Exception:
+        return None
+    return getattr(client, "request", None)
+
+
+def get_client_id():
+    # الجلسة الواحدة تنفذ سكربتاً واحداً في كل مرة، وكل تبويب جلسة جديدة، فالحصص تُحسب لعنوان المستخدم لا للجلسة
+    request = get_connection_request()
+    if request is None:
+        return st.session_state['session_id']
+    address = request.remote_ip
+    if address in TRUSTED_PROXIES:
+        # العنوان الحقيقي هو آخر عنوان في السلسلة لم يضفه أحد الوكلاء الموثوقين
+        for forwarded in reversed(request.headers.get("X-Forwarded-For", "").split(",")):
+            address = forwarded.strip() or address
+            if address not in TRUSTED_PROXIES:
+                break
+    return address
+# --- نهاية قسم عزل المستخدمين ---
+
+
 def sanitize_filename(filename):
     filename = re.sub(r'[\\/*?:"<>|]', "_", filename)
     filename = re.sub(r'\s+', " ", filename).strip()
@@ -95,11 +241,13 @@ def get_videos_info(url):
     except Exception as e:
         raise Exception(f"خطأ في جلب المعلومات: {str(e)}")
 
-def download_video(url, quality, file_type, progress_placeholder):
-    output_dir = "downloads"
+def download_video(url, quality, file_type, progress_placeholder, clip=None, output_dir=DOWNLOADS_ROOT, max_filesize=None):
     os.makedirs(output_dir, exist_ok=True)
     
-    output_template = os.path.join(output_dir, '%(title)s.%(ext)s')
+    # المعرّف في الاسم يمنع تصادم المرئيات التي تحمل نفس العنوان
+    output_template = os.path.join(output_dir, '%(title)s [%(id)s].%(ext)s')
+    if clip:
+        output_template = os.path.join(output_dir, '%(title)s [%(id)s] [%(section_start)d-%(section_end)d].%(ext)s')
     
     ydl_opts = {
         'format': get_format_options(quality, file_type),
@@ -118,10 +266,16 @@ def download_video(url, quality, file_type, progress_placeholder):
     elif file_type == 'mp4':
         ydl_opts['merge_output_format'] = 'mp4'
     
+    if clip:
+        ydl_opts.update(clip_ydl_options(clip))
+    if max_filesize:
+        ydl_opts['max_filesize'] = max_filesize
+    
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+            downloads = info.get('requested_downloads')
+            filename = downloads[0]['filepath'] if downloads else ydl.prepare_filename(info)
             
             if file_type == 'mp3':
                 filename = filename.rsplit('.', 1)[0] + '.mp3'
@@ -134,6 +288,11 @@ def download_video(url, quality, file_type, progress_placeholder):
 st.title("📥 برنامج تحميل الميديا")
 st.markdown("---")
 
+registry = get_job_registry()
+session_dir = get_session_dir()
+session_id = st.session_state['session_id']
+client_id = get_client_id()
+
 # Sidebar
 with st.sidebar:
     st.header("⚙️ الإعدادات")
@@ -165,7 +324,10 @@ with col2:
     clear_btn = st.button("🗑️ مسح", use_container_width=True)
 
 if clear_btn:
-    st.session_state.clear()
+    # الإبقاء على معرّف الجلسة حتى تبقى الحصص مرتبطة بنفس المستخدم
+    for key in list(st.session_state.keys()):
+        if key != 'session_id':
+            del st.session_state[key]
     st.rerun()
 
 if fetch_info and url:
@@ -195,34 +357,62 @@ if 'video_info' in st.session_state:
         selected_videos = [0]
         st.info(f"📹 {info['videos'][0]['title']}")
 
+    clips = {}
+    with st.expander("⏱️ مقاطع زمنية (اختياري)"):
+        st.caption("اكتب بداية ونهاية المقطع مثل 1:00-3:30، أو اترك الحقل فارغاً لتحميل المرئية كاملة.")
+        for video_idx in selected_videos:
+            clip_text = st.text_input(info['videos'][video_idx]['title'], key=f"clip_{video_idx}")
+            if clip_text.strip():
+                try:
+                    clips[video_idx] = parse_clip_range(clip_text)
+                except ValueError as e:
+                    st.warning(str(e))
+
     if st.button("⬇️ بدء التحميل", use_container_width=True, type="primary"):
+        if not registry.try_start_job(session_id, client_id):
+            st.error(f"❌ لديك {MAX_JOBS_PER_USER} مهام جارية بالفعل في تبويبات أخرى. انتظر حتى تنتهي.")
+            st.stop()
+
         progress_bar = st.progress(0)
         status_text = st.empty()
         
         total = len(selected_videos)
         
-        for idx, video_idx in enumerate(selected_videos):
-            video = info['videos'][video_idx]
-            status_text.text(f"جاري تحميل ({idx+1}/{total}): {video['title'][:50]}...")
-            
-            try:
-                filename = download_video(video['url'], quality, file_type, status_text)
+        try:
+            for idx, video_idx in enumerate(selected_videos):
+                video = info['videos'][video_idx]
+                remaining_bytes = MAX_BYTES_PER_USER - registry.client_bytes(client_id)
+                if remaining_bytes <= 0:
+                    st.error("❌ تم تجاوز المساحة المسموح بها لك. نزّل ملفاتك الحالية وانتظر حذفها ثم حاول مجدداً.")
+                    break
+                status_text.text(f"جاري تحميل ({idx+1}/{total}): {video['title'][:50]}...")
                 
-                # Provide download link
-                if os.path.exists(filename):
-                    with open(filename, 'rb') as f:
-                        st.download_button(
-                            label=f"💾 تحميل: {os.path.basename(filename)}",
-                            data=f,
-                            file_name=os.path.basename(filename),
-                            mime="video/mp4" if file_type == "mp4" else "audio/mpeg"
-                        )
-                    st.success(f"✅ اكتمل: {video['title']}")
+                try:
+                    filename = download_video(video['url'], quality, file_type, status_text, clips.get(video_idx),
+                                              session_dir, remaining_bytes)
+                    
+                    # Provide download link
+                    if os.path.exists(filename):
+                        registry.register(session_id, client_id, filename)
+                        with open(filename, 'rb') as f:
+                            st.download_button(
+                                label=f"💾 تحميل: {os.path.basename(filename)}",
+                                data=f,
+                                file_name=os.path.basename(filename),
+                                mime="video/mp4" if file_type == "mp4" else "audio/mpeg",
+                                on_click=registry.mark_delivered,
+                                args=(filename,)
+                            )
+                        st.success(f"✅ اكتمل: {video['title']}")
+                    else:
+                        st.warning(f"⚠️ لم يُحفظ {video['title']}: قد يتجاوز حجمه المساحة المتبقية لك.")
+                    
+                except Exception as e:
+                    st.error(f"❌ خطأ في {video['title']}: {str(e)}")
                 
-            except Exception as e:
-                st.error(f"❌ خطأ في {video['title']}: {str(e)}")
-            
-            progress_bar.progress((idx + 1) / total)
+                progress_bar.progress((idx + 1) / total)
+        finally:
+            registry.finish_job(session_id, client_id)
         
         status_text.text("✅ اكتملت جميع التحميلات!")
 
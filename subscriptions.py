@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from download_engine import get_videos_info, run_download_queue, stop_event
+from playlist_snapshot import PlaylistSnapshot, write_snapshot, append_snapshot
+
+SUBSCRIPTIONS_FILE = "subscriptions.json"
+DEFAULT_HEAD_SIZE = 15
+DEFAULT_DOWNLOAD_DIR = os.path.join(os.getcwd(), "مجلد_التنزيلات")
+
+
+class SubscriptionManager:
+    def __init__(self, path=SUBSCRIPTIONS_FILE, head_size=DEFAULT_HEAD_SIZE, max_workers=8, log=print):
+        self.path = path
+        self.head_size = head_size
+        self.max_workers = max_workers
+        self.log = log
+        self._lock = threading.Lock()
+        self._snapshot_locks = {} # الرابط -> قفل يمنع فحص الاشتراك وتسجيل تحميلاته من الكتابة فوق بعضهما
+        self._in_flight = set() # معرّفات أُرسلت للتحميل ولم ينته تحميلها بعد
+        # المعرّفات المعروفة لكل اشتراك في لقطة ثنائية بجانب الملف بدلاً من قوائم JSON
+        self.snapshots_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "snapshots")
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        self.subscriptions = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                subscriptions = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        for url, subscription in subscriptions.items():
+            # ترحيل الملفات القديمة التي تحفظ known_ids كقائمة
+            if "known_ids" in subscription:
+                known_ids = subscription.pop("known_ids")
+                if known_ids:
+                    write_snapshot(self.snapshot_path(url), [{"id": video_id} for video_id in known_ids], subscription["title"])
+                subscription["known_count"] = len(known_ids)
+        return subscriptions
+
+    def snapshot_path(self, url):
+        return os.path.join(self.snapshots_dir, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + ".dtps")
+
+    def open_snapshot(self, url):
+        try:
+            return PlaylistSnapshot(self.snapshot_path(url))
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        with self._lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.subscriptions, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+    def add(self, url, download_dir=DEFAULT_DOWNLOAD_DIR, quality="متوسطة", file_type="mp4"):
+        with self._lock:
+            self.subscriptions.setdefault(url, {
+                "title": None, "download_dir": download_dir, "quality": quality, "file_type": file_type,
+                "known_count": 0, "head_ids": [], "pending": [], "last_checked": None,
+            })
+        self.save()
+
+    def remove(self, url):
+        with self._lock:
+            removed = self.subscriptions.pop(url, None) is not None
+        if removed and os.path.exists(self.snapshot_path(url)):
+            os.remove(self.snapshot_path(url))
+        self.save()
+        return removed
+
+    def snapshot_lock(self, url):
+        with self._lock:
+            return self._snapshot_locks.setdefault(url, threading.Lock())
+
+    def check(self, url, enqueue_existing=False):
+        with self.snapshot_lock(url):
+            return self._check(url, enqueue_existing)
+
+    def _check(self, url, enqueue_existing):
+        # يعيد قائمة المرئيات التي يجب تحميلها. الفحص الرخيص أولاً: أول N عناصر فقط،
+        # والتعداد الكامل فقط عند أول مزامنة أو إذا كانت كل عناصر الرأس جديدة (قد توجد فجوة بعدها).
+        # المرئيات الجديدة لا تدخل اللقطة إلا بعد نجاح تحميلها، وحتى ذلك تبقى في pending وتُعاد في الفحص التالي
+        subscription = self.subscriptions[url]
+        pending = subscription.setdefault("pending", [])
+        pending_ids = {video["id"] for video in pending}
+        snapshot = self.open_snapshot(url)
+        # البحث في اللقطة ثنائي عبر mmap، فلا تُبنى مجموعة بكل المعرّفات في الذاكرة
+        known = snapshot if snapshot is not None else ()
+        try:
+            new_videos = []
+            baseline = []
+            if len(known):
+                head = get_videos_info(url, self.head_size)
+                head_ids = [video["id"] for video in head["videos"]]
+                if head_ids == subscription["head_ids"]:
+                    subscription["last_checked"] = time.time()
+                    return self._take_pending(pending)
+                new_videos = [video for video in head["videos"] if video["id"] not in known and video["id"] not in pending_ids]
+                full_walk = len(new_videos) == len(head_ids) and head_ids
+            else:
+                full_walk = True
+
+            if full_walk:
+                info = get_videos_info(url)
+                subscription["title"] = info["playlist_title"] or subscription["title"]
+                first_sync = not len(known)
+                new_videos = [video for video in info["videos"] if video["id"] not in known and video["id"] not in pending_ids]
+                head_ids = [video["id"] for video in info["videos"][:self.head_size]]
+                if first_sync and not enqueue_existing:
+                    # المزامنة الأولى تسجل الموجود كخط أساس دون تحميله
+                    baseline = new_videos
+                    new_videos = []
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+
+        if baseline:
+            added = append_snapshot(self.snapshot_path(url), baseline, subscription["title"])
+            subscription["known_count"] = subscription.get("known_count", 0) + added
+        with self._lock:
+            pending.extend(new_videos)
+        subscription["head_ids"] = head_ids
+        subscription["last_checked"] = time.time()
+        return self._take_pending(pending)
+
+    def _take_pending(self, pending):
+        # العناصر التي ما زالت في طابور التحميل لا تُرسل مرة ثانية
+        with self._lock:
+            videos = [video for video in pending if video["id"] not in self._in_flight]
+            self._in_flight.update(video["id"] for video in videos)
+        return videos
+
+    def record_downloads(self, url, videos, downloaded):
+        # تُستدعى مرة واحدة لكل دفعة: الناجح فقط يُضاف إلى اللقطة دفعة واحدة، والفاشل يبقى في pending ليُعاد في الفحص التالي
+        with self.snapshot_lock(url):
+            with self._lock:
+                self._in_flight.difference_update(video["id"] for video in videos)
+            subscription = self.subscriptions.get(url)
+            if not downloaded or subscription is None:
+                return
+            added = append_snapshot(self.snapshot_path(url), downloaded, subscription["title"])
+            downloaded_ids = {video["id"] for video in downloaded}
+            with self._lock:
+                subscription["known_count"] = subscription.get("known_count", 0) + added
+                subscription["pending"] = [item for item in subscription.get("pending", []) if item["id"] not in downloaded_ids]
+        self.save()
+
+    def download(self, url, videos, log=print):
+        subscription = self.subscriptions[url]
+        # run_download_queue يبلّغ بالعنوان فقط، فتُربط النتيجة بالمرئية عبر عنوانها
+        by_title = {}
+        for video in videos:
+            by_title.setdefault(video.get("title", "مرئية غير مسمى"), []).append(video)
+        downloaded = []
+
+        def on_finished(title, success):
+            matches = by_title.get(title)
+            if matches:
+                video = matches.pop(0)
+                if success:
+                    downloaded.append(video)
+
+        try:
+            run_download_queue(videos, subscription["download_dir"], subscription["quality"],
+                               subscription["file_type"], False, subscription["title"],
+                               on_log=log, on_error=log, on_finished=on_finished)
+        finally:
+            # ما لم يصل إليه الطابور (إيقاف أو خطأ) يعود قابلاً للإرسال في الفحص التالي
+            self.record_downloads(url, videos, downloaded)
+
+    def poll_once(self, enqueue, enqueue_existing=False):
+        def poll(url):
+            try:
+                new_videos = self.check(url, enqueue_existing)
+            except Exception as e:
+                self.log(f"فشل فحص الاشتراك {url}: {e}")
+                return
+            if new_videos:
+                self.log(f"{len(new_videos)} مرئية جديدة في {self.subscriptions[url]['title'] or url}")
+                enqueue(url, new_videos)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(poll, list(self.subscriptions)))
+        self.save()
+
+    def run_forever(self, interval, enqueue, enqueue_existing=False):
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.poll_once(enqueue, enqueue_existing)
+            stop_event.wait(max(0, interval - (time.monotonic() - started)))
+
+
+def start_download_thread(manager, log=print):
+    # خيط تحميل واحد يستهلك العناصر الجديدة حتى لا يتأخر الفحص الدوري
+    jobs = queue.Queue()
+
+    def worker():
+        while True:
+            url, videos = jobs.get()
+            if url in manager.subscriptions:
+                manager.download(url, videos, log)
+
+    threading.Thread(target=worker, daemon=True).start()
+    return lambda url, videos: jobs.put((url, videos))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="متابعة القنوات وقوائم التشغيل وتحميل الجديد تلقائياً")
+    parser.add_argument("--file", default=SUBSCRIPTIONS_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="إضافة اشتراك")
+    add_parser.add_argument("url")
+    add_parser.add_argument("--dir", default=DEFAULT_DOWNLOAD_DIR)
+    add_parser.add_argument("--quality", default="متوسطة")
+    add_parser.add_argument("--format", default="mp4", choices=["mp4", "mp3"])
+
+    remove_parser = subparsers.add_parser("remove", help="حذف اشتراك")
+    remove_parser.add_argument("url")
+
+    subparsers.add_parser("list", help="عرض الاشتراكات")
+
+    run_parser = subparsers.add_parser("run", help="تشغيل الفحص الدوري")
+    run_parser.add_argument("--interval", type=int, default=3600, help="الفترة بين الفحوص بالثواني")
+    run_parser.add_argument("--head", type=int, default=DEFAULT_HEAD_SIZE, help="عدد العناصر الأولى في الفحص السريع")
+    run_parser.add_argument("--workers", type=int, default=8)
+    run_parser.add_argument("--once", action="store_true", help="فحص واحد ثم الخروج بعد انتهاء التحميل")
+    run_parser.add_argument("--download-existing", action="store_true", help="تحميل العناصر الموجودة عند أول مزامنة")
+
+    args = parser.parse_args(argv)
+    manager = SubscriptionManager(args.file)
+
+    if args.command == "add":
+        manager.add(args.url, args.dir, args.quality, args.format)
+    elif args.command == "remove":
+        if not manager.remove(args.url):
+            print("الاشتراك غير موجود.")
+            return 1
+    elif args.command == "list":
+        for url, subscription in manager.subscriptions.items():
+            print(f"{url}\t{subscription['title'] or ''}\t{subscription.get('known_count', 0)}")
+    elif args.command == "run":
+        manager.head_size = args.head
+        manager.max_workers = args.workers
+        if args.once:
+            pending = []
+            manager.poll_once(lambda url, videos: pending.append((url, videos)), args.download_existing)
+            for url, videos in pending:
+                manager.download(url, videos)
+        else:
+            manager.run_forever(args.interval, start_download_thread(manager), args.download_existing)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
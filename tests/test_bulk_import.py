@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_engine
+from download_engine import bulk_resolve_urls
+
+VIDEO_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class BulkImportTests(unittest.TestCase):
+    def setUp(self):
+        # روابط المرئيات تُحل محلياً، فأي طلب شبكة هنا خطأ
+        patcher = mock.patch.object(download_engine, 'get_videos_info', side_effect=AssertionError("network call"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clip_suffix_and_duplicates(self):
+        result = bulk_resolve_urls(["https://youtu.be/dQw4w9WgXcQ 1:00-2:00",
+                                    f"{VIDEO_URL}&t=10 1:00 - 2:00",
+                                    "  https://youtu.be/dQw4w9WgXcQ  ", ""])
+        self.assertEqual(result["duplicates"], 1)
+        self.assertEqual([video.get("clip") for video in result["videos"]], [[60.0, 120.0], None])
+        self.assertTrue(all(video["title"] == VIDEO_URL for video in result["videos"]))
+
+    def test_unparseable_suffix_fails_the_line_without_network(self):
+        lines = ["https://youtu.be/dQw4w9WgXcQ 90", "https://youtu.be/dQw4w9WgXcQ # note"]
+        result = bulk_resolve_urls(lines)
+        self.assertEqual(result["videos"], [])
+        self.assertEqual([url for url, _ in result["failed"]], lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
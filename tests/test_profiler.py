@@ -0,0 +1,37 @@
+import os
+import sys
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_engine import StageProfiler
+
+
+class StageProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+
+    def test_closing_one_profiler_keeps_tracing_for_the_others(self):
+        first = StageProfiler(os.path.join(self.output_dir, "first"))
+        second = StageProfiler(os.path.join(self.output_dir, "second"))
+        first.close()
+        first.close()
+        with second.stage("download", "item"):
+            pass
+        self.assertTrue(tracemalloc.is_tracing())
+        second.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_does_not_stop_tracing_it_did_not_start(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        StageProfiler(self.output_dir).close()
+        self.assertTrue(tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()
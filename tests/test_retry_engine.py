@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import download_engine
+from download_engine import (
+    HostCircuitBreaker, NetworkPathPool, classify_download_error, load_yt_dlp, run_download_queue
+)
+
+# سياسات بنفس البنية لكن بتأخير قصير حتى تبقى الاختبارات سريعة
+FAST_POLICIES = {
+    name: dict(policy, base_delay=0.05, max_delay=0.1) for name, policy in download_engine.RETRY_POLICIES.items()
+}
+MEDIA_BODY = b'\x00' * 4096
+# عنوان من نطاق التوثيق (TEST-NET-1) لا تملكه أي واجهة محلية، فيفشل الربط عليه كمسار معطل
+UNUSABLE_SOURCE = "192.0.2.1"
+
+
+class FaultHandler(BaseHTTPRequestHandler):
+    # /status/<رمز>/<اسم>: يعيد الرمز دائماً
+    # /flaky/<عدد>/<اسم>: يعيد 503 لأول <عدد> طلبات ثم ينجح
+    # /slow/<اسم>: يتأخر أكثر من مهلة الاتصال
+    # /ok/<اسم>: ملف وسائط صغير
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            self.server.clients.append(self.client_address[0])
+            count = self.server.requests.count(self.path)
+        if parts[0] == 'status':
+            self.send_error(int(parts[1]))
+            return
+        if parts[0] == 'flaky' and count <= int(parts[1]):
+            self.send_error(503)
+            return
+        if parts[0] == 'slow':
+            time.sleep(2)
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(MEDIA_BODY)))
+        self.end_headers()
+        try:
+            self.wfile.write(MEDIA_BODY)
+        except OSError:
+            pass
+
+
+class FaultServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FaultHandler)
+        self.requests = []
+        self.clients = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path, host="127.0.0.1"):
+        return f"http://{host}:{self.server_address[1]}/{path}.mp4"
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class RetryEngineTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FaultServer()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.download_dir, ignore_errors=True)
+        patchers = [
+            mock.patch.dict(download_engine.RETRY_POLICIES, FAST_POLICIES),
+            mock.patch.object(download_engine, 'host_breaker', HostCircuitBreaker(failure_threshold=2, cooldown=0.3)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def capture_error(self, url, **options):
+        yt_dlp = load_yt_dlp()
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'retries': 0, **options}) as ydl:
+            with self.assertRaises(yt_dlp.utils.DownloadError) as context:
+                ydl.extract_info(url, download=False)
+        return context.exception
+
+    def run_queue(self, videos):
+        finished = []
+        logs = []
+        run_download_queue(videos, self.download_dir, "متوسطة", "mp4", False,
+                           settings={"adaptive_fragments": False, "checksums": False},
+                           cancel_event=threading.Event(),
+                           on_log=logs.append,
+                           on_finished=lambda title, ok: finished.append((title, ok)))
+        return finished, logs
+
+    def test_classifies_server_faults(self):
+        for status, expected in ((503, '5xx'), (500, '5xx'), (429, '429'), (403, '403'), (404, 'other')):
+            with self.subTest(status=status):
+                error = self.capture_error(self.server.url(f"status/{status}/classify"))
+                self.assertEqual(classify_download_error(error), expected)
+
+    def test_classifies_timeout(self):
+        error = self.capture_error(self.server.url("slow/classify"), socket_timeout=0.3)
+        self.assertEqual(classify_download_error(error), 'timeout')
+
+    def test_transient_5xx_is_deferred_behind_the_rest_of_the_queue(self):
+        videos = [
+            {"title": "flaky", "url": self.server.url("flaky/1/deferred")},
+            {"title": "first", "url": self.server.url("ok/first")},
+            {"title": "second", "url": self.server.url("ok/second")},
+        ]
+        finished, logs = self.run_queue(videos)
+        self.assertEqual(finished, [("first", True), ("second", True), ("flaky", True)])
+        self.assertTrue(any(message.startswith("تأجيل flaky") for message in logs))
+
+    def test_permanent_error_is_not_retried(self):
+        path = "status/404/permanent"
+        finished, _ = self.run_queue([{"title": "missing", "url": self.server.url(path)}])
+        self.assertEqual(finished, [("missing", False)])
+        self.assertEqual(self.server.requests.count(f"/{path}.mp4"), 1)
+
+    def test_403_does_not_trip_the_breaker(self):
+        videos = [{"title": f"forbidden{index}", "url": self.server.url(f"status/403/forbidden{index}")}
+                  for index in range(3)]
+        self.run_queue(videos)
+        self.assertTrue(download_engine.host_breaker.allow("127.0.0.1"))
+
+    def test_breaker_suspends_failing_host_without_blocking_others(self):
+        videos = [{"title": f"down{index}", "url": self.server.url(f"status/503/down{index}")} for index in range(3)]
+        videos.append({"title": "other-host", "url": self.server.url("ok/other", host="localhost")})
+        finished, logs = self.run_queue(videos)
+        self.assertIn(("other-host", True), finished)
+        self.assertTrue(any("تعليق الطلبات إلى 127.0.0.1" in message for message in logs))
+        # العنصر السليم على المضيف الآخر يكتمل قبل انتهاء محاولات المضيف المعطل
+        self.assertLess(finished.index(("other-host", True)), len(finished) - 1)
+        self.assertTrue(all(not ok for title, ok in finished if title.startswith("down")))
+
+
+class HostCircuitBreakerTests(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = HostCircuitBreaker(failure_threshold=2, cooldown=60)
+        self.assertFalse(breaker.record_failure("a"))
+        self.assertTrue(breaker.allow("a"))
+        self.assertTrue(breaker.record_failure("a"))
+        self.assertFalse(breaker.allow("a"))
+        self.assertTrue(breaker.allow("b"))
+
+    def test_half_open_allows_a_single_probe(self):
+        breaker = HostCircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("a"))
+        self.assertFalse(breaker.allow("a"))
+        self.assertGreater(breaker.retry_at("a"), time.monotonic())
+
+    def test_failed_probe_reopens_and_successful_probe_closes(self):
+        breaker = HostCircuitBreaker(failure_threshold=3, cooldown=0.05)
+        for _ in range(3):
+            breaker.record_failure("a")
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("a"))
+        self.assertTrue(breaker.record_failure("a"))
+        self.assertFalse(breaker.allow("a"))
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("a"))
+        breaker.record_success("a")
+        self.assertTrue(breaker.allow("a"))
+        self.assertTrue(breaker.allow("a"))
+
+    def test_released_probe_lets_the_next_item_probe(self):
+        breaker = HostCircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure("a")
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("a"))
+        breaker.release_probe("a")
+        self.assertTrue(breaker.allow("a"))
+
+
+def loopback_alias_available(address):
+    # لينكس يوجه 127.0.0.0/8 كله إلى lo، أما ماك وويندوز فيحتاجان alias مضافاً يدوياً
+    try:
+        with socket.socket() as sock:
+            sock.bind((address, 0))
+        return True
+    except OSError:
+        return False
+
+
+class NetworkPathPoolTests(unittest.TestCase):
+    def test_unmeasured_and_idle_paths_are_preferred(self):
+        pool = NetworkPathPool(["a", "b"])
+        self.assertEqual(pool.acquire(), "a")
+        self.assertEqual(pool.acquire(), "b")
+        pool.release("a", 4 * download_engine.MIN_SAMPLE_BYTES, 1)
+        pool.release("b", 2 * download_engine.MIN_SAMPLE_BYTES, 1)
+        self.assertEqual(pool.acquire(), "a")
+
+    def test_failed_path_cools_down_with_backoff(self):
+        pool = NetworkPathPool(["a", "b"], cooldown=10)
+        pool.acquire()
+        self.assertEqual(pool.release("a", 0, 0, ok=False), "failed")
+        first_cooldown = pool.paths["a"]["cooldown_until"] - time.monotonic()
+        self.assertEqual(pool.acquire(), "b")
+        self.assertEqual(pool.acquire(), "b")
+        pool.paths["a"]["cooldown_until"] = 0
+        pool.acquire()
+        pool.release("a", 0, 0, ok=False)
+        self.assertGreater(pool.paths["a"]["cooldown_until"] - time.monotonic(), first_cooldown)
+
+    def test_degraded_path_is_paused_and_remeasured(self):
+        pool = NetworkPathPool(["fast", "slow"], cooldown=10)
+        pool.acquire(), pool.acquire()
+        pool.release("fast", 10 * download_engine.MIN_SAMPLE_BYTES, 1)
+        self.assertEqual(pool.release("slow", download_engine.MIN_SAMPLE_BYTES, 1), "degraded")
+        self.assertIsNone(pool.throughput("slow"))
+        self.assertEqual(pool.acquire(), "fast")
+
+    def test_all_paths_cooling_down_falls_back_to_the_earliest(self):
+        pool = NetworkPathPool(["a", "b"], cooldown=10)
+        pool.acquire(), pool.acquire()
+        pool.release("a", 0, 0, ok=False)
+        pool.release("b", 0, 0, ok=False)
+        pool.paths["b"]["cooldown_until"] -= 5
+        self.assertEqual(pool.acquire(), "b")
+
+
+class NetworkPathFailoverTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FaultServer()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        if not loopback_alias_available("127.0.0.2"):
+            self.skipTest("العنوان 127.0.0.2 غير مضاف كـ alias على واجهة loopback")
+        self.download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.download_dir, ignore_errors=True)
+        # مجمع جديد لكل اختبار بدلاً من المجمع المشترك في العملية
+        self.pool = NetworkPathPool([UNUSABLE_SOURCE, "127.0.0.2", "127.0.0.1"])
+        patchers = [
+            mock.patch.dict(download_engine.RETRY_POLICIES, FAST_POLICIES),
+            mock.patch.object(download_engine, 'host_breaker', HostCircuitBreaker(failure_threshold=2, cooldown=0.3)),
+            mock.patch.object(download_engine, 'get_network_pool', return_value=self.pool),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_failed_path_is_skipped_and_items_complete_on_the_aliases(self):
+        videos = [{"title": f"item{index}", "url": self.server.url(f"ok/path{index}")} for index in range(3)]
+        finished = []
+        logs = []
+        run_download_queue(videos, self.download_dir, "متوسطة", "mp4", False,
+                           settings={"adaptive_fragments": False, "checksums": False,
+                                     "network_paths": list(self.pool.paths)},
+                           cancel_event=threading.Event(),
+                           on_log=logs.append,
+                           on_finished=lambda title, ok: finished.append((title, ok)))
+        self.assertEqual(sorted(finished), [(f"item{index}", True) for index in range(3)])
+        self.assertTrue(any(message.startswith(f"فشل المسار {UNUSABLE_SOURCE}") for message in logs))
+        bad = self.pool.paths[UNUSABLE_SOURCE]
+        self.assertEqual(bad["failures"], 1)
+        self.assertGreater(bad["cooldown_until"], time.monotonic())
+        # الطلبات خرجت فعلاً من عنوان الـ alias المختار
+        self.assertIn("127.0.0.2", self.server.clients)
+        for path in ("127.0.0.1", "127.0.0.2"):
+            self.assertEqual(self.pool.paths[path]["failures"], 0)
+            self.assertEqual(self.pool.paths[path]["in_flight"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
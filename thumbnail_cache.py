@@ -0,0 +1,107 @@
+import io
+import os
+import re
+import threading
+import urllib.request
+
+from download_engine import YOUTUBE_ID_RE
+
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "downtube", "thumbnails")
+THUMBNAIL_SIZE = (96, 54)
+THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def thumbnail_url_for(video):
+    if video.get("thumbnail"):
+        return video["thumbnail"]
+    video_id = video.get("id") or ""
+    if YOUTUBE_ID_RE.match(video_id):
+        # mqdefault (320x180) أصغر صورة بنسبة 16:9 بدون أشرطة سوداء
+        return f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+    return None
+
+
+def resize_thumbnail(data, size=THUMBNAIL_SIZE):
+    from PIL import Image # استيراد كسول حتى لا يبطئ الإقلاع
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail(size, Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=80, optimize=True)
+        return output.getvalue()
+
+
+class ThumbnailCache:
+    # ذاكرة تخزين على القرص محدودة الحجم؛ وقت التعديل يُحدّث عند كل قراءة ليعمل كترتيب LRU
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = sum(entry.stat().st_size for entry in self._cached_entries())
+
+    def _cached_entries(self):
+        # ملفات .tmp كتابات جارية من خيوط أخرى لم تُستبدل بعد، فلا تُحسب ولا تُخلى
+        return (entry for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith('.tmp'))
+
+    def path_for(self, video_id):
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', video_id)
+        return os.path.join(self.cache_dir, f"{safe_id}.jpg")
+
+    def get(self, video_id):
+        path = self.path_for(video_id)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, video_id, data):
+        path = self.path_for(video_id)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            # الكتابة فوق صورة موجودة تستبدل حجمها ولا تضيف إليه
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, path)
+            self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # حذف الأقدم استخداماً حتى 90% من الحد لتفادي الإخلاء عند كل إضافة
+        entries = sorted(self._cached_entries(), key=lambda entry: entry.stat().st_mtime)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._total_bytes -= size
+            except OSError:
+                pass
+
+    def fetch(self, video):
+        video_id = video.get("id")
+        if not video_id:
+            return None
+        data = self.get(video_id)
+        if data is not None:
+            return data
+        url = thumbnail_url_for(video)
+        if not url:
+            return None
+        request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            data = resize_thumbnail(response.read(), self.size)
+        self.put(video_id, data)
+        return data